@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""Single-writer actor that owns the traffic aggregator"""
+import concurrent.futures
+import threading
+import time
+import traceback
+from typing import Any, Callable, Dict, List, Optional
+
+from tshark_ingest import IngestQueue
+
+
+class AggregatorActor:
+    """Applies every change to one aggregator from one dedicated thread
+
+    Capture sources hand batches to ingest() and go back to reading packets;
+    reads run as messages too (call()), in order with the batches, so the
+    aggregator is never locked and a reader never sees half a batch. Several
+    sources can feed the graph at once: attach() registers one, and the first
+    source after an idle period starts a fresh aggregator. While any source is
+    attached, on_tick(aggregator, now) runs every `interval` seconds (expiry,
+    deltas, checkpoints) and the packet store counters are republished.
+
+    Before start() and after stop() messages are applied on the caller's thread.
+    """
+
+    def __init__(self, aggregator=None, on_tick: Optional[Callable[[Any, float], None]] = None,
+                 on_replace: Optional[Callable[[Any], None]] = None, interval: float = 0.5,
+                 maxsize: int = 64):
+        self.aggregator = aggregator
+        self.on_tick = on_tick
+        self.on_replace = on_replace
+        self.interval = interval
+        # Messages are whole batches; a full inbox blocks the sources (back-pressure)
+        self.inbox = IngestQueue(maxsize, "block")
+        self.version = 0
+        self.status: Dict[str, Any] = {}
+        self._sources: List[Optional[Callable[[Any], float]]] = []
+        self._snapshot = (-1, None)
+        self._thread: Optional[threading.Thread] = None
+        self._running = False
+
+    @property
+    def running(self) -> bool:
+        return self._running
+
+    def start(self) -> "AggregatorActor":
+        if not self._running:
+            self._running = True
+            self.inbox = IngestQueue(self.inbox.maxsize, "block")
+            self._thread = threading.Thread(target=self._run, name="aggregator", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout: float = 5.0):
+        """Apply everything already queued, then stop the thread"""
+        if self._running:
+            self._running = False
+            self.inbox.close()
+            self._thread.join(timeout)
+        for message in self.inbox.get_batch(0, len(self.inbox)):
+            self._apply(message)
+
+    def ingest(self, method: str, records: List[Any]):
+        """Queue `aggregator.<method>(records)`; records must not be modified afterwards"""
+        self._send(("ingest", method, records))
+
+    def call(self, fn: Callable[[Any], Any], timeout: Optional[float] = None) -> Any:
+        """Return fn(aggregator), run after every message queued before it
+
+        fn runs on the actor thread and may read the aggregator freely, but
+        must not change the graph (snapshots are reused until the next batch).
+        """
+        if not self._running or threading.current_thread() is self._thread:
+            return fn(self.aggregator)
+        future = concurrent.futures.Future()
+        self.inbox.put(("call", fn, future))
+        return future.result(timeout)
+
+    def replace(self, aggregator):
+        """Make aggregator the graph (e.g. one restored from a checkpoint)"""
+        self._send(("replace", None, aggregator))
+
+    def attach(self, start: Callable[[], Any], clock: Optional[Callable[[Any], float]] = None):
+        """Register a capture source
+
+        If no other source is attached, the graph is replaced by start(). Idle
+        entries are aged by wall-clock time while any live source (clock None)
+        is attached, otherwise by clock(aggregator), e.g. a replay's capture time.
+        """
+        def attach(aggregator):
+            if not self._sources:
+                self._replace(start())
+            self._sources.append(clock)
+        self.call(attach)
+
+    def detach(self, clock: Optional[Callable[[Any], float]] = None):
+        """Unregister a source, sending the changes it made since the last tick"""
+        def detach(aggregator):
+            self._tick()
+            self._sources.remove(clock)
+        self.call(detach)
+
+    def snapshot(self) -> Optional[Dict[str, Any]]:
+        """The full graph, rebuilt only when it changed since the last snapshot
+
+        The dict is shared by every reader until the next change and must not be modified.
+        """
+        def build(aggregator):
+            version, graph = self._snapshot
+            if aggregator is None:
+                return None
+            if version != self.version:
+                graph = aggregator._get_visualization_data()
+                self._snapshot = (self.version, graph)
+            return graph
+        return self.call(build)
+
+    def _send(self, message):
+        if self._running:
+            self.inbox.put(message)
+        else:
+            self._apply(message)
+
+    def _run(self):
+        last_tick = time.monotonic()
+        while self._running:
+            timeout = max(self.interval - (time.monotonic() - last_tick), 0)
+            for message in self.inbox.get_batch(timeout, 64):
+                self._apply(message)
+            if time.monotonic() - last_tick >= self.interval:
+                last_tick = time.monotonic()
+                if self._sources:
+                    self._tick()
+
+    def _apply(self, message):
+        kind, method, payload = message
+        if kind == "call":
+            if payload.set_running_or_notify_cancel():
+                try:
+                    payload.set_result(method(self.aggregator))
+                except BaseException as e:
+                    payload.set_exception(e)
+        elif kind == "replace":
+            self._replace(payload)
+        elif self.aggregator is not None:
+            try:
+                getattr(self.aggregator, method)(payload)
+            except Exception:
+                # One bad batch must not stop the graph for every other source
+                traceback.print_exc()
+            self.version += 1
+
+    def _replace(self, aggregator):
+        self.aggregator = aggregator
+        self.version += 1
+        self._publish(aggregator)
+        if self.on_replace is not None:
+            self.on_replace(aggregator)
+
+    def _tick(self):
+        aggregator = self.aggregator
+        if aggregator is None:
+            return
+        clocks = self._sources
+        now = time.time() if not clocks or None in clocks else clocks[0](aggregator)
+        if self.on_tick is not None:
+            try:
+                self.on_tick(aggregator, now)
+            except Exception:
+                traceback.print_exc()
+        self.version += 1
+        self._publish(aggregator)
+
+    def _publish(self, aggregator):
+        # Swapped as a whole, so sources can read it without a round trip
+        self.status = {
+            "hosts": len(aggregator.hosts),
+            "streams": len(aggregator.streams),
+            "malformedPackets": aggregator.malformed_packets,
+            "packetStore": aggregator.packets.stats()
+        }
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""Versioned, checksummed binary checkpoint files and a background checkpoint writer
+
+A checkpoint is a header followed by named sections of bytes:
+
+    magic (8s) | format version (H) | flags (H) | payload length (Q) | CRC-32 of payload (I)
+    payload: per section, name length (B) | name | data length (Q) | data
+
+The payload is zlib-compressed when FLAG_ZLIB is set. What the sections hold is
+up to the writer; the column helpers below pack lists of numbers and strings
+so that they restore without per-item parsing. Encoded checkpoints are
+self-delimiting, so they can also be appended back to back as a log (see
+iter_checkpoints).
+"""
+import array
+import os
+import struct
+import sys
+import threading
+import time
+import zlib
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+MAGIC = b"AWXCKPT\n"
+FORMAT_VERSION = 2  # 2: subnet rollups, packet index and heavy-hitter state
+FLAG_ZLIB = 0x1
+
+_HEADER = struct.Struct("<8sHHQI")
+_SECTION = struct.Struct("<Q")
+
+
+class CheckpointError(ValueError):
+    """A checkpoint file that is not ours, is from another format version, or is damaged"""
+
+
+def encode_checkpoint(sections: Dict[str, bytes], compress: bool = True) -> bytes:
+    parts = []
+    for name, data in sections.items():
+        encoded = name.encode()
+        parts += [bytes([len(encoded)]), encoded, _SECTION.pack(len(data)), data]
+    payload = b"".join(parts)
+    if compress:
+        # Level 1: most of the size win for a fraction of the time
+        payload = zlib.compress(payload, 1)
+    flags = FLAG_ZLIB if compress else 0
+    return _HEADER.pack(MAGIC, FORMAT_VERSION, flags, len(payload), zlib.crc32(payload)) + payload
+
+
+def decode_checkpoint(data: bytes) -> Dict[str, bytes]:
+    if len(data) < _HEADER.size:
+        raise CheckpointError("Checkpoint is truncated")
+    magic, version, flags, length, checksum = _HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise CheckpointError("Not a checkpoint file")
+    if version != FORMAT_VERSION:
+        raise CheckpointError(f"Unsupported checkpoint format version {version}")
+    payload = memoryview(data)[_HEADER.size:]
+    if len(payload) != length or zlib.crc32(payload) != checksum:
+        raise CheckpointError("Checkpoint is damaged (length or checksum mismatch)")
+    if flags & FLAG_ZLIB:
+        payload = memoryview(zlib.decompress(payload))
+
+    sections = {}
+    offset = 0
+    while offset < len(payload):
+        name_length = payload[offset]
+        name = bytes(payload[offset + 1:offset + 1 + name_length]).decode()
+        offset += 1 + name_length
+        size = _SECTION.unpack_from(payload, offset)[0]
+        offset += _SECTION.size
+        sections[name] = bytes(payload[offset:offset + size])
+        offset += size
+    return sections
+
+
+def iter_checkpoints(data: bytes) -> Iterator[Tuple[Dict[str, bytes], int]]:
+    """Decode checkpoints stored back to back, with the encoded size of each
+
+    Stops at a truncated or damaged checkpoint.
+    """
+    view = memoryview(data)
+    offset = 0
+    while offset + _HEADER.size <= len(view):
+        end = offset + _HEADER.size + _HEADER.unpack_from(view, offset)[3]
+        try:
+            sections = decode_checkpoint(view[offset:end])
+        except CheckpointError:
+            # The tail of a log cut short by a crash
+            return
+        yield sections, end - offset
+        offset = end
+
+
+def write_checkpoint(path: str, sections: Dict[str, bytes], compress: bool = True) -> int:
+    """Atomically replace `path` with a checkpoint of `sections`; return its size in bytes"""
+    data = encode_checkpoint(sections, compress)
+    temporary = f"{path}.tmp"
+    with open(temporary, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    # Readers see either the previous checkpoint or this one, never a partial file
+    os.replace(temporary, path)
+    return len(data)
+
+
+def read_checkpoint(path: str) -> Dict[str, bytes]:
+    with open(path, "rb") as f:
+        return decode_checkpoint(f.read())
+
+
+def pack_array(typecode: str, values: Iterable) -> bytes:
+    """Numbers as a little-endian array.array column"""
+    column = array.array(typecode, values)
+    if sys.byteorder == "big":
+        column.byteswap()
+    return column.tobytes()
+
+
+def unpack_array(typecode: str, data: bytes) -> array.array:
+    column = array.array(typecode)
+    column.frombytes(data)
+    if sys.byteorder == "big":
+        column.byteswap()
+    return column
+
+
+def pack_strings(values: Iterable[str]) -> bytes:
+    """NUL-separated strings; values must not contain NUL"""
+    values = list(values)
+    # One leading separator tells a list of one empty string from an empty list
+    return ("\0" + "\0".join(values)).encode() if values else b""
+
+
+def unpack_strings(data: bytes) -> List[str]:
+    return data.decode().split("\0")[1:] if data else []
+
+
+class Checkpointer:
+    """Writes checkpoints every `interval` seconds without stopping ingest
+
+    The caller's build() takes the snapshot (plain section bytes, so it shares
+    nothing with live state); compressing and writing it happen on a writer
+    thread, so ingest only pauses for the snapshot. The process is never
+    forked, which is unsafe next to the server's other threads.
+    """
+
+    def __init__(self, path: str, interval: float = 60.0):
+        self.path = path
+        self.interval = interval
+        self._last = time.monotonic()
+        self._writer: Optional[threading.Thread] = None
+        self.written = 0
+        self.failed = 0
+
+    def maybe_save(self, build: Callable[[], Dict[str, bytes]]) -> bool:
+        """Snapshot and start writing a checkpoint if one is due and none is being written"""
+        self.poll()
+        if self._writer is not None or not self.interval or time.monotonic() - self._last < self.interval:
+            return False
+        self._last = time.monotonic()
+        sections = build()
+        self._writer = threading.Thread(target=self._save_inline, args=(lambda: sections,),
+                                        name="checkpoint", daemon=True)
+        self._writer.start()
+        return True
+
+    def poll(self, block: bool = False):
+        """Reap a finished background checkpoint"""
+        if self._writer is None:
+            return
+        if block:
+            self._writer.join()
+        if not self._writer.is_alive():
+            self._writer = None
+
+    def save(self, build: Callable[[], Dict[str, bytes]]):
+        """Write a checkpoint now, after any running one finishes (for shutdown)"""
+        self.poll(block=True)
+        self._save_inline(build)
+
+    def _save_inline(self, build: Callable[[], Dict[str, bytes]]):
+        started = time.monotonic()
+        try:
+            size = write_checkpoint(self.path, build())
+        except (OSError, RuntimeError) as e:
+            self.failed += 1
+            print(f"Checkpoint to {self.path} failed: {e}", file=sys.stderr)
+            return
+        self.written += 1
+        print(f"Checkpoint written to {self.path} ({size} bytes, {time.monotonic() - started:.2f}s)")
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""Bidirectional 5-tuple flows with incremental TCP analysis"""
+import collections
+from typing import Any, Dict, List, Optional, Tuple
+
+# tcp.flags bits used by the state machine (same values as TCP_FLAG_BITS)
+FIN, SYN, RST, ACK = 0x01, 0x02, 0x04, 0x10
+
+# Sequence number space, for comparisons across wraparound
+SEQ_MOD = 1 << 32
+
+
+class FlowDirection:
+    """Counters and sequence tracking for one direction of a flow"""
+
+    __slots__ = ("packets", "bytes", "next_seq", "last_time", "holes", "fin")
+
+    def __init__(self):
+        self.packets = 0
+        self.bytes = 0
+        self.next_seq: Optional[int] = None  # Sequence number after the highest segment seen
+        self.last_time = 0.0
+        self.holes = 0  # Segments skipped ahead of next_seq and not yet filled
+        self.fin = False
+
+
+class Flow:
+    """One connection, oriented client (initiator) to server
+
+    TCP flows move through SYN_SENT, SYN_RECEIVED, ESTABLISHED, CLOSING and
+    CLOSED (or RESET); flows first seen mid-connection start as ESTABLISHED.
+    Other transports are ACTIVE.
+    """
+
+    __slots__ = ("client_ip", "client_port", "server_ip", "server_port", "transport", "protocol", "state",
+                 "first_seen", "last_seen", "syn_time", "rtt", "retransmissions", "out_of_order",
+                 "to_server", "to_client")
+
+    def __init__(self, client_ip: str, client_port: str, server_ip: str, server_port: str,
+                 transport: str, protocol: str, timestamp: float, state: str):
+        self.client_ip = client_ip
+        self.client_port = client_port
+        self.server_ip = server_ip
+        self.server_port = server_port
+        self.transport = transport
+        self.protocol = protocol
+        self.state = state
+        self.first_seen = timestamp
+        self.last_seen = timestamp
+        self.syn_time: Optional[float] = None
+        self.rtt: Optional[float] = None  # Handshake SYN to ACK, ms
+        self.retransmissions = 0
+        self.out_of_order = 0
+        self.to_server = FlowDirection()
+        self.to_client = FlowDirection()
+
+    @property
+    def id(self) -> str:
+        return f"{self.transport} {self.client_ip} {self.client_port} {self.server_ip} {self.server_port}"
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "client": self.client_ip,
+            "clientPort": self.client_port or None,
+            "server": self.server_ip,
+            "serverPort": self.server_port or None,
+            "transport": self.transport,
+            "protocol": self.protocol,
+            "state": self.state,
+            "start": self.first_seen,
+            "lastSeen": self.last_seen,
+            "duration": self.last_seen - self.first_seen,
+            "packets": self.to_server.packets + self.to_client.packets,
+            "bytes": self.to_server.bytes + self.to_client.bytes,
+            "packetsToServer": self.to_server.packets,
+            "packetsToClient": self.to_client.packets,
+            "bytesToServer": self.to_server.bytes,
+            "bytesToClient": self.to_client.bytes,
+            "rtt": self.rtt,
+            "retransmissions": self.retransmissions,
+            "outOfOrder": self.out_of_order
+        }
+
+    def update_tcp(self, direction: FlowDirection, from_client: bool, flags: int,
+                   seq: Optional[int], tcp_len: Optional[int], timestamp: float):
+        """Advance the state machine and sequence analysis for one segment"""
+        length = tcp_len or 0
+        if flags & (SYN | FIN | RST):
+            state = self.state
+            if flags & RST:
+                self.state = "RESET"
+            elif flags & SYN:
+                if flags & ACK:
+                    if not from_client and state == "SYN_SENT":
+                        self.state = "SYN_RECEIVED"
+                elif from_client and state == "SYN_SENT" and self.syn_time is None:
+                    self.syn_time = timestamp
+            if flags & FIN and self.state != "RESET":
+                direction.fin = True
+                self.state = "CLOSED" if self.to_server.fin and self.to_client.fin else "CLOSING"
+            # SYN and FIN take a sequence number
+            length += (1 if flags & SYN else 0) + (1 if flags & FIN else 0)
+        elif self.state == "SYN_RECEIVED" and from_client and flags & ACK:
+            self.state = "ESTABLISHED"
+            if self.syn_time is not None:
+                self.rtt = timestamp - self.syn_time
+
+        # A bare ACK carries nothing to analyse
+        if seq is None or not length:
+            return
+        expected = direction.next_seq
+        end = (seq + length) % SEQ_MOD
+        if seq == expected:
+            direction.next_seq = end
+        elif expected is None or (seq - expected) % SEQ_MOD < SEQ_MOD // 2:
+            # At or beyond everything seen so far; beyond leaves a hole
+            if expected is not None:
+                direction.holes += 1
+            direction.next_seq = end
+        elif direction.holes and (self.rtt is None or timestamp - direction.last_time < self.rtt):
+            # Fills a gap soon after it opened: reordered rather than resent
+            direction.holes -= 1
+            self.out_of_order += 1
+        else:
+            self.retransmissions += 1
+
+
+class FlowTable:
+    """Flows by canonical 5-tuple, updated in O(1) per packet
+
+    Flows are kept in least recently active order, so idle expiry and the
+    `max_flows` cap only ever look at the oldest ones.
+    """
+
+    def __init__(self, max_flows: int = 100000):
+        self.max_flows = max_flows
+        self.evicted = 0
+        self.flows: "collections.OrderedDict[Tuple[str, str, str, str, str], Flow]" = collections.OrderedDict()
+
+    def add(self, packet: Any) -> Optional[Flow]:
+        """Count a stored packet (DetailedPacket fields) and return its flow"""
+        if not self.max_flows:
+            return None
+        src_ip = packet.sourceIP
+        dst_ip = packet.destinationIP
+        src_port = packet.sourcePort or ""
+        dst_port = packet.destinationPort or ""
+        flags = packet.tcpFlags
+        transport = "tcp" if flags is not None else ("udp" if src_port else "ip")
+        timestamp = packet.timestamp
+
+        if src_ip < dst_ip or (src_ip == dst_ip and src_port <= dst_port):
+            key = (transport, src_ip, src_port, dst_ip, dst_port)
+        else:
+            key = (transport, dst_ip, dst_port, src_ip, src_port)
+        flows = self.flows
+        flow = flows.get(key)
+        if flow is not None and flags is not None and flags & SYN and not flags & ACK \
+                and flow.state in ("CLOSED", "RESET"):
+            # Port reuse: a new connection on the same 5-tuple
+            del flows[key]
+            flow = None
+
+        if flow is None:
+            if flags is None:
+                flow = Flow(src_ip, src_port, dst_ip, dst_port, transport, packet.protocol, timestamp, "ACTIVE")
+            elif flags & SYN and flags & ACK:
+                # Missed the SYN: the sender of the SYN/ACK is the server
+                flow = Flow(dst_ip, dst_port, src_ip, src_port, transport, packet.protocol, timestamp, "SYN_SENT")
+            elif flags & SYN:
+                flow = Flow(src_ip, src_port, dst_ip, dst_port, transport, packet.protocol, timestamp, "SYN_SENT")
+            else:
+                flow = Flow(src_ip, src_port, dst_ip, dst_port, transport, packet.protocol, timestamp, "ESTABLISHED")
+            flows[key] = flow
+            if len(flows) > self.max_flows:
+                flows.popitem(last=False)
+                self.evicted += 1
+        else:
+            flows.move_to_end(key)
+
+        from_client = src_ip == flow.client_ip and src_port == flow.client_port
+        direction = flow.to_server if from_client else flow.to_client
+        direction.packets += 1
+        direction.bytes += packet.length
+        if timestamp > flow.last_seen:
+            flow.last_seen = timestamp
+        if flags is not None:
+            flow.update_tcp(direction, from_client, flags, packet.tcpSeq, packet.tcpLen, timestamp)
+        direction.last_time = timestamp
+        return flow
+
+    def expire(self, cutoff: float) -> int:
+        """Drop flows with no packets since `cutoff` (ms); return how many"""
+        flows = self.flows
+        removed = 0
+        while flows:
+            key, flow = next(iter(flows.items()))
+            if flow.last_seen > cutoff:
+                break
+            del flows[key]
+            removed += 1
+        return removed
+
+    def view(self, ips: Optional[List[str]] = None, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Flows as dicts, most recently active first, optionally only those involving `ips`"""
+        wanted = set(ips) if ips else None
+        result = []
+        for flow in reversed(self.flows.values()):
+            if wanted is not None and flow.client_ip not in wanted and flow.server_ip not in wanted:
+                continue
+            result.append(flow.to_dict())
+            if len(result) == limit:
+                break
+        return result
+
+    def __len__(self) -> int:
+        return len(self.flows)
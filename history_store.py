@@ -0,0 +1,772 @@
+#!/usr/bin/env python3
+"""Append-only, time-segmented on-disk packet history
+
+Packets are appended to segment files in blocks. A block is one checkpoint
+container (length-prefixed, CRC-32, zlib) holding a batch of packets as
+columns, so a segment is a log of blocks and a crash can only cut off its
+tail. A new segment starts every `segment_seconds` or once the current one
+reaches `segment_bytes`. Sealing a segment writes a `.idx` file next to it
+with the segment's min/max packet time and the addresses it holds, which lets
+time-range and host queries skip whole segments, plus the offset and time
+range of every block and per-minute totals of every stream (SegmentRollup).
+graph() answers time-range queries from those totals and decodes packets
+only for the partial minutes at either end; whole hours come from `.hour`
+files holding the totals of the sealed segments' packets in that hour, built
+on first use and rebuilt when the set of segments changes. Segments left
+without an index by a crash are re-indexed on startup.
+"""
+import collections
+import heapq
+import json
+import math
+import os
+import sys
+import threading
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from checkpoint import (CheckpointError, decode_checkpoint, encode_checkpoint, iter_checkpoints, pack_array,
+                        pack_strings, read_checkpoint, unpack_array, unpack_strings, write_checkpoint)
+from tshark_ingest import IngestQueue
+
+SEGMENT_SUFFIX = ".seg"
+INDEX_SUFFIX = ".idx"
+HOUR_SUFFIX = ".hour"
+
+# Fields of the records returned by HistoryStore.records; numbers missing from a packet are -1
+HISTORY_COLUMNS = ("id", "timestamp", "sourceIP", "destinationIP", "protocol", "length",
+                   "sourcePort", "destinationPort", "ttl", "tcpFlags")
+
+MINUTE = 60000  # ms
+HOUR = 60 * MINUTE
+
+# (sourceIP, destinationIP, protocol) -> [packets, bytes, last packet time]
+StreamTotals = Dict[Tuple[str, str, str], List]
+
+_STRING_COLUMNS = ("sourceIP", "destinationIP", "protocol")
+_NUMBER_COLUMNS = {"id": "q", "timestamp": "d", "length": "I", "sourcePort": "i", "destinationPort": "i",
+                   "ttl": "h", "tcpFlags": "h"}
+
+
+def packet_columns(packets: List[Any]) -> Dict[str, list]:
+    """HISTORY_COLUMNS of DetailedPacket-like objects"""
+    return {
+        "id": [packet.id for packet in packets],
+        "timestamp": [packet.timestamp for packet in packets],
+        "sourceIP": [packet.sourceIP for packet in packets],
+        "destinationIP": [packet.destinationIP for packet in packets],
+        "protocol": [packet.protocol for packet in packets],
+        "length": [packet.length for packet in packets],
+        "sourcePort": [int(packet.sourcePort) if packet.sourcePort else -1 for packet in packets],
+        "destinationPort": [int(packet.destinationPort) if packet.destinationPort else -1 for packet in packets],
+        "ttl": [-1 if packet.ttl is None else packet.ttl for packet in packets],
+        "tcpFlags": [-1 if packet.tcpFlags is None else packet.tcpFlags for packet in packets]
+    }
+
+
+def encode_block(columns: Dict[str, list]) -> bytes:
+    # Strings are stored once per block and referenced by index
+    strings: Dict[str, int] = {}
+    sections = {name: pack_array(typecode, columns[name]) for name, typecode in _NUMBER_COLUMNS.items()}
+    for name in _STRING_COLUMNS:
+        sections[name] = pack_array("I", [strings.setdefault(value, len(strings)) for value in columns[name]])
+    sections["strings"] = pack_strings(strings)
+    return encode_checkpoint(sections)
+
+
+def decode_block(sections: Dict[str, bytes]) -> Dict[str, Any]:
+    """The columns of an encode_block block (arrays for numbers, lists for strings)"""
+    strings = unpack_strings(sections["strings"])
+    columns: Dict[str, Any] = {name: unpack_array(typecode, sections[name])
+                               for name, typecode in _NUMBER_COLUMNS.items()}
+    for name in _STRING_COLUMNS:
+        columns[name] = [strings[index] for index in unpack_array("I", sections[name])]
+    return columns
+
+
+class SegmentInfo:
+    """What a segment file holds; times are packet times in ms"""
+
+    __slots__ = ("path", "size", "blocks", "packets", "bytes", "min_time", "max_time", "hosts", "modified",
+                 "rollup")
+
+    def __init__(self, path: str):
+        self.path = path
+        self.size = 0  # Bytes of complete blocks
+        self.blocks = 0
+        self.packets = 0
+        self.bytes = 0
+        self.min_time = math.inf
+        self.max_time = -math.inf
+        self.hosts: Optional[set] = set()  # None in published() copies
+        self.modified = 0.0  # When the segment was sealed (wall clock), for age-based retention
+        self.rollup: Optional[SegmentRollup] = None  # Only while the segment is written
+
+    def add(self, columns: Dict[str, Any], size: int):
+        timestamps = columns["timestamp"]
+        self.size += size
+        self.blocks += 1
+        self.packets += len(timestamps)
+        self.bytes += sum(columns["length"])
+        if timestamps:
+            self.min_time = min(self.min_time, min(timestamps))
+            self.max_time = max(self.max_time, max(timestamps))
+        self.hosts.update(columns["sourceIP"])
+        self.hosts.update(columns["destinationIP"])
+
+    def published(self) -> "SegmentInfo":
+        """A copy for readers of a segment still being written (without its host index)"""
+        info = SegmentInfo(self.path)
+        for name in self.__slots__:
+            setattr(info, name, getattr(self, name))
+        info.hosts = None
+        return info
+
+    def to_index(self) -> Dict[str, bytes]:
+        meta = {"size": self.size, "blocks": self.blocks, "packets": self.packets, "bytes": self.bytes,
+                "minTime": self.min_time, "maxTime": self.max_time}
+        return {"meta": json.dumps(meta).encode(), "hosts": pack_strings(sorted(self.hosts))}
+
+    @classmethod
+    def from_index(cls, path: str, sections: Dict[str, bytes]) -> "SegmentInfo":
+        info = cls(path)
+        meta = json.loads(sections["meta"])
+        info.size = meta["size"]
+        info.blocks = meta["blocks"]
+        info.packets = meta["packets"]
+        info.bytes = meta["bytes"]
+        info.min_time = meta["minTime"]
+        info.max_time = meta["maxTime"]
+        info.hosts = set(unpack_strings(sections["hosts"]))
+        return info
+
+
+def _merge(totals: StreamTotals, other: StreamTotals):
+    for key, (packets, bytes_transferred, last) in other.items():
+        row = totals.get(key)
+        if row is None:
+            totals[key] = [packets, bytes_transferred, last]
+        else:
+            row[0] += packets
+            row[1] += bytes_transferred
+            if last > row[2]:
+                row[2] = last
+
+
+def pack_totals(totals: StreamTotals) -> Dict[str, bytes]:
+    """Stream totals as checkpoint sections, in the order of the dict"""
+    strings: Dict[str, int] = {}
+    rows = list(totals.values())
+    sections = {
+        "streams.packets": pack_array("q", [row[0] for row in rows]),
+        "streams.bytes": pack_array("q", [row[1] for row in rows]),
+        "streams.last": pack_array("d", [row[2] for row in rows])
+    }
+    for position, name in enumerate(("streams.source", "streams.target", "streams.protocol")):
+        sections[name] = pack_array("I", [strings.setdefault(key[position], len(strings)) for key in totals])
+    sections["streams.strings"] = pack_strings(strings)
+    return sections
+
+
+def _stream_keys(sections: Dict[str, bytes]) -> List[Tuple[str, str, str]]:
+    strings = unpack_strings(sections["streams.strings"])
+    return list(zip(*(
+        [strings[index] for index in unpack_array("I", sections[name])]
+        for name in ("streams.source", "streams.target", "streams.protocol"))))
+
+
+def unpack_totals(sections: Dict[str, bytes]) -> StreamTotals:
+    return {key: [packets, bytes_transferred, last] for key, packets, bytes_transferred, last in zip(
+        _stream_keys(sections), unpack_array("q", sections["streams.packets"]),
+        unpack_array("q", sections["streams.bytes"]), unpack_array("d", sections["streams.last"]))}
+
+
+class SegmentRollup:
+    """Block positions and per-minute stream totals of one segment
+
+    While the segment is written, every block's minutes are kept separately
+    (block_minutes) and never changed, so readers can use them without a lock;
+    sealed() merges them.
+    """
+
+    __slots__ = ("offsets", "sizes", "min_times", "max_times", "block_minutes", "_minutes", "totals", "_index")
+
+    def __init__(self):
+        self.offsets: List[int] = []
+        self.sizes: List[int] = []
+        self.min_times: List[float] = []
+        self.max_times: List[float] = []
+        self.block_minutes: List[Dict[int, StreamTotals]] = []
+        self._minutes: Optional[Dict[int, StreamTotals]] = None
+        self.totals: Optional[StreamTotals] = None  # Once sealed
+        self._index: Optional[Dict[str, bytes]] = None  # Minute sections not decoded yet
+
+    @property
+    def minutes(self) -> Optional[Dict[int, StreamTotals]]:
+        """Stream totals by minute, once sealed"""
+        index = self._index
+        if index is not None:
+            # Only segments at the ends of a query range need them
+            self._minutes = self._decode_minutes(index)
+            self._index = None
+        return self._minutes
+
+    def add(self, columns: Dict[str, Any], offset: int, size: int):
+        timestamps = columns["timestamp"]
+        minutes: Dict[int, StreamTotals] = {}
+        for timestamp, source, target, protocol, length in zip(
+                timestamps, columns["sourceIP"], columns["destinationIP"], columns["protocol"], columns["length"]):
+            minute = int(timestamp // MINUTE)
+            bucket = minutes.get(minute)
+            if bucket is None:
+                bucket = minutes[minute] = {}
+            row = bucket.get((source, target, protocol))
+            if row is None:
+                bucket[source, target, protocol] = [1, length, timestamp]
+            else:
+                row[0] += 1
+                row[1] += length
+                if timestamp > row[2]:
+                    row[2] = timestamp
+        self.offsets.append(offset)
+        self.sizes.append(size)
+        self.min_times.append(min(timestamps) if timestamps else math.inf)
+        self.max_times.append(max(timestamps) if timestamps else -math.inf)
+        # Last, so a reader never sees the minutes of a block without its position
+        self.block_minutes.append(minutes)
+
+    def sealed(self) -> "SegmentRollup":
+        rollup = SegmentRollup()
+        rollup.offsets = self.offsets
+        rollup.sizes = self.sizes
+        rollup.min_times = self.min_times
+        rollup.max_times = self.max_times
+        minutes: Dict[int, StreamTotals] = {}
+        for block in self.block_minutes:
+            for minute, bucket in block.items():
+                _merge(minutes.setdefault(minute, {}), bucket)
+        rollup._minutes = minutes
+        rollup.totals = {}
+        for bucket in minutes.values():
+            _merge(rollup.totals, bucket)
+        return rollup
+
+    def buckets(self, first_minute: int, last_minute: int) -> Iterator[StreamTotals]:
+        """Stream totals of every minute in [first_minute, last_minute)"""
+        blocks = [self.minutes] if self.totals is not None else self.block_minutes[:]
+        for minutes in blocks:
+            for minute, bucket in minutes.items():
+                if first_minute <= minute < last_minute:
+                    yield bucket
+
+    def blocks_between(self, start: float, end: float) -> List[Tuple[int, int]]:
+        """(offset, size) of the blocks that may hold packets in [start, end)"""
+        count = len(self.block_minutes) if self.totals is None else len(self.offsets)
+        return [(self.offsets[i], self.sizes[i]) for i in range(count)
+                if self.max_times[i] >= start and self.min_times[i] < end]
+
+    def to_index(self) -> Dict[str, bytes]:
+        # Minute rows refer to streams by their position in the totals
+        streams = {key: index for index, key in enumerate(self.totals)}
+        rows = [(minute, streams[key], row) for minute, bucket in self.minutes.items() for key, row in bucket.items()]
+        sections = pack_totals(self.totals)
+        sections.update({
+            "blocks.offset": pack_array("q", self.offsets),
+            "blocks.size": pack_array("q", self.sizes),
+            "blocks.min": pack_array("d", self.min_times),
+            "blocks.max": pack_array("d", self.max_times),
+            "minutes.minute": pack_array("q", [minute for minute, _, _ in rows]),
+            "minutes.stream": pack_array("I", [stream for _, stream, _ in rows]),
+            "minutes.packets": pack_array("q", [row[0] for _, _, row in rows]),
+            "minutes.bytes": pack_array("q", [row[1] for _, _, row in rows]),
+            "minutes.last": pack_array("d", [row[2] for _, _, row in rows])
+        })
+        return sections
+
+    @classmethod
+    def from_index(cls, sections: Dict[str, bytes]) -> "SegmentRollup":
+        rollup = cls()
+        rollup.offsets = unpack_array("q", sections["blocks.offset"]).tolist()
+        rollup.sizes = unpack_array("q", sections["blocks.size"]).tolist()
+        rollup.min_times = unpack_array("d", sections["blocks.min"]).tolist()
+        rollup.max_times = unpack_array("d", sections["blocks.max"]).tolist()
+        rollup.totals = unpack_totals(sections)
+        rollup._index = {name: data for name, data in sections.items() if name.startswith(("minutes.", "streams."))}
+        return rollup
+
+    @staticmethod
+    def _decode_minutes(sections: Dict[str, bytes]) -> Dict[int, StreamTotals]:
+        keys = _stream_keys(sections)
+        minutes: Dict[int, StreamTotals] = {}
+        for minute, stream, packets, bytes_transferred, last in zip(
+                unpack_array("q", sections["minutes.minute"]), unpack_array("I", sections["minutes.stream"]),
+                unpack_array("q", sections["minutes.packets"]), unpack_array("q", sections["minutes.bytes"]),
+                unpack_array("d", sections["minutes.last"])):
+            bucket = minutes.get(minute)
+            if bucket is None:
+                bucket = minutes[minute] = {}
+            bucket[keys[stream]] = [packets, bytes_transferred, last]
+        return minutes
+
+
+class HistoryStore:
+    """Packet history in segment files under `directory`
+
+    append() only queues a packet; every `block_packets` packets (or after
+    `flush_interval` seconds, see tick()) the batch goes to a writer thread,
+    which encodes it, appends it to the current segment and fsyncs at most
+    every `fsync_interval` seconds. append, tick and close must be called from
+    one thread (the aggregator's). Sealed segments are deleted oldest first
+    while the history exceeds `max_bytes` or they are older than `max_age`
+    seconds (0 disables either limit). The rollups of the `rollup_cache` most
+    recently queried segments and the totals of the `hour_cache` most recently
+    queried hours stay in memory.
+    """
+
+    def __init__(self, directory: str, segment_seconds: float = 300.0, segment_bytes: int = 64 << 20,
+                 max_bytes: int = 0, max_age: float = 0.0, block_packets: int = 4096,
+                 flush_interval: float = 1.0, fsync_interval: float = 1.0, queue_size: int = 64,
+                 rollup_cache: int = 512, hour_cache: int = 168):
+        self.directory = directory
+        self.segment_seconds = segment_seconds
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.block_packets = block_packets
+        self.flush_interval = flush_interval
+        self.fsync_interval = fsync_interval
+        self.blocks_written = 0
+        self.failed = 0
+        # Sealed segments' rollups by path, least recently used first
+        self.rollup_cache = rollup_cache
+        self._rollups: "collections.OrderedDict[str, SegmentRollup]" = collections.OrderedDict()
+        self._rollups_lock = threading.Lock()
+        # Hour -> (segment file names, stream totals); the lock also lets one query build an hour at a time
+        self.hour_cache = hour_cache
+        self._hours: "collections.OrderedDict[int, Tuple[List[str], StreamTotals]]" = collections.OrderedDict()
+        self._hours_lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        # Replaced, never modified, so readers on other threads can iterate them
+        self.segments: List[SegmentInfo] = self._load_segments()  # Sealed, oldest first
+        self.active: Optional[SegmentInfo] = None
+        self._enforce_retention()
+
+        self._pending: List[Any] = []
+        self._last_flush = time.monotonic()
+        # Full batches wait here for the writer; if the disk falls behind, ingest blocks
+        self.inbox = IngestQueue(queue_size, "block")
+        # Writer thread state
+        self._segment: Optional[SegmentInfo] = None
+        self._file = None
+        self._opened = 0.0
+        self._synced = True
+        self._last_sync = 0.0
+        self._thread = threading.Thread(target=self._run, name="history", daemon=True)
+        self._thread.start()
+
+    def append(self, packet: Any):
+        """Queue a stored packet (DetailedPacket) for the history; it must not change afterwards"""
+        pending = self._pending
+        pending.append(packet)
+        if len(pending) >= self.block_packets:
+            self.flush()
+
+    def tick(self):
+        """Hand over a partial block once it has waited `flush_interval` seconds"""
+        if self._pending and time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        if self._pending:
+            self.inbox.put(self._pending)
+            self._pending = []
+        self._last_flush = time.monotonic()
+
+    def close(self, timeout: float = 10.0):
+        """Write everything queued, seal the current segment and stop the writer"""
+        self.flush()
+        self.inbox.put(None)
+        self._thread.join(timeout)
+
+    def segments_between(self, start: Optional[float] = None, end: Optional[float] = None,
+                         ip: Optional[str] = None) -> List[SegmentInfo]:
+        """Segments that may hold packets in [start, end) ms, optionally involving ip, oldest first"""
+        # Active first: if it is sealed in between, it is then among the sealed segments
+        active = self.active
+        segments = self.segments
+        if active is not None and not any(segment.path == active.path for segment in segments[-1:]):
+            segments = segments + [active]
+        return [segment for segment in segments
+                if segment.packets
+                and (start is None or segment.max_time >= start)
+                and (end is None or segment.min_time < end)
+                and (ip is None or segment.hosts is None or ip in segment.hosts)]
+
+    def blocks(self, segment: SegmentInfo) -> Iterator[Dict[str, Any]]:
+        """Decoded columns of every block in a segment (nothing if retention removed it)"""
+        try:
+            with open(segment.path, "rb") as f:
+                data = f.read(segment.size)
+        except OSError:
+            return
+        for sections, _ in iter_checkpoints(data):
+            yield decode_block(sections)
+
+    def records(self, start: Optional[float] = None, end: Optional[float] = None,
+                ip: Optional[str] = None) -> Iterator[tuple]:
+        """HISTORY_COLUMNS tuples of packets in [start, end) ms, optionally to or from ip
+
+        Packets come in write order, segment by segment.
+        """
+        for segment in self.segments_between(start, end, ip):
+            for block in self.blocks(segment):
+                for record in zip(*(block[name] for name in HISTORY_COLUMNS)):
+                    timestamp = record[1]
+                    if ((start is None or timestamp >= start) and (end is None or timestamp < end)
+                            and (ip is None or ip == record[2] or ip == record[3])):
+                        yield record
+
+    def graph(self, start: float, end: float, limit: Optional[int] = None) -> Dict[str, Any]:
+        """The hosts and streams of packets in [start, end) ms
+
+        Hosts are identified by address. With a limit, only the `limit` streams
+        with the most bytes (and their hosts) are returned; host totals still
+        count every stream.
+        """
+        first_minute = math.ceil(start / MINUTE)
+        last_minute = math.floor(end / MINUTE)
+        if first_minute < last_minute:
+            edges = [(start, first_minute * MINUTE), (last_minute * MINUTE, end)]
+        else:
+            first_minute = last_minute = 0
+            edges = [(start, end)]
+        edges = [(edge_start, edge_end) for edge_start, edge_end in edges if edge_start < edge_end]
+        first_hour = math.ceil(first_minute / 60)
+        last_hour = math.floor(last_minute / 60)
+        if first_hour < last_hour:
+            minutes = [(first_minute, first_hour * 60), (last_hour * 60, last_minute)]
+        else:
+            first_hour = last_hour = 0
+            minutes = [(first_minute, last_minute)]
+
+        totals: StreamTotals = {}
+        segments = self.segments_between(start, end)
+        # Only sealed segments are in the hour files; the one being written has a rollup
+        sealed = [segment for segment in segments if segment.rollup is None]
+        for hour in range(first_hour, last_hour):
+            _merge(totals, self._hour_totals(hour, [segment for segment in sealed if
+                                                    segment.max_time >= hour * HOUR
+                                                    and segment.min_time < (hour + 1) * HOUR]))
+        for segment in segments:
+            if segment.rollup is None and segment.min_time >= first_hour * HOUR and segment.max_time < last_hour * HOUR:
+                # Counted in full by the hour files
+                continue
+            ranges = minutes if segment.rollup is None else [(first_minute, last_minute)]
+            rollup = self.rollup(segment)
+            if rollup is None:
+                continue
+            if rollup.totals is not None and any(segment.min_time >= first * MINUTE and segment.max_time < last * MINUTE
+                                                 for first, last in ranges):
+                # Every packet of the segment is in whole minutes of the range
+                _merge(totals, rollup.totals)
+                continue
+            for first, last in ranges:
+                for bucket in rollup.buckets(first, last):
+                    _merge(totals, bucket)
+            for edge_start, edge_end in edges:
+                if segment.max_time >= edge_start and segment.min_time < edge_end:
+                    self._scan(segment, rollup.blocks_between(edge_start, edge_end), edge_start, edge_end, totals)
+        return self._graph(totals, start, end, limit)
+
+    def rollup(self, segment: SegmentInfo) -> Optional[SegmentRollup]:
+        """The rollup of a segment, loaded from its index if needed (None if it is gone)"""
+        if segment.rollup is not None:
+            return segment.rollup
+        with self._rollups_lock:
+            rollup = self._rollups.get(segment.path)
+            if rollup is not None:
+                self._rollups.move_to_end(segment.path)
+                return rollup
+        try:
+            rollup = SegmentRollup.from_index(read_checkpoint(segment.path[:-len(SEGMENT_SUFFIX)] + INDEX_SUFFIX))
+        except (OSError, CheckpointError, KeyError, ValueError):
+            try:
+                rollup = self._index_segment(segment.path)[1]
+            except OSError:
+                return None
+        self._cache_rollup(segment.path, rollup)
+        return rollup
+
+    def _hour_totals(self, hour: int, segments: List[SegmentInfo]) -> StreamTotals:
+        """Stream totals of the packets in one hour of some sealed segments; must not be modified"""
+        sources = [os.path.basename(segment.path) for segment in segments]
+        path = os.path.join(self.directory, f"{hour:08d}{HOUR_SUFFIX}")
+        with self._hours_lock:
+            cached = self._hours.get(hour)
+            if cached is not None and cached[0] == sources:
+                self._hours.move_to_end(hour)
+                return cached[1]
+            totals = None
+            try:
+                sections = read_checkpoint(path)
+                if unpack_strings(sections["sources"]) == sources:
+                    totals = unpack_totals(sections)
+            except (OSError, CheckpointError, KeyError, ValueError):
+                pass
+            if totals is None:
+                totals = {}
+                for segment in segments:
+                    rollup = self.rollup(segment)
+                    if rollup is None:
+                        continue
+                    if segment.min_time >= hour * HOUR and segment.max_time < (hour + 1) * HOUR:
+                        _merge(totals, rollup.totals)
+                    else:
+                        for bucket in rollup.buckets(hour * 60, (hour + 1) * 60):
+                            _merge(totals, bucket)
+                sections = pack_totals(totals)
+                sections["sources"] = pack_strings(sources)
+                try:
+                    write_checkpoint(path, sections)
+                except OSError as e:
+                    print(f"Failed to write history rollup {path}: {e}", file=sys.stderr)
+            self._hours[hour] = (sources, totals)
+            if len(self._hours) > self.hour_cache:
+                self._hours.popitem(last=False)
+            return totals
+
+    def _cache_rollup(self, path: str, rollup: SegmentRollup):
+        with self._rollups_lock:
+            self._rollups[path] = rollup
+            if len(self._rollups) > self.rollup_cache:
+                self._rollups.popitem(last=False)
+
+    def _scan(self, segment: SegmentInfo, blocks: Iterable[Tuple[int, int]], start: float, end: float,
+              totals: StreamTotals):
+        """Add the packets in [start, end) of some of a segment's blocks to totals"""
+        try:
+            with open(segment.path, "rb") as f:
+                for offset, size in blocks:
+                    f.seek(offset)
+                    columns = decode_block(decode_checkpoint(f.read(size)))
+                    for timestamp, source, target, protocol, length in zip(
+                            columns["timestamp"], columns["sourceIP"], columns["destinationIP"],
+                            columns["protocol"], columns["length"]):
+                        if start <= timestamp < end:
+                            row = totals.get((source, target, protocol))
+                            if row is None:
+                                totals[source, target, protocol] = [1, length, timestamp]
+                            else:
+                                row[0] += 1
+                                row[1] += length
+                                if timestamp > row[2]:
+                                    row[2] = timestamp
+        except (OSError, CheckpointError) as e:
+            print(f"Skipping unreadable history segment {segment.path}: {e}", file=sys.stderr)
+
+    @staticmethod
+    def _graph(totals: StreamTotals, start: float, end: float, limit: Optional[int]) -> Dict[str, Any]:
+        hosts: Dict[str, List[int]] = {}
+        for (source, target, _), (packets, bytes_transferred, _) in totals.items():
+            for ip in (source, target):
+                host = hosts.get(ip)
+                if host is None:
+                    hosts[ip] = [packets, bytes_transferred]
+                else:
+                    host[0] += packets
+                    host[1] += bytes_transferred
+        streams = totals.items()
+        if limit is not None and len(totals) > limit:
+            streams = heapq.nlargest(limit, streams, key=lambda item: item[1][1])
+            shown = {ip for (source, target, _), _ in streams for ip in (source, target)}
+        else:
+            shown = hosts
+        return {
+            "from": start,
+            "to": end,
+            "hosts": [{"id": ip, "ip": ip, "packets": hosts[ip][0], "bytesTransferred": hosts[ip][1]}
+                      for ip in shown],
+            "streams": [{"source": source, "target": target, "protocol": protocol, "packets": packets,
+                         "bytes": bytes_transferred, "timestamp": last}
+                        for (source, target, protocol), (packets, bytes_transferred, last) in streams],
+            "totalStreams": len(totals)
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        segments = self.segments_between()
+        return {
+            "segments": len(segments),
+            "bytes": sum(segment.size for segment in segments),
+            "packets": sum(segment.packets for segment in segments),
+            "pending": len(self._pending),
+            "blocksWritten": self.blocks_written,
+            "failed": self.failed,
+            "queue": self.inbox.stats()
+        }
+
+    def _run(self):
+        running = True
+        while running:
+            for batch in self.inbox.get_batch(self.fsync_interval, 16):
+                if batch is None:
+                    running = False
+                    break
+                self._write(batch)
+            self._maintain()
+        self._seal()
+
+    def _write(self, packets: List[Any]):
+        try:
+            columns = packet_columns(packets)
+            data = encode_block(columns)
+            if self._segment is not None and self._segment.size + len(data) > self.segment_bytes:
+                self._seal()
+            if self._segment is None:
+                self._open()
+            self._file.write(data)
+            self._file.flush()
+        except (OSError, ValueError, OverflowError) as e:
+            self.failed += 1
+            print(f"Failed to write {len(packets)} packets to the history: {e}", file=sys.stderr)
+            return
+        self._synced = False
+        self._segment.rollup.add(columns, self._segment.size, len(data))
+        self._segment.add(columns, len(data))
+        self.active = self._segment.published()
+        self.blocks_written += 1
+
+    def _maintain(self):
+        now = time.monotonic()
+        if not self._synced and now - self._last_sync >= self.fsync_interval:
+            self._sync()
+        if self._segment is not None and now - self._opened >= self.segment_seconds:
+            self._seal()
+
+    def _sync(self):
+        try:
+            os.fsync(self._file.fileno())
+        except OSError as e:
+            print(f"Failed to sync {self._segment.path}: {e}", file=sys.stderr)
+        self._synced = True
+        self._last_sync = time.monotonic()
+
+    def _open(self):
+        # Named by creation time, so file names sort oldest first
+        stamp = int(time.time() * 1000)
+        while os.path.exists(os.path.join(self.directory, f"{stamp:013d}{SEGMENT_SUFFIX}")):
+            stamp += 1
+        path = os.path.join(self.directory, f"{stamp:013d}{SEGMENT_SUFFIX}")
+        self._file = open(path, "ab")
+        self._segment = SegmentInfo(path)
+        self._segment.rollup = SegmentRollup()
+        self._opened = time.monotonic()
+
+    def _seal(self):
+        segment = self._segment
+        if segment is None:
+            return
+        self._sync()
+        self._file.close()
+        self._file = None
+        self._segment = None
+        segment.modified = time.time()
+        rollup = segment.rollup.sealed()
+        segment.rollup = None
+        self._write_index(segment, rollup)
+        self._cache_rollup(segment.path, rollup)
+        self.segments = self.segments + [segment]
+        self.active = None
+        self._enforce_retention()
+        # Build the hours this segment completed, including the one before it started, ahead of queries
+        hours = range(int(segment.min_time // HOUR) - 1, int(segment.max_time // HOUR)) if segment.packets else ()
+        for hour in hours:
+            hour_segments = [other for other in self.segments
+                             if other.max_time >= hour * HOUR and other.min_time < (hour + 1) * HOUR]
+            if hour_segments:
+                self._hour_totals(hour, hour_segments)
+
+    @staticmethod
+    def _write_index(segment: SegmentInfo, rollup: SegmentRollup):
+        sections = segment.to_index()
+        sections.update(rollup.to_index())
+        try:
+            write_checkpoint(segment.path[:-len(SEGMENT_SUFFIX)] + INDEX_SUFFIX, sections)
+        except OSError as e:
+            # Rebuilt from the segment itself on the next startup
+            print(f"Failed to index {segment.path}: {e}", file=sys.stderr)
+
+    def _load_segments(self) -> List[SegmentInfo]:
+        segments = []
+        for name in sorted(os.listdir(self.directory)):
+            if not name.endswith(SEGMENT_SUFFIX):
+                continue
+            path = os.path.join(self.directory, name)
+            index_path = path[:-len(SEGMENT_SUFFIX)] + INDEX_SUFFIX
+            try:
+                segment = SegmentInfo.from_index(path, read_checkpoint(index_path))
+            except (OSError, CheckpointError, KeyError, ValueError):
+                segment, rollup = self._index_segment(path)
+                if segment.packets:
+                    print(f"Re-indexed history segment {path} ({segment.packets} packets)")
+                    self._write_index(segment, rollup)
+            if not segment.packets:
+                self._remove(segment)
+                continue
+            segment.modified = os.path.getmtime(path)
+            segments.append(segment)
+        return segments
+
+    @staticmethod
+    def _index_segment(path: str) -> Tuple[SegmentInfo, SegmentRollup]:
+        """Rebuild the index of a segment that was not sealed, from its complete blocks"""
+        segment = SegmentInfo(path)
+        rollup = SegmentRollup()
+        with open(path, "rb") as f:
+            data = f.read()
+        for sections, size in iter_checkpoints(data):
+            columns = decode_block(sections)
+            rollup.add(columns, segment.size, size)
+            segment.add(columns, size)
+        return segment, rollup.sealed()
+
+    def _enforce_retention(self):
+        segments = list(self.segments)
+        total = sum(segment.size for segment in segments)
+        now = time.time()
+        removed = []
+        while segments and ((self.max_bytes and total > self.max_bytes)
+                            or (self.max_age and now - segments[0].modified > self.max_age)):
+            oldest = segments.pop(0)
+            total -= oldest.size
+            self._remove(oldest)
+            removed.append(oldest)
+            with self._rollups_lock:
+                self._rollups.pop(oldest.path, None)
+        self.segments = segments
+        if removed:
+            self._remove_hours(removed)
+
+    def _remove_hours(self, removed: List[SegmentInfo]):
+        """Delete the hour files that counted packets of removed segments"""
+        for name in os.listdir(self.directory):
+            if not name.endswith(HOUR_SUFFIX):
+                continue
+            try:
+                hour = int(name[:-len(HOUR_SUFFIX)])
+            except ValueError:
+                continue
+            if any(segment.max_time >= hour * HOUR and segment.min_time < (hour + 1) * HOUR for segment in removed):
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError as e:
+                    print(f"Failed to remove {name}: {e}", file=sys.stderr)
+
+    @staticmethod
+    def _remove(segment: SegmentInfo):
+        for path in (segment.path, segment.path[:-len(SEGMENT_SUFFIX)] + INDEX_SUFFIX):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print(f"Failed to remove {path}: {e}", file=sys.stderr)
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""Inverted index from packet fields to the streams holding matching stored packets"""
+import functools
+import heapq
+import ipaddress
+import itertools
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from checkpoint import pack_array, unpack_array
+
+# Searchable fields: addresses and ports of either end, DNS query names, HTTP request host and URI
+SEARCH_FIELDS = ("ip", "port", "dnsName", "httpHost", "httpUri")
+
+Term = Tuple[str, str]
+
+
+@functools.lru_cache(maxsize=1 << 16)
+def normalize_ip(ip: str) -> str:
+    """Canonical spelling of an address (IPv6 compressed and lower-cased); other names as given"""
+    try:
+        return ipaddress.ip_address(ip).compressed
+    except ValueError:
+        return ip
+
+
+def normalize(field: str, value: Any) -> str:
+    """The indexed form of a search value: addresses canonical, names lower-cased, DNS names without the root dot"""
+    if field not in SEARCH_FIELDS:
+        raise ValueError(f"Unknown search field {field!r}, expected one of {', '.join(SEARCH_FIELDS)}")
+    if field == "port":
+        return str(int(value))
+    value = str(value).strip()
+    if field == "ip":
+        return normalize_ip(value)
+    if field == "dnsName":
+        return value.rstrip(".").lower()
+    if field == "httpHost":
+        return value.lower()
+    return value
+
+
+def _values(layer: Dict[str, Any], name: str) -> List[str]:
+    # tshark gives a list when a field occurs more than once in a packet
+    value = layer.get(name)
+    if value is None or value == "":
+        return []
+    return value if isinstance(value, list) else [value]
+
+
+def packet_terms(packet: Any) -> Set[Term]:
+    """The distinct (field, value) terms a stored packet (DetailedPacket) is found by"""
+    terms = {("ip", normalize_ip(packet.sourceIP)), ("ip", normalize_ip(packet.destinationIP))}
+    if packet.sourcePort:
+        terms.add(("port", packet.sourcePort))
+    if packet.destinationPort:
+        terms.add(("port", packet.destinationPort))
+    layers = packet.layers
+    if layers:
+        dns = layers.get("dns")
+        if dns:
+            terms.update(("dnsName", name.rstrip(".").lower()) for name in _values(dns, "dns.qry.name"))
+        http = layers.get("http")
+        if http:
+            terms.update(("httpHost", host.lower()) for host in _values(http, "http.host"))
+            terms.update(("httpUri", uri) for uri in _values(http, "http.request.uri"))
+    return terms
+
+
+class PacketIndex:
+    """Streams with stored packets for every search term, with how many packets match
+
+    The index follows a PacketStore: replace() with every packet stored and
+    the one it overwrote, and remove() the packets of every stream the store
+    drops (its on_evict callback), so it never holds more entries than the
+    store holds (term, stream) pairs. search() narrows a query to the streams
+    holding every term and reads the matching packets from their rings,
+    newest first.
+    """
+
+    def __init__(self):
+        self._terms: Dict[Term, Dict[str, int]] = {}
+        self.entries = 0  # (term, stream) pairs
+
+    def add(self, stream_key: str, packet: Any):
+        self._add(stream_key, packet_terms(packet))
+
+    def replace(self, stream_key: str, packet: Any, evicted: Optional[Any]):
+        """Index a stored packet that overwrote `evicted` (None if it did not) in its stream"""
+        terms = packet_terms(packet)
+        if evicted is None:
+            self._add(stream_key, terms)
+            return
+        old = packet_terms(evicted)
+        # Usually the same connection, so the same terms and nothing to change
+        if old != terms:
+            self._remove(stream_key, old - terms)
+            self._add(stream_key, terms - old)
+
+    def remove(self, stream_key: str, packets: Iterable[Any]):
+        """Forget packets that left the store (unknown ones are ignored)"""
+        for packet in packets:
+            self._remove(stream_key, packet_terms(packet))
+
+    def _add(self, stream_key: str, terms: Iterable[Term]):
+        index = self._terms
+        for term in terms:
+            streams = index.get(term)
+            if streams is None:
+                index[term] = {stream_key: 1}
+                self.entries += 1
+            elif stream_key in streams:
+                streams[stream_key] += 1
+            else:
+                streams[stream_key] = 1
+                self.entries += 1
+
+    def _remove(self, stream_key: str, terms: Iterable[Term]):
+        index = self._terms
+        for term in terms:
+            streams = index.get(term)
+            if streams is None or stream_key not in streams:
+                continue
+            if streams[stream_key] > 1:
+                streams[stream_key] -= 1
+                continue
+            del streams[stream_key]
+            self.entries -= 1
+            if not streams:
+                del index[term]
+
+    def search(self, store, query: Dict[str, Any], limit: Optional[int] = 50,
+               before_id: Optional[int] = None) -> Dict[str, Any]:
+        """Stored packets matching every field of query, newest first
+
+        Returns {"packets": [(stream key, packet)], "streams": {stream key:
+        matching packets}, "total": matching packets}; only the `limit`
+        newest packets with an id below `before_id` are included.
+        """
+        terms = {(field, normalize(field, value)) for field, value in query.items() if value not in (None, "")}
+        if not terms:
+            raise ValueError(f"Expected at least one of {', '.join(SEARCH_FIELDS)}")
+        postings = sorted((self._terms.get(term, {}) for term in terms), key=len)
+        if len(postings) == 1:
+            # Exact from the counts alone
+            streams = {key: count for key, count in postings[0].items() if key in store}
+        else:
+            # A stream holding every term may still have no packet holding them all
+            streams = {}
+            for key in postings[0]:
+                if key in store and all(key in other for other in postings[1:]):
+                    count = sum(1 for packet in store[key] if terms <= packet_terms(packet))
+                    if count:
+                        streams[key] = count
+
+        matches = [self._matches(key, store[key], terms, before_id) for key in streams]
+        newest = heapq.merge(*matches, key=lambda match: match[1].id, reverse=True)
+        return {
+            "packets": list(itertools.islice(newest, limit)),
+            "streams": streams,
+            "total": sum(streams.values())
+        }
+
+    @staticmethod
+    def _matches(stream_key: str, ring, terms: Set[Term], before_id: Optional[int]) -> Iterator[Tuple[str, Any]]:
+        for packet in ring.newest_first():
+            if before_id is not None and packet.id >= before_id:
+                continue
+            if terms <= packet_terms(packet):
+                yield stream_key, packet
+
+    def to_sections(self, refs: Callable[[Iterable[Optional[str]]], bytes]) -> Dict[str, bytes]:
+        """The index as checkpoint sections; refs() packs strings (see NetworkTrafficAggregator.to_checkpoint)"""
+        fields, values = zip(*self._terms) if self._terms else ((), ())
+        postings = list(self._terms.values())
+        return {
+            "index.field": refs(fields),
+            "index.value": refs(values),
+            "index.streams": pack_array("I", list(map(len, postings))),
+            "index.stream": refs(itertools.chain.from_iterable(postings)),
+            "index.count": pack_array("I", list(itertools.chain.from_iterable(map(dict.values, postings))))
+        }
+
+    def load_sections(self, sections: Dict[str, bytes], strs: Callable[[str], List[Optional[str]]]):
+        """Restore an empty index from to_sections() sections instead of re-indexing every packet"""
+        keys = strs("index.stream")
+        counts = unpack_array("I", sections["index.count"])
+        offset = 0
+        for field, value, length in zip(strs("index.field"), strs("index.value"),
+                                        unpack_array("I", sections["index.streams"])):
+            self._terms[field, value] = dict(zip(keys[offset:offset + length], counts[offset:offset + length]))
+            offset += length
+        self.entries = offset
+
+    def stats(self) -> Dict[str, int]:
+        return {"terms": len(self._terms), "entries": self.entries}
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""Per-stream storage of recent detailed packets"""
+import collections
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+
+class PacketRing(collections.deque):
+    """Fixed-capacity ring of a stream's most recent packets
+
+    A deque with maxlen, so appending a packet to a full ring drops the
+    oldest one in O(1) inside deque.append itself; PacketStore.add checks
+    for the eviction inline to keep that one C call on its hot path. Use
+    push() to get the evicted packet back. Packets must have increasing
+    integer `id`s for `recent(since_id=...)`.
+    """
+
+    __slots__ = ()
+
+    def __init__(self, capacity: int):
+        super().__init__((), capacity)
+
+    @property
+    def capacity(self) -> int:
+        return self.maxlen
+
+    def push(self, item: Any) -> Optional[Any]:
+        """Store item and return the packet it evicted, if any"""
+        if len(self) < self.maxlen:
+            self.append(item)
+            return None
+        evicted = self[0] if self else item
+        self.append(item)
+        return evicted
+
+    def newest_first(self) -> Iterator[Any]:
+        return reversed(self)
+
+    def recent(self, limit: Optional[int] = None, since_id: Optional[int] = None) -> List[Any]:
+        """Return up to `limit` newest packets with an id above `since_id`, oldest first
+
+        Only the returned packets are visited.
+        """
+        if limit is None and since_id is None:
+            return list(self)
+
+        result = []
+        if limit is not None and limit <= 0:
+            return result
+        for item in reversed(self):
+            if since_id is not None and item.id <= since_id:
+                break
+            result.append(item)
+            if len(result) == limit:
+                break
+        result.reverse()
+        return result
+
+
+# Approximate retained size of one stored DetailedPacket (see tests/bench_aggregator.py bench_memory)
+PACKET_BYTES_ESTIMATE = 250
+
+
+class PacketStore:
+    """Packet rings for every stream under one global packet budget
+
+    Streams are kept in least-recently-used order: storing a packet or reading
+    a stream's details makes it the most recent. Once the total exceeds
+    `max_packets`, the least recently used streams lose all their stored
+    packets (their graph counters are kept) until it fits again. If given,
+    on_evict(stream_key, packets) is told about the packets of every stream
+    that is evicted or popped; add() returns the packet it overwrote.
+    """
+
+    def __init__(self, capacity_per_stream: int = 100, max_packets: int = 1000000,
+                 on_evict: Optional[Callable[[str, Iterable[Any]], None]] = None):
+        self.capacity_per_stream = capacity_per_stream
+        self.max_packets = max_packets
+        self.on_evict = on_evict
+        self.total = 0
+        self.evicted_packets = 0
+        self.evicted_streams = 0
+        self._rings: "collections.OrderedDict[str, PacketRing]" = collections.OrderedDict()
+
+    def add(self, stream_key: str, packet: Any) -> Optional[Any]:
+        """Store packet and return the packet it overwrote in the stream's full ring, if any"""
+        rings = self._rings
+        ring = rings.get(stream_key)
+        if ring is None:
+            ring = rings[stream_key] = PacketRing(self.capacity_per_stream)
+        else:
+            rings.move_to_end(stream_key)
+
+        if len(ring) < ring.maxlen:
+            ring.append(packet)
+            self.total += 1
+            if self.total > self.max_packets:
+                self._evict()
+            return None
+        evicted = ring[0] if ring else packet
+        ring.append(packet)
+        return evicted
+
+    def extend(self, stream_key: str, packets: List[Any]):
+        """Store several packets of a stream at once (oldest first), as when restoring a checkpoint"""
+        rings = self._rings
+        ring = rings.get(stream_key)
+        if ring is None:
+            ring = rings[stream_key] = PacketRing(self.capacity_per_stream)
+        else:
+            rings.move_to_end(stream_key)
+
+        before = len(ring)
+        ring.extend(packets)
+        self.total += len(ring) - before
+        if self.total > self.max_packets:
+            self._evict()
+
+    def get(self, stream_key: str) -> Optional[PacketRing]:
+        """Return a stream's packets and mark it as recently used"""
+        ring = self._rings.get(stream_key)
+        if ring is not None:
+            self._rings.move_to_end(stream_key)
+        return ring
+
+    def pop(self, stream_key: str, default=None) -> Optional[PacketRing]:
+        ring = self._rings.pop(stream_key, None)
+        if ring is None:
+            return default
+        self.total -= len(ring)
+        if self.on_evict is not None:
+            self.on_evict(stream_key, ring)
+        return ring
+
+    def _evict(self):
+        """Drop the coldest streams' packets until the budget is met, never the newest stream"""
+        rings = self._rings
+        while self.total > self.max_packets and len(rings) > 1:
+            stream_key, ring = rings.popitem(last=False)
+            self.total -= len(ring)
+            self.evicted_packets += len(ring)
+            self.evicted_streams += 1
+            if self.on_evict is not None:
+                self.on_evict(stream_key, ring)
+
+    def __contains__(self, stream_key: str) -> bool:
+        return stream_key in self._rings
+
+    def __getitem__(self, stream_key: str) -> PacketRing:
+        return self._rings[stream_key]
+
+    def __len__(self) -> int:
+        return len(self._rings)
+
+    def values(self):
+        return self._rings.values()
+
+    def items(self):
+        """(stream key, ring) pairs, least recently used first"""
+        return self._rings.items()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "packets": self.total,
+            "maxPackets": self.max_packets,
+            "streams": len(self._rings),
+            "estimatedBytes": self.total * PACKET_BYTES_ESTIMATE,
+            "evictedPackets": self.evicted_packets,
+            "evictedStreams": self.evicted_streams
+        }
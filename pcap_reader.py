@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+"""Memory-mapped pcap/pcapng reader for L3/L4 summary fields
+
+Decodes Ethernet/SLL/raw IP, IPv4/IPv6, TCP and UDP headers at fixed offsets
+and yields tuples in tshark_ingest.SUMMARY_FIELDS order, so offline captures
+can be fed to NetworkTrafficAggregator.add_summary without running tshark.
+"""
+import mmap
+import socket
+import struct
+from typing import Iterator, Optional, Tuple
+
+# pcap magic numbers (microsecond and nanosecond timestamps)
+PCAP_MAGIC_US = 0xA1B2C3D4
+PCAP_MAGIC_NS = 0xA1B23C4D
+
+# pcapng block types
+PCAPNG_SHB = 0x0A0D0D0A
+PCAPNG_IDB = 0x00000001
+PCAPNG_SPB = 0x00000003
+PCAPNG_EPB = 0x00000006
+PCAPNG_BYTE_ORDER_MAGIC = 0x1A2B3C4D
+
+# Link-layer header types
+LINKTYPE_NULL = 0
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_LOOP = 108
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_LINUX_SLL2 = 276
+RAW_LINKTYPES = (LINKTYPE_RAW, 12, 14)
+
+ETHERTYPE_IPV4 = 0x0800
+ETHERTYPE_IPV6 = 0x86DD
+VLAN_ETHERTYPES = (0x8100, 0x88A8, 0x9100)
+
+# IPv6 extension headers skipped on the way to the transport header
+IPV6_EXTENSION_HEADERS = (0, 43, 60)
+IPV6_FRAGMENT_HEADER = 44
+
+IP_PROTOCOL_NAMES = {1: "icmp", 6: "tcp", 17: "udp", 58: "icmpv6"}
+
+_u16be = struct.Struct("!H")
+_u32be = struct.Struct("!I")
+
+
+class PcapFormatError(ValueError):
+    pass
+
+
+class PcapReader:
+    """Iterate summary tuples from a pcap or pcapng file
+
+    Each tuple holds (time_epoch, protocols, src, dst, ip_len, ttl,
+    tcp_srcport, tcp_dstport, udp_srcport, udp_dstport, tcp_flags, tcp_seq,
+    tcp_len) with ports as strings and the numeric columns as numbers; tcp_seq
+    is the raw sequence number, where tshark prints a relative one. Frames without an
+    IP header are counted in `skipped`.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.packets = 0
+        self.skipped = 0
+        self._file = open(path, "rb")
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty files cannot be mapped
+            self._file.close()
+            raise PcapFormatError(f"{path} is empty")
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __iter__(self) -> Iterator[Tuple]:
+        for timestamp, linktype, offset, caplen in self.iter_frames():
+            record = decode_frame(self._map, offset, caplen, linktype, timestamp)
+            if record is None:
+                self.skipped += 1
+                continue
+            self.packets += 1
+            yield record
+
+    def iter_frames(self) -> Iterator[Tuple[float, int, int, int]]:
+        """Yield (timestamp, linktype, offset, captured length) for every frame"""
+        if len(self._map) < 4:
+            raise PcapFormatError(f"{self.path} is too short to be a capture file")
+
+        magic = _u32be.unpack_from(self._map, 0)[0]
+        if magic == PCAPNG_SHB:
+            return self._iter_pcapng()
+        return self._iter_pcap()
+
+    def _iter_pcap(self):
+        buf = self._map
+        if len(buf) < 24:
+            raise PcapFormatError(f"{self.path} has a truncated pcap header")
+
+        for endian in ("<", ">"):
+            magic = struct.unpack_from(endian + "I", buf, 0)[0]
+            if magic in (PCAP_MAGIC_US, PCAP_MAGIC_NS):
+                break
+        else:
+            raise PcapFormatError(f"{self.path} is not a pcap or pcapng file")
+
+        divisor = 1e9 if magic == PCAP_MAGIC_NS else 1e6
+        linktype = struct.unpack_from(endian + "I", buf, 20)[0] & 0x0FFFFFFF
+        record_header = struct.Struct(endian + "IIII")
+        end = len(buf)
+        offset = 24
+
+        while offset + 16 <= end:
+            ts_sec, ts_frac, caplen, _ = record_header.unpack_from(buf, offset)
+            offset += 16
+            if offset + caplen > end:
+                break  # Truncated final record
+            yield ts_sec + ts_frac / divisor, linktype, offset, caplen
+            offset += caplen
+
+    def _iter_pcapng(self):
+        buf = self._map
+        end = len(buf)
+        offset = 0
+        endian = "<"
+        interfaces = []
+
+        while offset + 12 <= end:
+            block_type = struct.unpack_from(endian + "I", buf, offset)[0]
+
+            if block_type == PCAPNG_SHB:
+                # Each section header may switch byte order
+                byte_order = struct.unpack_from("<I", buf, offset + 8)[0]
+                endian = "<" if byte_order == PCAPNG_BYTE_ORDER_MAGIC else ">"
+                interfaces = []
+
+            block_length = struct.unpack_from(endian + "I", buf, offset + 4)[0]
+            if block_length < 12 or offset + block_length > end:
+                break  # Truncated or corrupt block
+            body = offset + 8
+
+            if block_type == PCAPNG_IDB:
+                linktype = struct.unpack_from(endian + "H", buf, body)[0]
+                interfaces.append((linktype, self._interface_resolution(buf, body + 8, offset + block_length - 4, endian)))
+            elif block_type == PCAPNG_EPB:
+                # 8 byte header, 20 byte packet header and 4 byte trailing length around the frame
+                if block_length < 32:
+                    raise PcapFormatError(f"{self.path}: enhanced packet block at offset {offset} "
+                                          f"is {block_length} bytes, shorter than its header")
+                interface_id, ts_high, ts_low, caplen = struct.unpack_from(endian + "IIII", buf, body)
+                if caplen > block_length - 32:
+                    raise PcapFormatError(f"{self.path}: enhanced packet block at offset {offset} "
+                                          f"captures {caplen} bytes but holds only {block_length - 32}")
+                if interface_id < len(interfaces):
+                    linktype, resolution = interfaces[interface_id]
+                    yield ((ts_high << 32) | ts_low) / resolution, linktype, body + 20, caplen
+            elif block_type == PCAPNG_SPB and interfaces:
+                # Simple packets carry no timestamp and belong to the first interface
+                orig_len = struct.unpack_from(endian + "I", buf, body)[0]
+                caplen = min(orig_len, block_length - 16)
+                yield 0.0, interfaces[0][0], body + 4, caplen
+
+            offset += block_length
+
+    @staticmethod
+    def _interface_resolution(buf, offset: int, end: int, endian: str) -> float:
+        """Return timestamp units per second from an IDB's if_tsresol option"""
+        while offset + 4 <= end:
+            code, length = struct.unpack_from(endian + "HH", buf, offset)
+            if code == 0:
+                break
+            if code == 9 and length >= 1:
+                tsresol = buf[offset + 4]
+                if tsresol & 0x80:
+                    return float(2 ** (tsresol & 0x7F))
+                return float(10 ** tsresol)
+            offset += 4 + ((length + 3) & ~3)
+        return 1e6
+
+
+def _network_offset(buf, offset: int, caplen: int, linktype: int):
+    """Return (offset, IP version) of the network header, or None if it is not IP"""
+    if linktype == LINKTYPE_ETHERNET:
+        if caplen < 14:
+            return None
+        ethertype = _u16be.unpack_from(buf, offset + 12)[0]
+        header = 14
+        while ethertype in VLAN_ETHERTYPES and header + 4 <= caplen:
+            ethertype = _u16be.unpack_from(buf, offset + header + 2)[0]
+            header += 4
+    elif linktype == LINKTYPE_LINUX_SLL:
+        if caplen < 16:
+            return None
+        ethertype = _u16be.unpack_from(buf, offset + 14)[0]
+        header = 16
+    elif linktype == LINKTYPE_LINUX_SLL2:
+        if caplen < 20:
+            return None
+        ethertype = _u16be.unpack_from(buf, offset)[0]
+        header = 20
+    elif linktype in RAW_LINKTYPES:
+        if caplen < 1:
+            return None
+        version = buf[offset] >> 4
+        return (offset, version) if version in (4, 6) else None
+    elif linktype in (LINKTYPE_NULL, LINKTYPE_LOOP):
+        if caplen < 4:
+            return None
+        # The address family is in host byte order of the capturing machine
+        family = struct.unpack_from("<I", buf, offset)[0]
+        if family > 0xFFFF:
+            family = _u32be.unpack_from(buf, offset)[0]
+        if family == 2:
+            return offset + 4, 4
+        if family in (10, 24, 28, 30):
+            return offset + 4, 6
+        return None
+    else:
+        return None
+
+    if ethertype == ETHERTYPE_IPV4:
+        return offset + header, 4
+    if ethertype == ETHERTYPE_IPV6:
+        return offset + header, 6
+    return None
+
+
+def decode_frame(buf, offset: int, caplen: int, linktype: int, timestamp: float) -> Optional[Tuple]:
+    """Decode the L3/L4 summary of one captured frame, or None if it has no IP header"""
+    network = _network_offset(buf, offset, caplen, linktype)
+    if network is None:
+        return None
+    ip_offset, version = network
+    end = offset + caplen
+
+    if version == 4:
+        if ip_offset + 20 > end:
+            return None
+        header_length = (buf[ip_offset] & 0x0F) * 4
+        ip_len = _u16be.unpack_from(buf, ip_offset + 2)[0]
+        fragment_offset = _u16be.unpack_from(buf, ip_offset + 6)[0] & 0x1FFF
+        ttl = buf[ip_offset + 8]
+        proto = buf[ip_offset + 9]
+        src = socket.inet_ntoa(buf[ip_offset + 12:ip_offset + 16])
+        dst = socket.inet_ntoa(buf[ip_offset + 16:ip_offset + 20])
+        layer = "ip"
+        transport = ip_offset + header_length
+        if fragment_offset:
+            # Only the first fragment carries the transport header
+            transport = None
+    else:
+        if ip_offset + 40 > end:
+            return None
+        ip_len = _u16be.unpack_from(buf, ip_offset + 4)[0] + 40
+        proto = buf[ip_offset + 6]
+        ttl = buf[ip_offset + 7]
+        src = socket.inet_ntop(socket.AF_INET6, buf[ip_offset + 8:ip_offset + 24])
+        dst = socket.inet_ntop(socket.AF_INET6, buf[ip_offset + 24:ip_offset + 40])
+        layer = "ipv6"
+        transport = ip_offset + 40
+        while proto in IPV6_EXTENSION_HEADERS and transport + 8 <= end:
+            proto = buf[transport]
+            transport += (buf[transport + 1] + 1) * 8
+        if proto == IPV6_FRAGMENT_HEADER and transport + 8 <= end:
+            fragment_offset = _u16be.unpack_from(buf, transport + 2)[0] >> 3
+            proto = buf[transport]
+            transport = None if fragment_offset else transport + 8
+
+    protocol_name = IP_PROTOCOL_NAMES.get(proto)
+    protocols = f"{layer}:{protocol_name}" if protocol_name else layer
+    tcp_srcport = tcp_dstport = udp_srcport = udp_dstport = ""
+    tcp_flags = tcp_seq = tcp_len = ""
+
+    if transport is not None:
+        if proto == 6 and transport + 14 <= end:
+            tcp_srcport = str(_u16be.unpack_from(buf, transport)[0])
+            tcp_dstport = str(_u16be.unpack_from(buf, transport + 2)[0])
+            tcp_seq = _u32be.unpack_from(buf, transport + 4)[0]
+            offset_flags = _u16be.unpack_from(buf, transport + 12)[0]
+            tcp_flags = offset_flags & 0x0FFF
+            # Payload is what the IP length leaves after the IP/extension and TCP headers
+            tcp_len = max(ip_len - (transport - ip_offset) - (offset_flags >> 12) * 4, 0)
+        elif proto == 17 and transport + 4 <= end:
+            udp_srcport = str(_u16be.unpack_from(buf, transport)[0])
+            udp_dstport = str(_u16be.unpack_from(buf, transport + 2)[0])
+
+    return (timestamp, protocols, src, dst, ip_len, ttl,
+            tcp_srcport, tcp_dstport, udp_srcport, udp_dstport, tcp_flags, tcp_seq, tcp_len)
+
+
+def read_summaries(path: str) -> Iterator[Tuple]:
+    """Yield a summary tuple for every IP packet in a capture file"""
+    with PcapReader(path) as reader:
+        yield from reader
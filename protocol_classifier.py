@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""Table-driven protocol classification shared by the capture servers"""
+import json
+import os
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+# Application layers that decide the protocol on their own, highest priority first
+LAYER_RULES: Tuple[Tuple[str, str], ...] = (("http", "HTTP"), ("tls", "HTTPS"), ("dns", "DNS"))
+
+# Transport layers, in priority order, with the protocol used when no port rule matches
+TRANSPORTS: Tuple[Tuple[str, str], ...] = (("tcp", "TCP"), ("udp", "UDP"), ("icmp", "ICMP"))
+
+# Well-known ports by transport
+PORT_RULES: Dict[str, Dict[str, str]] = {
+    "tcp": {"80": "HTTP", "443": "HTTPS", "22": "SSH", "21": "FTP", "23": "TELNET"},
+    "udp": {"53": "DNS", "123": "NTP", "67": "DHCP", "68": "DHCP"}
+}
+
+
+class ProtocolClassifier:
+    """Name a packet's protocol from its layers and ports
+
+    Rules are checked in order: application layers (LAYER_RULES), then the
+    first transport present, whose destination and then source port are looked
+    up in its port table. Packets with no known transport are "OTHER". A tshark
+    layer given as None (as the test traffic generator does) counts as absent.
+
+    The rules are compiled into plain if-chains with dict port lookups, so
+    classifying costs the same as a hand-written chain.
+    """
+
+    def __init__(self, layer_rules: Iterable[Tuple[str, str]] = LAYER_RULES,
+                 port_rules: Optional[Dict[str, Dict[str, str]]] = None,
+                 transports: Iterable[Tuple[str, str]] = TRANSPORTS):
+        self.layer_rules = tuple(layer_rules)
+        self.port_rules = {transport: dict(ports) for transport, ports in (port_rules or PORT_RULES).items()}
+        self.transports = tuple(transports)
+        self.classify_packet = self._compile("packet", 'layers = packet["_source"]["layers"]')
+        self.classify_summary = self._compile("layers, tcp_srcport, tcp_dstport, udp_srcport, udp_dstport")
+
+    @classmethod
+    def from_file(cls, path: str) -> "ProtocolClassifier":
+        """Defaults extended by a JSON rules file
+
+        {"layers": [["quic", "QUIC"], ...], "transports": [["sctp", "SCTP"], ...],
+         "ports": {"tcp": {"8080": "HTTP"}, "sctp": {...}}}
+        Layer rules are checked before the defaults and transports after them; port
+        rules add to or replace the defaults.
+        """
+        with open(path) as f:
+            config = json.load(f)
+
+        port_rules = {transport: dict(ports) for transport, ports in PORT_RULES.items()}
+        for transport, ports in config.get("ports", {}).items():
+            port_rules.setdefault(transport, {}).update({str(port): name for port, name in ports.items()})
+        layer_rules = tuple((layer, name) for layer, name in config.get("layers", [])) + LAYER_RULES
+        transports = TRANSPORTS + tuple((layer, name) for layer, name in config.get("transports", []))
+        return cls(layer_rules, port_rules, transports)
+
+    def _compile(self, arguments: str, prologue: str = "") -> Callable[..., str]:
+        """Build the classify function for one input shape
+
+        classify_packet(packet) reads ports from the tshark transport layer;
+        classify_summary(layers, tcp_srcport, tcp_dstport, udp_srcport, udp_dstport)
+        takes frame.protocols layer names and port columns, and only knows tcp/udp ports.
+        """
+        summary = not prologue
+        lines = [f"def classify({arguments}):"]
+        if prologue:
+            lines.append(f"    {prologue}")
+        # Summary layers are a list of names; packet layers a dict that may map a layer to None
+        present = "{!r} in layers" if summary else "layers.get({!r}) is not None"
+        for layer, protocol in self.layer_rules:
+            lines.append(f"    if {present.format(layer)}: return {protocol!r}")
+        namespace: Dict[str, Any] = {}
+        for i, (layer, protocol) in enumerate(self.transports):
+            ports = self.port_rules.get(layer)
+            if ports and summary and layer in ("tcp", "udp"):
+                lines.append(f"    if {present.format(layer)}:")
+                src, dst = f"{layer}_srcport", f"{layer}_dstport"
+            elif ports and not summary:
+                lines.append(f"    fields = layers.get({layer!r})")
+                lines.append("    if fields is not None:")
+                src, dst = f"fields.get({layer + '.srcport'!r})", f"fields.get({layer + '.dstport'!r})"
+            else:
+                lines.append(f"    if {present.format(layer)}:")
+                lines.append(f"        return {protocol!r}")
+                continue
+            namespace[f"ports{i}"] = ports
+            lines.append(f"        return ports{i}.get({dst}) or ports{i}.get({src}) or {protocol!r}")
+        lines.append('    return "OTHER"')
+        exec(compile("\n".join(lines), f"<protocol rules: {arguments}>", "exec"), namespace)
+        return namespace["classify"]
+
+
+def load_classifier(path: Optional[str] = None) -> ProtocolClassifier:
+    """The classifier for `path`, or the PROTOCOL_RULES environment variable, or the defaults"""
+    path = path or os.environ.get("PROTOCOL_RULES")
+    if path:
+        print(f"Loading protocol rules from {path}")
+        return ProtocolClassifier.from_file(path)
+    return ProtocolClassifier()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""Sliding-window packet and byte rates in fixed-size circular buckets"""
+from typing import Dict, List, Tuple
+
+# Windows (seconds) reported by RateCounter.rates
+RATE_WINDOWS = (1, 10, 60)
+
+
+class RateCounter:
+    """Per-second packet/byte counts for the last BUCKETS seconds
+
+    Bucket `second % BUCKETS` holds that second's totals. Advancing to a new
+    second clears only the buckets skipped since the last update, so adding is
+    O(1) amortized and memory is fixed.
+    """
+
+    BUCKETS = max(RATE_WINDOWS)
+
+    __slots__ = ("last_second", "_packets", "_bytes")
+
+    def __init__(self):
+        self.last_second = -1
+        self._packets = [0] * self.BUCKETS
+        self._bytes = [0] * self.BUCKETS
+
+    def add(self, second: int, packets: int, bytes_transferred: int):
+        """Count traffic seen during `second` (integer epoch seconds)"""
+        if second != self.last_second and not self._advance(second):
+            return  # Older than any window
+        index = second % self.BUCKETS
+        self._packets[index] += packets
+        self._bytes[index] += bytes_transferred
+
+    def _advance(self, second: int) -> bool:
+        """Move the ring forward to `second`; False if `second` is too old to record"""
+        last = self.last_second
+        buckets = self.BUCKETS
+        if second < last:
+            return second > last - buckets
+        if second - last >= buckets:
+            self._packets = [0] * buckets
+            self._bytes = [0] * buckets
+        else:
+            for stale in range(last + 1, second + 1):
+                self._packets[stale % buckets] = 0
+                self._bytes[stale % buckets] = 0
+        self.last_second = second
+        return True
+
+    def totals(self, end: int, window: int) -> Tuple[int, int]:
+        """Return (packets, bytes) over the `window` seconds ending with second `end`"""
+        first = max(end - window + 1, self.last_second - self.BUCKETS + 1)
+        packets = bytes_transferred = 0
+        for second in range(first, min(end, self.last_second) + 1):
+            index = second % self.BUCKETS
+            packets += self._packets[index]
+            bytes_transferred += self._bytes[index]
+        return packets, bytes_transferred
+
+    def rates(self, now: float) -> Dict[str, List[float]]:
+        """Packets/s and bytes/s over each of RATE_WINDOWS, counting only completed seconds"""
+        end = int(now) - 1
+        packets_per_second = []
+        bytes_per_second = []
+        for window in RATE_WINDOWS:
+            packets, bytes_transferred = self.totals(end, window)
+            packets_per_second.append(packets / window)
+            bytes_per_second.append(bytes_transferred / window)
+        return {"packetsPerSecond": packets_per_second, "bytesPerSecond": bytes_per_second}
+
+    def idle(self, now: float) -> bool:
+        """True once no window can contain traffic any more"""
+        return int(now) - 1 - self.last_second >= self.BUCKETS
@@ -1,13 +1,34 @@
 #!/usr/bin/env python3
+import array
+import functools
+import gc
+import itertools
 import json
+import math
 import signal
 import subprocess
 import sys
 import time
 import os
+import socket
 from dataclasses import dataclass, field, asdict
-from typing import Dict, List, Optional, Any, Tuple
+from typing import Dict, Iterable, List, Optional, Any, Set, Tuple
 import random
+from collections import Counter, OrderedDict
+
+from aggregator_actor import AggregatorActor
+from checkpoint import CheckpointError, Checkpointer, pack_array, pack_strings, read_checkpoint, unpack_array, unpack_strings
+from flow_table import FlowTable
+from history_store import HistoryStore
+from packet_index import SEARCH_FIELDS, PacketIndex
+from packet_store import PacketStore
+from pcap_reader import PcapReader
+from protocol_classifier import load_classifier
+from rate_counter import RATE_WINDOWS, RateCounter
+from sketches import CountMinSketch, HyperLogLog, SpaceSaving
+from subnet_rollup import SubnetRollup, rollup_level
+from tshark_ingest import (DecodePool, EKDecoder, IngestQueue, IngestStats, ReplayPacer, TsharkReader,
+                           make_decoder, parse_replay_speed, summary_tshark_args)
 
 try:
     from flask import Flask, jsonify, request, send_from_directory, render_template
@@ -29,15 +50,106 @@ socketio = SocketIO(app, cors_allowed_origins=["http://localhost:3001",
                                               "http://localhost:5175"],
                    ping_timeout=60, ping_interval=25)
 
-# Data models
-@dataclass
+# Directory that replayed capture files are resolved against
+CAPTURE_DIR = os.environ.get('CAPTURE_DIR', 'captures')
+
+# Largest number of replayed packets handed to the aggregator at once
+REPLAY_BATCH_SIZE = 1024
+
+# Detailed packets kept across all streams before cold streams are evicted
+MAX_RETAINED_PACKETS = int(os.environ.get('MAX_RETAINED_PACKETS', 1000000))
+
+# Connections tracked in the flow table before the least recently active are dropped (0 disables it)
+MAX_FLOWS = int(os.environ.get('MAX_FLOWS', 100000))
+
+# Checkpoint file for warm restarts (unset disables checkpoints) and seconds between checkpoints
+CHECKPOINT_PATH = os.environ.get('CHECKPOINT_PATH')
+CHECKPOINT_INTERVAL = float(os.environ.get('CHECKPOINT_INTERVAL', 60))
+
+# On-disk packet history directory (unset disables it), when to start a new segment file
+# (seconds, bytes), and how much history to keep (bytes, seconds since sealed; 0 keeps everything)
+HISTORY_DIR = os.environ.get('HISTORY_DIR')
+HISTORY_SEGMENT_SECONDS = float(os.environ.get('HISTORY_SEGMENT_SECONDS', 300))
+HISTORY_SEGMENT_BYTES = int(os.environ.get('HISTORY_SEGMENT_BYTES', 64 << 20))
+HISTORY_MAX_BYTES = int(os.environ.get('HISTORY_MAX_BYTES', 0))
+HISTORY_MAX_AGE = float(os.environ.get('HISTORY_MAX_AGE', 7 * 86400))
+
+# Streams idle for this many seconds are removed, then hosts left without streams (0 keeps everything)
+IDLE_TTL = float(os.environ.get('IDLE_TTL', 600))
+
+# Heavy-hitter mode: keep only this many hosts and streams exactly, the rest under "other" (0 keeps all)
+HEAVY_HITTER_K = int(os.environ.get('HEAVY_HITTER_K', 0))
+
+# Host id and stream key collecting traffic outside the top-K in heavy-hitter mode
+OTHER_HOST_ID = "other"
+OTHER_STREAM_KEY = f"{OTHER_HOST_ID}-{OTHER_HOST_ID}-OTHER"
+
+# Decoded packet details (requestPacketDetails) kept for repeated requests
+DETAIL_CACHE_SIZE = 1024
+
+# Packets per searchPackets reply, by default and at most
+SEARCH_PAGE_SIZE = 50
+MAX_SEARCH_PAGE_SIZE = 1000
+
+# Protocol rules: the defaults, extended by the file named in PROTOCOL_RULES
+PROTOCOL_CLASSIFIER = load_classifier()
+
+# Set on IPv6 index keys so they never collide with IPv4 addresses
+IPV6_KEY_FLAG = 1 << 128
+
+def ip_to_int(ip: str):
+    """Pack an IPv4/IPv6 address string into an integer index key"""
+    try:
+        return int.from_bytes(socket.inet_pton(socket.AF_INET, ip), "big")
+    except OSError:
+        pass
+    try:
+        return int.from_bytes(socket.inet_pton(socket.AF_INET6, ip), "big") | IPV6_KEY_FLAG
+    except OSError:
+        # Not an address (e.g. a resolved name); index it as-is
+        return ip
+
+# Data models are slotted (no per-instance __dict__) where the Python version allows it
+DATACLASS_SLOTS = {"slots": True} if sys.version_info >= (3, 10) else {}
+
+# tcp.flags bits, in the order the tcpFlags dict is sent to clients
+TCP_FLAG_BITS = {"syn": 0x02, "ack": 0x10, "fin": 0x01, "rst": 0x04, "psh": 0x08, "urg": 0x20}
+
+# tshark field names of the individual tcp.flags bits
+TCP_FLAG_FIELDS = {"syn": "tcp.flags.syn", "ack": "tcp.flags.ack", "fin": "tcp.flags.fin",
+                   "rst": "tcp.flags.reset", "psh": "tcp.flags.push", "urg": "tcp.flags.urg"}
+
+@functools.lru_cache(maxsize=1 << 16)
+def distinct_hash(value: str) -> int:
+    """HyperLogLog hash of an address or port, cached since the same values recur"""
+    return HyperLogLog.hash(value)
+
+@functools.lru_cache(maxsize=1 << 16)
+def shared_int(value) -> int:
+    """int() of a small recurring column such as tcp.len, one object per value like sys.intern"""
+    return int(value)
+
+@dataclass(**DATACLASS_SLOTS)
 class NetworkHost:
     id: str
     ip: str
     packets: int = 0
     bytesTransferred: int = 0
+    # Distinct addresses talked to, and destination ports sent to
+    peers: HyperLogLog = field(default_factory=HyperLogLog, repr=False, compare=False)
+    ports: HyperLogLog = field(default_factory=HyperLogLog, repr=False, compare=False)
 
-@dataclass
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "ip": self.ip,
+            "packets": self.packets,
+            "bytesTransferred": self.bytesTransferred,
+            "distinctPeers": self.peers.count(),
+            "distinctPorts": self.ports.count()
+        }
+
+@dataclass(**DATACLASS_SLOTS)
 class NetworkStream:
     source: str
     target: str
@@ -46,9 +158,13 @@ class NetworkStream:
     bytes: int = 0
     timestamp: float = 0.0
     
-@dataclass
+@dataclass(**DATACLASS_SLOTS)
 class DetailedPacket:
-    id: str
+    """A stored packet; strings are shared with hosts or interned, TCP flags are a bitfield
+    
+    Use to_dict() for the shape sent to clients.
+    """
+    id: int
     timestamp: float
     sourceIP: str
     destinationIP: str
@@ -57,11 +173,96 @@ class DetailedPacket:
     ttl: Optional[int] = None
     sourcePort: Optional[str] = None
     destinationPort: Optional[str] = None
-    tcpFlags: Optional[Dict[str, bool]] = None
-    httpInfo: Optional[Dict[str, Any]] = None
-    dnsInfo: Optional[Dict[str, Any]] = None
-    payload: Optional[str] = None
+    tcpFlags: Optional[int] = None  # TCP_FLAG_BITS
+    tcpSeq: Optional[int] = None  # Relative (tshark) or raw (pcap_reader) sequence number
+    tcpLen: Optional[int] = None  # TCP payload bytes
+    layers: Optional[Dict[str, Any]] = None  # Undecoded DETAIL_LAYERS, see decode_detail_layers
     raw_data: Optional[Dict[str, Any]] = None
+    
+    def to_dict(self) -> Dict[str, Any]:
+        tcp_flags = self.tcpFlags
+        http_info, dns_info, payload = decode_detail_layers(self.layers) if self.layers else (None, None, None)
+        return {
+            "id": str(self.id),
+            "timestamp": self.timestamp,
+            "sourceIP": self.sourceIP,
+            "destinationIP": self.destinationIP,
+            "protocol": self.protocol,
+            "length": self.length,
+            "ttl": self.ttl,
+            "sourcePort": self.sourcePort,
+            "destinationPort": self.destinationPort,
+            "tcpFlags": None if tcp_flags is None else {
+                name: bool(tcp_flags & bit) for name, bit in TCP_FLAG_BITS.items()
+            },
+            "tcpSeq": self.tcpSeq,
+            "tcpLen": self.tcpLen,
+            "httpInfo": http_info,
+            "dnsInfo": dns_info,
+            "payload": payload,
+            "raw_data": self.raw_data
+        }
+
+# tshark layers stored as-is with a packet and only decoded when its details are requested
+DETAIL_LAYERS = ("http", "dns", "data")
+
+def decode_detail_layers(layers: Dict[str, Any]) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]], Optional[str]]:
+    """Build (httpInfo, dnsInfo, payload) from a packet's DETAIL_LAYERS"""
+    # Extract HTTP information
+    http_info = None
+    if "http" in layers:
+        http_layer = layers["http"]
+        http_info = {}
+        
+        # HTTP Request
+        if "http.request.method" in http_layer:
+            http_info["method"] = http_layer["http.request.method"]
+            http_info["uri"] = http_layer.get("http.request.uri", "")
+            http_info["host"] = http_layer.get("http.host", "")
+            http_info["userAgent"] = http_layer.get("http.user_agent", "")
+            
+        # HTTP Response
+        elif "http.response" in http_layer or "http.response_code" in http_layer:
+            http_info["statusCode"] = http_layer.get("http.response.code", "")
+            http_info["statusPhrase"] = http_layer.get("http.response.phrase", "")
+            http_info["contentType"] = http_layer.get("http.content_type", "")
+            http_info["contentLength"] = http_layer.get("http.content_length", "")
+            
+        # Common HTTP headers
+        for key, value in http_layer.items():
+            if key.startswith("http.") and key not in ["http.request", "http.response"]:
+                cleaned_key = key.replace("http.", "")
+                http_info[cleaned_key] = value
+                
+    # Extract DNS information
+    dns_info = None
+    if "dns" in layers:
+        dns_layer = layers["dns"]
+        dns_info = {
+            "isResponse": dns_layer.get("dns.flags.response", "0") == "1",
+            "queryName": dns_layer.get("dns.qry.name", ""),
+            "queryType": dns_layer.get("dns.qry.type", ""),
+            "responseCode": dns_layer.get("dns.flags.rcode", "")
+        }
+        
+        # Extract answers if available
+        if "dns.a" in dns_layer:
+            if isinstance(dns_layer["dns.a"], list):
+                dns_info["answers"] = dns_layer["dns.a"]
+            else:
+                dns_info["answers"] = [dns_layer["dns.a"]]
+        
+    # Extract payload if available
+    payload = None
+    if "data" in layers and "data.data" in layers["data"]:
+        hex_data = layers["data"]["data.data"]
+        try:
+            # Try to decode the hex data
+            payload = bytes.fromhex(hex_data).decode('utf-8', errors='replace')
+        except (ValueError, UnicodeDecodeError):
+            payload = f"HEX:{hex_data}"
+    
+    return http_info, dns_info, payload
 
 @dataclass
 class WiresharkData:
@@ -69,62 +270,393 @@ class WiresharkData:
     streams: List[NetworkStream] = field(default_factory=list)
 
 class NetworkTrafficAggregator:
-    def __init__(self):
+    def __init__(self, top_k: int = HEAVY_HITTER_K):
         self.hosts: Dict[str, NetworkHost] = {}
+        self.host_index: Dict[int, NetworkHost] = {}  # Hosts by packed IP (see ip_to_int)
         self.streams: Dict[str, NetworkStream] = {}
         self.host_id_counter = 0
-        self.packets: Dict[str, List[DetailedPacket]] = {}  # Store packets by stream key
-        self.max_packets_per_stream = 100  # Limit packet storage
+        # Recent packets by stream key, under a global budget, and the streams holding them by
+        # address, port, DNS name and HTTP host/URI (see search_packets)
+        self.index = PacketIndex()
+        self.packets = PacketStore(capacity_per_stream=100, max_packets=MAX_RETAINED_PACKETS,
+                                   on_evict=self.index.remove)
         self.packet_id_counter = 0
+        self.malformed_packets = 0  # Skipped by add_packets/add_summaries
+        # Entities changed or removed since the last flush_delta()
+        self._dirty_hosts: Set[str] = set()
+        self._dirty_streams: Set[str] = set()
+        self._removed_hosts: Set[str] = set()
+        self._removed_streams: Set[str] = set()
+        # Idle expiry: streams in least recently active order and the number of streams per host
+        self.idle_ttl = IDLE_TTL
+        self._stream_activity: "OrderedDict[str, None]" = OrderedDict()
+        self._host_streams: Dict[str, int] = {}
+        # Sliding-window rates, kept only while an entity has traffic in the last minute
+        self.host_rates: Dict[str, RateCounter] = {}
+        self.stream_rates: Dict[str, RateCounter] = {}
+        self.last_timestamp = 0.0  # Newest packet time seen, in ms
+        # Subnet totals for level-of-detail views (see view)
+        self.rollup = SubnetRollup()
+        # Connections by 5-tuple with TCP state, handshake RTT and loss counters (see flow_view)
+        self.flows = FlowTable(MAX_FLOWS)
+        # On-disk history every stored packet is also appended to, if any
+        self.history: Optional[HistoryStore] = None
+        # Client dicts of recently requested packets, by packet id, least recently used first
+        self._detail_cache: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+        # Heavy-hitter mode: Space-Saving picks the top_k hosts (by IP) and streams (by key) by bytes,
+        # with Count-Min estimates deciding when a newcomer outweighs the lightest tracked one
+        self.top_k = top_k
+        if top_k:
+            self.host_sketch = CountMinSketch()
+            self.host_hitters = SpaceSaving(top_k, self.host_sketch)
+            self.stream_hitters = SpaceSaving(top_k, CountMinSketch())
 
-    def add_packet(self, packet: Dict[str, Any]) -> Dict[str, Any]:
+    def add_packet(self, packet: Dict[str, Any]) -> str:
+        """Add a tshark packet and return the key of the stream it updated"""
+        return self.add_record(self.extract_record(packet))
+    
+    @classmethod
+    def extract_record(cls, packet: Dict[str, Any]) -> Tuple[str, str, str, int, float, DetailedPacket]:
+        """Parse a tshark packet into the compact record consumed by add_record
+        
+        Needs no aggregator state, so it can run in DecodePool worker processes.
+        """
         ip_layer = packet["_source"]["layers"]["ip"]
         src_ip = ip_layer["ip.src"]
         dst_ip = ip_layer["ip.dst"]
-        protocol = self._get_protocol(packet)
+        protocol = cls._get_protocol(packet)
         bytes_transferred = int(ip_layer["ip.len"])
         timestamp = float(packet["_source"]["layers"]["frame"]["frame.time_epoch"]) * 1000
+        
+        detailed_packet = cls._parse_packet_details(packet, src_ip, dst_ip, bytes_transferred, protocol, timestamp)
+        return src_ip, dst_ip, protocol, bytes_transferred, timestamp, detailed_packet
+    
+    def add_record(self, record: Tuple[str, str, str, int, float, DetailedPacket]) -> str:
+        """Add a packet already parsed by extract_record"""
+        src_ip, dst_ip, protocol, bytes_transferred, timestamp, detailed_packet = record
+
+        stream_key = self._update_counters(src_ip, dst_ip, protocol, bytes_transferred, timestamp,
+                                           detailed_packet.destinationPort)
+        
+        # Number and store detailed packet information
+        self.packet_id_counter += 1
+        detailed_packet.id = self.packet_id_counter
+        self._share_strings(stream_key, detailed_packet)
+        self._store_packet(stream_key, detailed_packet)
+        self.flows.add(detailed_packet)
+        if self.history is not None:
+            self.history.append(detailed_packet)
 
-        # Update hosts
-        src_host = self._get_or_create_host(src_ip)
-        dst_host = self._get_or_create_host(dst_ip)
+        return stream_key
+    
+    def add_summary(self, fields: Tuple[str, ...]) -> str:
+        """Add a packet from a `tshark -T fields` line split into SUMMARY_FIELDS order
+        
+        Numeric columns may also be numbers, as produced by pcap_reader.
+        """
+        return self.add_record(self.summary_record(fields))
+    
+    def add_packets(self, packets: Iterable[Dict[str, Any]]) -> int:
+        """Add a batch of tshark packets and return how many were added"""
+        return self.add_records(self._records(self.extract_record, packets))
+    
+    def add_summaries(self, summaries: Iterable[Tuple[str, ...]]) -> int:
+        """Add a batch of SUMMARY_FIELDS tuples and return how many were added"""
+        return self.add_records(self._records(self.summary_record, summaries))
+    
+    def _records(self, convert, items: Iterable[Any]) -> Iterable[Tuple[str, str, str, int, float, DetailedPacket]]:
+        """convert(item) for every item, skipping and counting malformed packets"""
+        for item in items:
+            try:
+                record = convert(item)
+            except (AttributeError, KeyError, TypeError, ValueError):
+                self.malformed_packets += 1
+                continue
+            yield record
+    
+    def add_records(self, records: Iterable[Tuple[str, str, str, int, float, DetailedPacket]]) -> int:
+        """Add a batch of extract_record/summary_record records in one pass
+        
+        Hosts and the stream are resolved once per (source, destination, protocol)
+        in the batch; later packets of the same conversation only bump counters.
+        """
+        if self.top_k:
+            # Every packet must reach the heavy-hitter sketches
+            count = 0
+            for record in records:
+                self.add_record(record)
+                count += 1
+            return count
+        
+        conversations = {}
+        try:
+            return self._add_conversations(records, conversations)
+        finally:
+            # Even if the batch stopped early, rates and subnets must match the stream totals
+            activity = self._stream_activity
+            for conversation in sorted(conversations.values(), key=lambda conversation: conversation[1].timestamp):
+                self._count_rates(conversation)
+                # Later packets in the batch moved lastSeen, so expire() must see the stream as active again
+                activity.move_to_end(conversation[0])
+    
+    def _add_conversations(self, records: Iterable[Tuple[str, str, str, int, float, DetailedPacket]],
+                           conversations: Dict[Tuple[str, str, str], list]) -> int:
+        history = self.history
+        count = 0
+        for src_ip, dst_ip, protocol, bytes_transferred, timestamp, detailed_packet in records:
+            conversation = conversations.get((src_ip, dst_ip, protocol))
+            if conversation is None:
+                # First packet of this conversation in the batch also marks it dirty
+                stream_key = self._update_counters(src_ip, dst_ip, protocol, bytes_transferred, timestamp,
+                                                   detailed_packet.destinationPort)
+                stream = self.streams[stream_key]
+                src_host = self.hosts[stream.source]
+                dst_host = self.hosts[stream.target]
+                # Later packets' rate counts are summed per second before reaching the counters
+                conversation = [stream_key, stream, src_host, dst_host, int(timestamp // 1000), 0, 0]
+                conversations[src_ip, dst_ip, protocol] = conversation
+            else:
+                stream_key, stream, src_host, dst_host, second, _, _ = conversation
+                src_host.packets += 1
+                dst_host.packets += 1
+                src_host.bytesTransferred += bytes_transferred
+                dst_host.bytesTransferred += bytes_transferred
+                stream.packets += 1
+                stream.bytes += bytes_transferred
+                stream.timestamp = timestamp
+                if timestamp > self.last_timestamp:
+                    self.last_timestamp = timestamp
+                
+                if int(timestamp // 1000) != second:
+                    self._count_rates(conversation)
+                    conversation[4] = int(timestamp // 1000)
+                conversation[5] += 1
+                conversation[6] += bytes_transferred
+                if detailed_packet.destinationPort:
+                    src_host.ports.add_hash(distinct_hash(detailed_packet.destinationPort))
+            
+            self.packet_id_counter += 1
+            detailed_packet.id = self.packet_id_counter
+            detailed_packet.sourceIP = src_host.ip
+            detailed_packet.destinationIP = dst_host.ip
+            self._store_packet(stream_key, detailed_packet)
+            self.flows.add(detailed_packet)
+            if history is not None:
+                history.append(detailed_packet)
+            count += 1
+        return count
+    
+    def _count_rates(self, conversation: list):
+        """Add a batch conversation's pending per-second counts to its rate counters"""
+        stream_key, stream, src_host, dst_host, second, packets, bytes_transferred = conversation
+        if packets:
+            self._add_rates(stream_key, src_host.id, dst_host.id, second, packets, bytes_transferred)
+            self.rollup.count(stream_key, packets, bytes_transferred, stream.timestamp)
+            conversation[5] = conversation[6] = 0
+    
+    def _add_rates(self, stream_key: str, src_id: str, dst_id: str, second: int,
+                   packets: int, bytes_transferred: int):
+        stream_rates = self.stream_rates
+        host_rates = self.host_rates
+        counter = stream_rates.get(stream_key) or stream_rates.setdefault(stream_key, RateCounter())
+        counter.add(second, packets, bytes_transferred)
+        counter = host_rates.get(src_id) or host_rates.setdefault(src_id, RateCounter())
+        counter.add(second, packets, bytes_transferred)
+        counter = host_rates.get(dst_id) or host_rates.setdefault(dst_id, RateCounter())
+        counter.add(second, packets, bytes_transferred)
+    
+    @classmethod
+    def summary_record(cls, fields: Tuple[str, ...]) -> Tuple[str, str, str, int, float, DetailedPacket]:
+        """Build an add_record record from a SUMMARY_FIELDS tuple"""
+        (time_epoch, protocols, src_ip, dst_ip, ip_len, ttl,
+         tcp_srcport, tcp_dstport, udp_srcport, udp_dstport, tcp_flags, tcp_seq, tcp_len) = fields
+        
+        protocol = cls._get_summary_protocol(protocols.split(":"), tcp_srcport, tcp_dstport, udp_srcport, udp_dstport)
+        bytes_transferred = int(ip_len)
+        timestamp = float(time_epoch) * 1000
+        
+        src_port = tcp_srcport or udp_srcport
+        dst_port = tcp_dstport or udp_dstport
+        
+        return src_ip, dst_ip, protocol, bytes_transferred, timestamp, DetailedPacket(
+            id=0,
+            timestamp=timestamp,
+            sourceIP=src_ip,
+            destinationIP=dst_ip,
+            protocol=protocol,
+            length=bytes_transferred,
+            ttl=int(ttl) if ttl else None,
+            sourcePort=sys.intern(src_port) if src_port else None,
+            destinationPort=sys.intern(dst_port) if dst_port else None,
+            tcpFlags=cls._decode_tcp_flags(tcp_flags) if tcp_flags != "" else None,
+            tcpSeq=int(tcp_seq) if tcp_seq != "" else None,
+            tcpLen=shared_int(tcp_len) if tcp_len != "" else None
+        )
+    
+    def _update_counters(self, src_ip: str, dst_ip: str, protocol: str,
+                         bytes_transferred: int, timestamp: float, dst_port: Optional[str] = None) -> str:
+        """Update host and stream totals for one packet and return its stream key"""
+        if self.top_k:
+            src_host, dst_host, stream_key = self._route_heavy_hitter(src_ip, dst_ip, protocol, bytes_transferred)
+        else:
+            src_host = self._get_or_create_host(src_ip)
+            dst_host = self._get_or_create_host(dst_ip)
+            stream_key = f"{src_host.id}-{dst_host.id}-{protocol}"
 
         src_host.packets += 1
         dst_host.packets += 1
         src_host.bytesTransferred += bytes_transferred
         dst_host.bytesTransferred += bytes_transferred
 
+        if dst_port:
+            src_host.ports.add_hash(distinct_hash(dst_port))
+        
         # Update stream
-        stream_key = f"{src_host.id}-{dst_host.id}-{protocol}"
-        if stream_key not in self.streams:
-            self.streams[stream_key] = NetworkStream(
-                source=src_host.id,
-                target=dst_host.id,
-                protocol=protocol,
-                packets=0,
-                bytes=0,
-                timestamp=timestamp
-            )
-            
-        stream = self.streams[stream_key]
+        stream = self.streams.get(stream_key)
+        if stream is None or self.top_k:
+            # Only a new stream can bring a new peer, except in heavy-hitter mode where peers share "other"
+            src_host.peers.add_hash(distinct_hash(dst_ip))
+            dst_host.peers.add_hash(distinct_hash(src_ip))
+        if stream is None:
+            stream = self._create_stream(stream_key, src_host.id, dst_host.id, protocol, timestamp)
         stream.packets += 1
         stream.bytes += bytes_transferred
         stream.timestamp = timestamp
+        if timestamp > self.last_timestamp:
+            self.last_timestamp = timestamp
         
-        # Create and store detailed packet information
-        detailed_packet = self._extract_packet_details(packet, src_ip, dst_ip, bytes_transferred, protocol, timestamp)
+        self._stream_activity.move_to_end(stream_key)
+        self._add_rates(stream_key, src_host.id, dst_host.id, int(timestamp // 1000), 1, bytes_transferred)
+        self.rollup.count(stream_key, 1, bytes_transferred, timestamp)
         
-        # Store packet by stream key with limit
-        if stream_key not in self.packets:
-            self.packets[stream_key] = []
-            
-        self.packets[stream_key].append(detailed_packet)
+        self._dirty_hosts.add(src_host.id)
+        self._dirty_hosts.add(dst_host.id)
+        self._dirty_streams.add(stream_key)
+        return stream_key
+    
+    def _create_stream(self, stream_key: str, source: str, target: str, protocol: str,
+                       timestamp: float) -> NetworkStream:
+        stream = self.streams[stream_key] = NetworkStream(
+            source=source,
+            target=target,
+            protocol=protocol,
+            packets=0,
+            bytes=0,
+            timestamp=timestamp
+        )
+        self._host_streams[source] = self._host_streams.get(source, 0) + 1
+        self._host_streams[target] = self._host_streams.get(target, 0) + 1
+        self._stream_activity[stream_key] = None
+        self.rollup.add_stream(stream_key, source, target, protocol)
+        return stream
+    
+    def _route_heavy_hitter(self, src_ip: str, dst_ip: str, protocol: str,
+                            bytes_transferred: int) -> Tuple[NetworkHost, NetworkHost, str]:
+        """Resolve a packet's hosts and stream key in heavy-hitter mode
         
-        # Enforce packet storage limit
-        if len(self.packets[stream_key]) > self.max_packets_per_stream:
-            self.packets[stream_key].pop(0)  # Remove oldest packet
-
-        return self._get_visualization_data()
+        Hosts outside the top-K count towards the "other" host. Streams outside the
+        top-K, and all traffic between two untracked hosts, go to the "other" stream.
+        """
+        src_host = self._heavy_hitter_host(src_ip, bytes_transferred)
+        dst_host = self._heavy_hitter_host(dst_ip, bytes_transferred)
+        if src_host.id not in self.hosts:
+            # Pushed out of the top-K by the destination
+            src_host = self._other_host()
+        if src_host.id == OTHER_HOST_ID and dst_host.id == OTHER_HOST_ID:
+            return src_host, dst_host, self._other_stream()
+        
+        stream_key = f"{src_host.id}-{dst_host.id}-{protocol}"
+        tracked, evicted = self.stream_hitters.offer(stream_key, bytes_transferred)
+        if evicted is not None:
+            self._fold_stream(evicted)
+        if not tracked:
+            stream_key = self._other_stream()
+        return src_host, dst_host, stream_key
+    
+    def _heavy_hitter_host(self, ip: str, bytes_transferred: int) -> NetworkHost:
+        tracked, evicted = self.host_hitters.offer(ip, bytes_transferred)
+        if evicted is not None:
+            self._fold_host(evicted)
+        return self._get_or_create_host(ip) if tracked else self._other_host()
+    
+    def _other_host(self) -> NetworkHost:
+        host = self.hosts.get(OTHER_HOST_ID)
+        if host is None:
+            # Not in host_index, so no address can resolve to it
+            host = self.hosts[OTHER_HOST_ID] = NetworkHost(id=OTHER_HOST_ID, ip=OTHER_HOST_ID)
+            self.rollup.add_host(OTHER_HOST_ID, OTHER_HOST_ID)
+        return host
+    
+    def _other_stream(self) -> str:
+        if OTHER_STREAM_KEY not in self.streams:
+            self._other_host()
+            self._create_stream(OTHER_STREAM_KEY, OTHER_HOST_ID, OTHER_HOST_ID, "OTHER", self.last_timestamp)
+        return OTHER_STREAM_KEY
+    
+    def _fold_host(self, ip: str):
+        """Move a host that left the top-K, and its streams, into the "other" host"""
+        host = self.host_index.get(ip_to_int(ip))
+        if host is None:
+            return
+        other = self._other_host()
+        other.packets += host.packets
+        other.bytesTransferred += host.bytesTransferred
+        other.peers.merge(host.peers)
+        other.ports.merge(host.ports)
+        self._dirty_hosts.add(OTHER_HOST_ID)
+        for stream_key in [key for key, stream in self.streams.items()
+                           if stream.source == host.id or stream.target == host.id]:
+            self._fold_stream(stream_key)
+        self._remove_host(host.id)
+    
+    def _fold_stream(self, stream_key: str):
+        """Move a stream that left the top-K into the "other" stream"""
+        stream = self.streams.get(stream_key)
+        if stream is None:
+            return
+        other = self.streams[self._other_stream()]
+        other.packets += stream.packets
+        other.bytes += stream.bytes
+        other.timestamp = max(other.timestamp, stream.timestamp)
+        self.rollup.count(OTHER_STREAM_KEY, stream.packets, stream.bytes, stream.timestamp)
+        self._dirty_streams.add(OTHER_STREAM_KEY)
+        self._remove_stream(stream_key)
+    
+    def estimated_host_bytes(self, ip: str) -> Optional[int]:
+        """Heavy-hitter mode: bytes sent or received by any host, approximate outside the top-K"""
+        if not self.top_k:
+            host = self.host_index.get(ip_to_int(ip))
+            return host.bytesTransferred if host is not None else None
+        return self.host_hitters.counts.get(ip) or self.host_sketch.estimate(ip)
+    
+    def _share_strings(self, stream_key: str, detailed_packet: DetailedPacket):
+        """Point the packet's addresses at its hosts' strings instead of per-packet copies"""
+        stream = self.streams[stream_key]
+        source_ip = self.hosts[stream.source].ip
+        if source_ip == detailed_packet.sourceIP:  # Not the case for "other" in heavy-hitter mode
+            detailed_packet.sourceIP = source_ip
+        destination_ip = self.hosts[stream.target].ip
+        if destination_ip == detailed_packet.destinationIP:
+            detailed_packet.destinationIP = destination_ip
+    
+    @property
+    def max_packets_per_stream(self) -> int:
+        """Limit packet storage per stream"""
+        return self.packets.capacity_per_stream
+    
+    @max_packets_per_stream.setter
+    def max_packets_per_stream(self, value: int):
+        self.packets.capacity_per_stream = value
+    
+    def _store_packet(self, stream_key: str, detailed_packet: DetailedPacket):
+        # A full stream drops its oldest packet; over budget, the coldest streams drop theirs
+        self.index.replace(stream_key, detailed_packet, self.packets.add(stream_key, detailed_packet))
+    
+    @staticmethod
+    def _decode_tcp_flags(tcp_flags) -> int:
+        """Return the TCP_FLAG_BITS of a tshark tcp.flags value such as "0x0018" (or its integer)"""
+        value = tcp_flags if isinstance(tcp_flags, int) else int(tcp_flags, 16)
+        return value & 0x3F
     
     def _extract_packet_details(self, packet: Dict[str, Any], 
                                src_ip: str = None, dst_ip: str = None, 
@@ -133,97 +665,59 @@ class NetworkTrafficAggregator:
                                timestamp: float = None) -> DetailedPacket:
         """Extract detailed information about the packet for deeper inspection"""
         self.packet_id_counter += 1
+        detailed_packet = self._parse_packet_details(packet, src_ip, dst_ip, bytes_transferred, protocol, timestamp)
+        detailed_packet.id = self.packet_id_counter
+        return detailed_packet
+    
+    @classmethod
+    def _parse_packet_details(cls, packet: Dict[str, Any], 
+                              src_ip: str = None, dst_ip: str = None, 
+                              bytes_transferred: int = None, 
+                              protocol: str = None, 
+                              timestamp: float = None) -> DetailedPacket:
+        """Build an unnumbered DetailedPacket from the packet's layers"""
         layers = packet["_source"]["layers"]
         
         # Use provided values or extract from packet
         src_ip = src_ip or layers["ip"]["ip.src"]
         dst_ip = dst_ip or layers["ip"]["ip.dst"]
         bytes_transferred = bytes_transferred or int(layers["ip"]["ip.len"])
-        protocol = protocol or self._get_protocol(packet)
+        protocol = protocol or cls._get_protocol(packet)
         timestamp = timestamp or float(layers["frame"]["frame.time_epoch"]) * 1000
         
         # Extract TTL if available
         ttl = int(layers["ip"].get("ip.ttl", 0)) if "ip.ttl" in layers["ip"] else None
         
-        # Extract port information
+        # Extract port information (a layer given as None counts as absent)
         src_port = None
         dst_port = None
-        if "tcp" in layers:
-            src_port = layers["tcp"].get("tcp.srcport")
-            dst_port = layers["tcp"].get("tcp.dstport")
-        elif "udp" in layers:
-            src_port = layers["udp"].get("udp.srcport")
-            dst_port = layers["udp"].get("udp.dstport")
-            
-        # Extract TCP flags
-        tcp_flags = None
-        if "tcp" in layers:
-            tcp_layer = layers["tcp"]
-            tcp_flags = {
-                "syn": tcp_layer.get("tcp.flags.syn") == "1",
-                "ack": tcp_layer.get("tcp.flags.ack") == "1", 
-                "fin": tcp_layer.get("tcp.flags.fin") == "1",
-                "rst": tcp_layer.get("tcp.flags.reset") == "1",
-                "psh": tcp_layer.get("tcp.flags.push") == "1",
-                "urg": tcp_layer.get("tcp.flags.urg") == "1"
-            }
-            
-        # Extract HTTP information
-        http_info = None
-        if "http" in layers:
-            http_layer = layers["http"]
-            http_info = {}
-            
-            # HTTP Request
-            if "http.request.method" in http_layer:
-                http_info["method"] = http_layer["http.request.method"]
-                http_info["uri"] = http_layer.get("http.request.uri", "")
-                http_info["host"] = http_layer.get("http.host", "")
-                http_info["userAgent"] = http_layer.get("http.user_agent", "")
-                
-            # HTTP Response
-            elif "http.response" in http_layer or "http.response_code" in http_layer:
-                http_info["statusCode"] = http_layer.get("http.response.code", "")
-                http_info["statusPhrase"] = http_layer.get("http.response.phrase", "")
-                http_info["contentType"] = http_layer.get("http.content_type", "")
-                http_info["contentLength"] = http_layer.get("http.content_length", "")
-                
-            # Common HTTP headers
-            for key, value in http_layer.items():
-                if key.startswith("http.") and key not in ["http.request", "http.response"]:
-                    cleaned_key = key.replace("http.", "")
-                    http_info[cleaned_key] = value
-                    
-        # Extract DNS information
-        dns_info = None
-        if "dns" in layers:
-            dns_layer = layers["dns"]
-            dns_info = {
-                "isResponse": dns_layer.get("dns.flags.response", "0") == "1",
-                "queryName": dns_layer.get("dns.qry.name", ""),
-                "queryType": dns_layer.get("dns.qry.type", ""),
-                "responseCode": dns_layer.get("dns.flags.rcode", "")
-            }
+        tcp_layer = layers.get("tcp")
+        udp_layer = layers.get("udp")
+        if tcp_layer is not None:
+            src_port = tcp_layer.get("tcp.srcport")
+            dst_port = tcp_layer.get("tcp.dstport")
+        elif udp_layer is not None:
+            src_port = udp_layer.get("udp.srcport")
+            dst_port = udp_layer.get("udp.dstport")
+        # Ports repeat across a conversation's packets, so share one string per port
+        src_port = sys.intern(src_port) if src_port else src_port
+        dst_port = sys.intern(dst_port) if dst_port else dst_port
             
-            # Extract answers if available
-            if "dns.a" in dns_layer:
-                if isinstance(dns_layer["dns.a"], list):
-                    dns_info["answers"] = dns_layer["dns.a"]
-                else:
-                    dns_info["answers"] = [dns_layer["dns.a"]]
+        # Extract TCP flags into a TCP_FLAG_BITS bitfield
+        tcp_flags = tcp_seq = tcp_len = None
+        if tcp_layer is not None:
+            tcp_flags = 0
+            for name, field_name in TCP_FLAG_FIELDS.items():
+                if tcp_layer.get(field_name) == "1":
+                    tcp_flags |= TCP_FLAG_BITS[name]
+            tcp_seq = int(tcp_layer["tcp.seq"]) if "tcp.seq" in tcp_layer else None
+            tcp_len = shared_int(tcp_layer["tcp.len"]) if "tcp.len" in tcp_layer else None
             
-        # Extract payload if available
-        payload = None
-        if "data" in layers and "data.data" in layers["data"]:
-            hex_data = layers["data"]["data.data"]
-            try:
-                # Try to decode the hex data
-                payload = bytes.fromhex(hex_data).decode('utf-8', errors='replace')
-            except (ValueError, UnicodeDecodeError):
-                payload = f"HEX:{hex_data}"
-                
+        # HTTP, DNS and payload are decoded only if the packet is inspected
+        detail_layers = {name: layers[name] for name in DETAIL_LAYERS if layers.get(name) is not None} or None
+        
         return DetailedPacket(
-            id=str(self.packet_id_counter),
+            id=0,
             timestamp=timestamp,
             sourceIP=src_ip,
             destinationIP=dst_ip,
@@ -233,16 +727,17 @@ class NetworkTrafficAggregator:
             sourcePort=src_port,
             destinationPort=dst_port,
             tcpFlags=tcp_flags,
-            httpInfo=http_info,
-            dnsInfo=dns_info,
-            payload=payload,
+            tcpSeq=tcp_seq,
+            tcpLen=tcp_len,
+            layers=detail_layers,
             raw_data=None  # Don't store the full packet to save memory
         )
 
     def _get_or_create_host(self, ip: str) -> NetworkHost:
-        for host in self.hosts.values():
-            if host.ip == ip:
-                return host
+        key = ip_to_int(ip)
+        host = self.host_index.get(key)
+        if host is not None:
+            return host
                 
         self.host_id_counter += 1
         host = NetworkHost(
@@ -250,82 +745,390 @@ class NetworkTrafficAggregator:
             ip=ip
         )
         self.hosts[host.id] = host
+        self.host_index[key] = host
+        self.rollup.add_host(host.id, ip)
         return host
 
-    def _get_protocol(self, packet: Dict[str, Any]) -> str:
-        layers = packet["_source"]["layers"]
-        
-        # Check application layer protocols first
-        if "http" in layers:
-            return "HTTP"
-        elif "tls" in layers:
-            return "HTTPS"  # Assume TLS is HTTPS
-        elif "dns" in layers:
-            return "DNS"
-        
-        # Check transport layer
-        if "tcp" in layers:
-            tcp_layer = layers["tcp"]
-            
-            # Check for well-known ports
-            if "tcp.dstport" in tcp_layer:
-                dst_port = tcp_layer["tcp.dstport"]
-                if dst_port == "80":
-                    return "HTTP"
-                elif dst_port == "443":
-                    return "HTTPS"
-                elif dst_port == "22":
-                    return "SSH"
-                elif dst_port == "21":
-                    return "FTP"
-                elif dst_port == "23":
-                    return "TELNET"
-                
-            return "TCP"
-        elif "udp" in layers:
-            udp_layer = layers["udp"]
-            
-            # Check for well-known ports
-            if "udp.dstport" in udp_layer:
-                dst_port = udp_layer["udp.dstport"]
-                if dst_port == "53":
-                    return "DNS"
-                elif dst_port == "123":
-                    return "NTP"
-                elif dst_port == "67" or dst_port == "68":
-                    return "DHCP"
-                    
-            return "UDP"
-        elif "icmp" in layers:
-            return "ICMP"
-            
-        return "OTHER"
+    @staticmethod
+    def _get_protocol(packet: Dict[str, Any]) -> str:
+        return PROTOCOL_CLASSIFIER.classify_packet(packet)
+
+    @staticmethod
+    def _get_summary_protocol(layers: List[str], tcp_srcport: str, tcp_dstport: str,
+                              udp_srcport: str, udp_dstport: str) -> str:
+        """Same rules as _get_protocol, for the frame.protocols list of a summary line"""
+        return PROTOCOL_CLASSIFIER.classify_summary(layers, tcp_srcport, tcp_dstport, udp_srcport, udp_dstport)
 
     def _get_visualization_data(self) -> Dict[str, Any]:
         return {
-            "hosts": [asdict(host) for host in self.hosts.values()],
+            "hosts": [host.to_dict() for host in self.hosts.values()],
             "streams": [asdict(stream) for stream in self.streams.values()]
         }
+    
+    def _remove_stream(self, stream_key: str):
+        """Drop a stream and its stored packets, and report it in the next delta"""
+        stream = self.streams.pop(stream_key, None)
+        if stream is not None:
+            self.packets.pop(stream_key, None)
+            self._stream_activity.pop(stream_key, None)
+            self.stream_rates.pop(stream_key, None)
+            for host_id in (stream.source, stream.target):
+                self._host_streams[host_id] -= 1
+            self.rollup.remove_stream(stream_key, stream.packets, stream.bytes)
+            self._dirty_streams.discard(stream_key)
+            self._removed_streams.add(stream_key)
+            if self.top_k:
+                self.stream_hitters.discard(stream_key)
+    
+    def _remove_host(self, host_id: str):
+        """Drop a host, and report it in the next delta"""
+        host = self.hosts.pop(host_id, None)
+        if host is not None:
+            self.host_index.pop(ip_to_int(host.ip), None)
+            self._host_streams.pop(host_id, None)
+            self.host_rates.pop(host_id, None)
+            self.rollup.remove_host(host_id)
+            self._dirty_hosts.discard(host_id)
+            self._removed_hosts.add(host_id)
+            if self.top_k:
+                self.host_hitters.discard(host.ip)
+    
+    def expire(self, now: float) -> int:
+        """Remove streams idle for idle_ttl seconds at `now` (epoch seconds), then hosts left without streams
+        
+        Streams are visited least recently active first, so only expired ones are looked at.
+        Returns the number of streams removed.
+        """
+        if not self.idle_ttl:
+            return 0
+        
+        cutoff = (now - self.idle_ttl) * 1000
+        orphans = set()
+        removed = 0
+        while self._stream_activity:
+            stream_key = next(iter(self._stream_activity))
+            stream = self.streams[stream_key]
+            if stream.timestamp > cutoff:
+                break
+            self._remove_stream(stream_key)
+            orphans.update((stream.source, stream.target))
+            removed += 1
+        
+        for host_id in orphans:
+            if not self._host_streams.get(host_id):
+                self._remove_host(host_id)
+        self.flows.expire(cutoff)
+        return removed
+    
+    def rates(self, now: float) -> Dict[str, Any]:
+        """Packets/s and bytes/s over RATE_WINDOWS for every host and stream with recent traffic
+        
+        Entities missing from the result had no traffic in the longest window.
+        """
+        result = {"time": now, "windows": list(RATE_WINDOWS), "hosts": {}, "streams": {}}
+        for name, counters in (("hosts", self.host_rates), ("streams", self.stream_rates)):
+            idle = []
+            for key, counter in counters.items():
+                if counter.idle(now):
+                    idle.append(key)
+                else:
+                    result[name][key] = counter.rates(now)
+            for key in idle:
+                del counters[key]
+        return result
+    
+    def view(self, prefix_length: Optional[int] = None, expand: Iterable[str] = ()) -> Dict[str, Any]:
+        """Graph with hosts grouped into subnets of `prefix_length` (see ROLLUP_LEVELS), or all hosts if None
+        
+        Subnets listed in `expand` are shown as their next-level subnets, or as
+        hosts for the finest level. Subnet ids are CIDR strings such as "10.1.0.0/16".
+        """
+        if prefix_length is None:
+            return self._get_visualization_data()
+        return self.rollup.view(rollup_level(prefix_length), expand, self.hosts, self.streams)
+    
+    def flow_view(self, host_ids: Iterable[str] = (), limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Connections from the flow table, most recently active first
+        
+        `host_ids` keeps only flows involving those hosts. Each flow carries the
+        ids of its client and server hosts (None once they have been expired or,
+        in heavy-hitter mode, when they are folded into "other").
+        """
+        ips = [self.hosts[host_id].ip for host_id in host_ids if host_id in self.hosts]
+        if host_ids and not ips:
+            return []
+        flows = self.flows.view(ips, limit)
+        for flow in flows:
+            for end in ("client", "server"):
+                host = self.host_index.get(ip_to_int(flow[end]))
+                flow[end + "Id"] = host.id if host is not None else None
+        return flows
+    
+    def flush_delta(self) -> Optional[Dict[str, Any]]:
+        """Return hosts and streams changed or removed since the last flush, or None
+        
+        Only dirty entities are serialized, so a flush costs O(changes) rather than
+        O(graph size). Removed streams are reported by stream key (source-target-protocol).
+        """
+        if not (self._dirty_hosts or self._dirty_streams or self._removed_hosts or self._removed_streams):
+            return None
+        
+        delta = {
+            "hosts": [self.hosts[host_id].to_dict() for host_id in self._dirty_hosts],
+            "streams": [asdict(self.streams[stream_key]) for stream_key in self._dirty_streams],
+            "removedHosts": list(self._removed_hosts),
+            "removedStreams": list(self._removed_streams)
+        }
+        self._dirty_hosts.clear()
+        self._dirty_streams.clear()
+        self._removed_hosts.clear()
+        self._removed_streams.clear()
+        return delta
         
-    def get_packet_details(self, source_id: str, target_id: str, protocol: str) -> List[Dict[str, Any]]:
-        """Return detailed packet information for a specific connection"""
+    def to_checkpoint(self) -> Dict[str, bytes]:
+        """Hosts, streams, stored packets, subnet rollups and the packet index as checkpoint sections (see checkpoint.py)
+
+        Every string is stored once in a table and referenced by index, so
+        restored packets share their address and port strings again. Rates, the
+        flow table and pending deltas are not kept.
+        """
+        # None is stored as -1, ahead of the table proper
+        strings: Dict[Optional[str], int] = {None: -1}
+
+        def refs(values: Iterable[Optional[str]]) -> bytes:
+            add = strings.setdefault
+            return pack_array("i", [add(value, len(strings) - 1) for value in values])
+
+        def optional(values: Iterable[Optional[int]]) -> List[int]:
+            return [-1 if value is None else value for value in values]
+
+        hosts = list(self.hosts.values())
+        sketches = []
+        for host in hosts:
+            for sketch in (host.peers, host.ports):
+                # Empty sketches are stored as just their precision byte
+                sketches.append(sketch.to_bytes() if sketch.registers else bytes([sketch.precision]))
+
+        stream_keys = list(self._stream_activity)
+        streams = [self.streams[key] for key in stream_keys]
+
+        rings = list(self.packets.items())
+        packets = [packet for _, ring in rings for packet in ring]
+        # Undecoded detail layers are rare, so they are kept as one JSON list
+        layers = []
+        layer_indexes = []
+        for packet in packets:
+            if packet.layers:
+                layer_indexes.append(len(layers))
+                layers.append(packet.layers)
+            else:
+                layer_indexes.append(-1)
+
+        sections = {
+            "hosts.id": refs(host.id for host in hosts),
+            "hosts.ip": refs(host.ip for host in hosts),
+            "hosts.packets": pack_array("q", (host.packets for host in hosts)),
+            "hosts.bytes": pack_array("q", (host.bytesTransferred for host in hosts)),
+            "hosts.sketchLengths": pack_array("I", (len(sketch) for sketch in sketches)),
+            "hosts.sketches": b"".join(sketches),
+            "streams.source": refs(stream.source for stream in streams),
+            "streams.target": refs(stream.target for stream in streams),
+            "streams.protocol": refs(stream.protocol for stream in streams),
+            "streams.packets": pack_array("q", (stream.packets for stream in streams)),
+            "streams.bytes": pack_array("q", (stream.bytes for stream in streams)),
+            "streams.timestamp": pack_array("d", (stream.timestamp for stream in streams)),
+            "rings.key": refs(key for key, _ in rings),
+            "rings.length": pack_array("I", (len(ring) for _, ring in rings)),
+            "packets.id": pack_array("q", (packet.id for packet in packets)),
+            "packets.timestamp": pack_array("d", (packet.timestamp for packet in packets)),
+            "packets.sourceIP": refs(packet.sourceIP for packet in packets),
+            "packets.destinationIP": refs(packet.destinationIP for packet in packets),
+            "packets.protocol": refs(packet.protocol for packet in packets),
+            "packets.length": pack_array("q", (packet.length for packet in packets)),
+            "packets.ttl": pack_array("h", optional(packet.ttl for packet in packets)),
+            "packets.sourcePort": refs(packet.sourcePort for packet in packets),
+            "packets.destinationPort": refs(packet.destinationPort for packet in packets),
+            "packets.tcpFlags": pack_array("b", optional(packet.tcpFlags for packet in packets)),
+            "packets.tcpSeq": pack_array("q", optional(packet.tcpSeq for packet in packets)),
+            "packets.tcpLen": pack_array("i", optional(packet.tcpLen for packet in packets)),
+            "packets.layers": json.dumps(layers).encode(),
+            "packets.layers.index": pack_array("i", layer_indexes),
+        }
+        # Saved as built, so restoring them is bulk loads rather than a replay of every host, stream and packet
+        sections.update(self.rollup.to_sections(refs, [host.id for host in hosts], stream_keys))
+        sections.update(self.index.to_sections(refs))
+        if self.top_k:
+            for name, hitters in (("hosts", self.host_hitters), ("streams", self.stream_hitters)):
+                sections[f"hitters.{name}.key"] = refs(hitters.counts)
+                sections[f"hitters.{name}.count"] = pack_array("q", hitters.counts.values())
+                sections[f"hitters.{name}.sketch"] = hitters.admission.to_bytes()
+        sections["strings"] = pack_strings(itertools.islice(strings, 1, None))
+        sections["meta"] = json.dumps({
+            "hostIdCounter": self.host_id_counter,
+            "packetIdCounter": self.packet_id_counter,
+            "lastTimestamp": self.last_timestamp,
+            "topK": self.top_k
+        }).encode()
+        return sections
+
+    @classmethod
+    def from_checkpoint(cls, sections: Dict[str, bytes]) -> "NetworkTrafficAggregator":
+        """Rebuild an aggregator from to_checkpoint() sections
+
+        Streams, subnet rollups and the packet index are loaded in bulk, not
+        replayed through the insert path. In heavy-hitter mode the tracked
+        counts and admission sketches are restored as saved.
+        """
+        meta = json.loads(sections["meta"])
+        aggregator = cls(meta["topK"])
+        aggregator.host_id_counter = meta["hostIdCounter"]
+        aggregator.packet_id_counter = meta["packetIdCounter"]
+        aggregator.last_timestamp = meta["lastTimestamp"]
+        # None last, so the -1 refs() stores for None looks it up like any string
+        strings = [sys.intern(value) for value in unpack_strings(sections["strings"])] + [None]
+
+        def column(name: str, typecode: str = "i") -> array.array:
+            return unpack_array(typecode, sections[name])
+
+        def strs(name: str) -> List[Optional[str]]:
+            return list(map(strings.__getitem__, column(name)))
+
+        host_ids = strs("hosts.id")
+        # Each host's distinct peers then distinct ports sketch
+        sketches = HyperLogLog.unpack_many(sections["hosts.sketches"], column("hosts.sketchLengths", "I"))
+        hosts = list(map(NetworkHost, host_ids, strs("hosts.ip"), column("hosts.packets", "q"),
+                         column("hosts.bytes", "q"), sketches[0::2], sketches[1::2]))
+        aggregator.hosts = dict(zip(host_ids, hosts))
+        aggregator.host_index = {ip_to_int(host.ip): host for host in hosts if host.id != OTHER_HOST_ID}
+
+        sources = strs("streams.source")
+        targets = strs("streams.target")
+        protocols = strs("streams.protocol")
+        stream_keys = [f"{source}-{target}-{protocol}" for source, target, protocol in zip(sources, targets, protocols)]
+        aggregator.streams = dict(zip(stream_keys, map(NetworkStream, sources, targets, protocols,
+                                                       column("streams.packets", "q"), column("streams.bytes", "q"),
+                                                       column("streams.timestamp", "d"))))
+        aggregator._stream_activity = OrderedDict.fromkeys(stream_keys)
+        aggregator._host_streams = dict(Counter(itertools.chain(sources, targets)))
+        aggregator.rollup.load_sections(sections, strs, host_ids, stream_keys)
+        if aggregator.top_k:
+            for name, hitters in (("hosts", aggregator.host_hitters), ("streams", aggregator.stream_hitters)):
+                hitters.admission = CountMinSketch.from_bytes(sections[f"hitters.{name}.sketch"])
+                hitters.load(dict(zip(strs(f"hitters.{name}.key"), column(f"hitters.{name}.count", "q"))))
+            aggregator.host_sketch = aggregator.host_hitters.admission
+
+        layers = json.loads(sections["packets.layers"])
+        packets = list(map(DetailedPacket, column("packets.id", "q"), column("packets.timestamp", "d"),
+                      strs("packets.sourceIP"), strs("packets.destinationIP"), strs("packets.protocol"),
+                      column("packets.length", "q"),
+                      [None if value < 0 else value for value in column("packets.ttl", "h")],
+                      strs("packets.sourcePort"), strs("packets.destinationPort"),
+                      [None if value < 0 else value for value in column("packets.tcpFlags", "b")],
+                      [None if value < 0 else value for value in column("packets.tcpSeq", "q")],
+                      [None if value < 0 else shared_int(value) for value in column("packets.tcpLen")],
+                      [None if index < 0 else layers[index] for index in column("packets.layers.index")]))
+        # Loaded first, so packets a smaller budget evicts while restoring also leave the index
+        aggregator.index.load_sections(sections, strs)
+        offset = 0
+        for stream_key, length in zip(strs("rings.key"), column("rings.length", "I")):
+            aggregator.packets.extend(stream_key, packets[offset:offset + length])
+            offset += length
+
+        # Clients get the restored graph as a snapshot, not as a delta
+        aggregator._dirty_hosts.clear()
+        aggregator._dirty_streams.clear()
+        return aggregator
+
+    def get_packet_details(self, source_id: str, target_id: str, protocol: str,
+                           limit: Optional[int] = None, since_id: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Return detailed packet information for a specific connection, oldest first
+        
+        `limit` keeps only the newest packets and `since_id` only those numbered after it.
+        """
         stream_key = f"{source_id}-{target_id}-{protocol}"
         
-        # Check if we have packets for this stream
-        if stream_key in self.packets:
+        # Check if we have packets for this stream (viewing it keeps it from being evicted)
+        ring = self.packets.get(stream_key)
+        if ring is not None:
             # Convert packets to dictionaries and return
-            return [asdict(packet) for packet in self.packets[stream_key]]
+            return self._packet_dicts(ring.recent(limit, since_id))
             
         # Try the reverse direction
-        reverse_key = f"{target_id}-{source_id}-{protocol}"
-        if reverse_key in self.packets:
-            return [asdict(packet) for packet in self.packets[reverse_key]]
+        ring = self.packets.get(f"{target_id}-{source_id}-{protocol}")
+        if ring is not None:
+            return self._packet_dicts(ring.recent(limit, since_id))
             
         # No packets found
         return []
 
-def start_capture(network_interface='any'):
-    aggregator = NetworkTrafficAggregator()
+    def search_packets(self, query: Dict[str, Any], limit: Optional[int] = 50,
+                       before_id: Optional[int] = None) -> Dict[str, Any]:
+        """Stored packets matching every field of query (see packet_index.SEARCH_FIELDS), newest first
+        
+        Pages continue with `before_id` set to the last packet id of the previous one.
+        Raises ValueError for an unknown field or an empty query.
+        """
+        # One more than the page tells whether there is a next one
+        result = self.index.search(self.packets, query, None if limit is None else limit + 1, before_id)
+        matches = result["packets"][:limit]
+        packets = [dict(details, streamId=stream_key) for (stream_key, _), details in
+                   zip(matches, self._packet_dicts([packet for _, packet in matches]))]
+        return {
+            "packets": packets,
+            "streams": [{"id": stream_key, "packets": count} for stream_key, count in result["streams"].items()],
+            "total": result["total"],
+            "nextBeforeId": matches[-1][1].id if len(result["packets"]) > len(matches) else None
+        }
+
+    def _packet_dicts(self, packets: List[DetailedPacket]) -> List[Dict[str, Any]]:
+        """Client dicts for stored packets, decoding each at most once while it stays in the cache"""
+        cache = self._detail_cache
+        result = []
+        for packet in packets:
+            details = cache.get(packet.id)
+            if details is None:
+                details = cache[packet.id] = packet.to_dict()
+                if len(cache) > DETAIL_CACHE_SIZE:
+                    cache.popitem(last=False)
+            else:
+                cache.move_to_end(packet.id)
+            result.append(details)
+        return result
+
+def emit_network_changes(aggregator: NetworkTrafficAggregator, now: float):
+    """Expire idle streams and hosts, then send what changed (networkDelta) and current rates (networkRates)
+    
+    Runs on the aggregator actor's thread every tick; also hands recent packets to
+    the history and starts a background checkpoint when one is due.
+    """
+    aggregator.expire(now)
+    delta = aggregator.flush_delta()
+    if delta:
+        socketio.emit('networkDelta', delta)
+    rates = aggregator.rates(now)
+    if rates["hosts"] or rates["streams"]:
+        socketio.emit('networkRates', rates)
+    if aggregator.history is not None:
+        aggregator.history.tick()
+    if checkpointer is not None:
+        checkpointer.maybe_save(aggregator.to_checkpoint)
+
+def start_capture(network_interface='any', mode='full', queue_size=10000, drop_policy='block', workers=0,
+                  top_k=HEAVY_HITTER_K):
+    tshark_process = None
+    reader = None
+    pool = None
+    pending = 0
+    # Joins the graph of any capture already running; top_k only applies to a new graph
+    actor.attach(lambda: take_aggregator(top_k))
+    
+    # Summary mode asks tshark only for the columns the aggregator counts
+    if mode == 'summary':
+        decoder = make_decoder("fields")
+        ingest = 'add_summaries'
+    else:
+        decoder = make_decoder("ek")
+        ingest = 'add_packets'
     
     try:
         # Check if running as root (required for packet capture)
@@ -336,25 +1139,26 @@ def start_capture(network_interface='any'):
             })
             
         # Use tshark to capture network traffic with specific parameters
-        # -p: Don't put the interface in promiscuous mode (if firewall is blocking)
+        # -T ek: one JSON document per line, so every packet can be decoded as soon as it arrives
         # -n: Disable all name resolution (faster and avoids DNS issues)
-        # Try with a more basic configuration first
-        tshark_cmd = ["tshark", "-i", network_interface, "-T", "json", 
-                     "-l", "-f", "ip", "-n", "-q"]
+        tshark_cmd = ["tshark", "-i", network_interface, "-l", "-f", "ip", "-n"]
+        if mode == 'summary':
+            tshark_cmd += summary_tshark_args()
+        else:
+            tshark_cmd += ["-T", "ek"]
         print(f"Running command: {' '.join(tshark_cmd)}")
         
+        # Binary pipes: TsharkReader drains both of them on its own threads
         tshark_process = subprocess.Popen(
             tshark_cmd,
             stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            bufsize=1  # Line buffered
+            stderr=subprocess.PIPE
         )
         
         # Check for immediate startup errors
         time.sleep(0.5)
         if tshark_process.poll() is not None:
-            error_output = tshark_process.stderr.read()
+            error_output = tshark_process.stderr.read().decode(errors='replace')
             print(f"tshark failed to start: {error_output}")
             socketio.emit('error', {
                 "message": f"Failed to start packet capture: {error_output}"
@@ -363,91 +1167,64 @@ def start_capture(network_interface='any'):
             
         print(f"tshark started successfully on interface {network_interface}")
         
+        # Full JSON decoding and field extraction can be spread over worker processes
+        if workers and mode != 'summary':
+            pool = DecodePool(decode_packet_chunk, workers)
+            ingest = 'add_records'
+            print(f"Decoding packets on {pool.workers} worker processes")
+        
+        reader = TsharkReader(tshark_process, decoder, queue_size, drop_policy, pool=pool).start()
+        
         # Notify client that capture has started successfully
         socketio.emit('captureStatus', {
             "status": "started", 
-            "message": f"Packet capture started on {network_interface}"
+            "message": f"Packet capture started on {network_interface} ({mode} mode, {drop_policy} policy)"
         })
         
-        buffer = ""
         packet_count = 0
         last_update_time = time.time()
-        update_batch = []
         
-        while True:
-            # Process stderr to catch warnings but don't stop on them
-            error = tshark_process.stderr.readline()
-            if error:
-                print(f"tshark stderr: {error.strip()}", file=sys.stderr)
+        while not reader.finished:
+            # Report tshark warnings but don't stop on them
+            for error in reader.stderr_lines():
+                print(f"tshark stderr: {error}", file=sys.stderr)
                 if "Permission denied" in error:
                     socketio.emit('error', {
                         "message": "Permission denied. Please run the server with sudo privileges."
                     })
-                    break
+                    return
             
-            # Process stdout for packet data
-            output = tshark_process.stdout.readline()
-            if output == "" and tshark_process.poll() is not None:
-                print("tshark process ended")
-                break
-                
-            if output:
-                # Check if the line is a complete JSON object 
-                try:
-                    # Clean the output and try to parse it
-                    cleaned_output = output.strip()
-                    if cleaned_output.startswith('[') and cleaned_output.endswith(']'):
-                        # If it's an array, take the first item
-                        packet_list = json.loads(cleaned_output)
-                        if packet_list and len(packet_list) > 0:
-                            packet = packet_list[0]
-                            visualization_data = aggregator.add_packet(packet)
-                            update_batch.append(visualization_data)
-                            packet_count += 1
-                    elif cleaned_output.startswith('{') and cleaned_output.endswith('}'):
-                        # It's a single packet
-                        packet = json.loads(cleaned_output)
-                        visualization_data = aggregator.add_packet(packet)
-                        update_batch.append(visualization_data)
-                        packet_count += 1
-                    else:
-                        # Incomplete JSON, add to buffer
-                        buffer += output
-                except json.JSONDecodeError:
-                    # Not valid JSON, add to buffer and try to process
-                    buffer += output
-                    
-                    # Try to extract complete JSON objects from buffer
-                    if buffer.strip().startswith('{') and '}' in buffer:
-                        try:
-                            # Find the position of the closing brace
-                            end_pos = buffer.find('}') + 1
-                            json_part = buffer[:end_pos]
-                            buffer = buffer[end_pos:]
-                            
-                            packet = json.loads(json_part)
-                            visualization_data = aggregator.add_packet(packet)
-                            update_batch.append(visualization_data)
-                            packet_count += 1
-                        except json.JSONDecodeError:
-                            # Still not valid JSON
-                            if len(buffer) > 50000:  # Reset if buffer gets too large
-                                print("Buffer overflow, resetting")
-                                buffer = ""
+            # Waits only until packets arrive (or the update interval passes), then
+            # hands everything already queued to the aggregator actor as one micro-batch
+            batch = reader.get_batch(timeout=0.5)
+            if batch:
+                actor.ingest(ingest, batch)
+            pending += len(batch)
+            packet_count += len(batch)
             
-            # Send batch updates every 0.5 seconds to reduce network traffic
+            # The actor sends graph changes itself; report ingest progress every 0.5 seconds
             current_time = time.time()
-            if update_batch and (current_time - last_update_time > 0.5 or len(update_batch) >= 10):
-                # Send the most recent update
-                recent_update = update_batch[-1]
-                socketio.emit('networkUpdate', recent_update)
+            if pending and current_time - last_update_time > 0.5:
+                # Report ingest counters so operators can see when packets are being dropped
+                stats = reader.stats()
+                status = actor.status
+                socketio.emit('captureStatus', {
+                    "status": "running",
+                    "message": f"Processed {packet_count} packets",
+                    "stats": stats,
+                    "packetStore": status.get("packetStore")
+                })
                 
                 # Log statistics
-                print(f"Processed {packet_count} packets, {len(recent_update['hosts'])} hosts, {len(recent_update['streams'])} streams")
+                print(f"Processed {packet_count} packets ({stats['packetsPerSecond']:.0f} packets/sec, "
+                      f"{stats['queue']['dropped']} dropped), "
+                      f"{status.get('hosts', 0)} hosts, {status.get('streams', 0)} streams")
                 
                 # Reset batch tracking
-                update_batch = []
+                pending = 0
                 last_update_time = current_time
+        
+        print("tshark process ended")
                     
     except Exception as e:
         print(f"Failed to start tshark: {e}", file=sys.stderr)
@@ -458,8 +1235,19 @@ def start_capture(network_interface='any'):
         })
     finally:
         # Send final update if there are any pending
-        if update_batch:
-            socketio.emit('networkUpdate', update_batch[-1])
+        actor.detach()
+        
+        if reader:
+            reader.stop()
+            print(f"Capture ingest: {reader.stats()}")
+            socketio.emit('captureStatus', {
+                "status": "stopped",
+                "message": f"Packet capture stopped on {network_interface}",
+                "stats": reader.stats(),
+                "packetStore": packet_store_stats()
+            })
+        if pool:
+            pool.close()
             
         if tshark_process and tshark_process.poll() is None:
             print("Terminating tshark process...")
@@ -471,10 +1259,128 @@ def start_capture(network_interface='any'):
                 tshark_process.kill()
             
 
+def decode_packet_chunk(text: str) -> Tuple[List[tuple], int]:
+    """DecodePool worker: decode complete `-T ek` lines into add_record records"""
+    decoder = EKDecoder()
+    records = []
+    errors = 0
+    for packet in decoder.feed(text) + decoder.close():
+        try:
+            records.append(NetworkTrafficAggregator.extract_record(packet))
+        except (KeyError, TypeError, ValueError):
+            errors += 1
+    return records, errors + decoder.stats.errors
+
+def resolve_capture_file(capture_file: str) -> str:
+    """Resolve a client-supplied capture file name inside CAPTURE_DIR"""
+    capture_dir = os.path.realpath(CAPTURE_DIR)
+    path = os.path.realpath(os.path.join(capture_dir, capture_file))
+    if os.path.commonpath([capture_dir, path]) != capture_dir:
+        raise ValueError(f"Capture file must be inside {CAPTURE_DIR}")
+    if not os.path.isfile(path):
+        raise FileNotFoundError(f"Capture file not found: {capture_file}")
+    return path
+
+def start_replay(capture_file, pace='max', reader='tshark'):
+    """Replay a pcap/pcapng file through the summary ingest path
+    
+    reader is 'tshark' (any format tshark can read) or 'native' (pcap_reader,
+    no subprocess, L3/L4 fields only).
+    """
+    tshark_process = None
+    pcap_file = None
+    stats = IngestStats()
+    actor.attach(take_aggregator, replay_clock)
+    
+    try:
+        path = resolve_capture_file(capture_file)
+        pacer = ReplayPacer(parse_replay_speed(pace), sleep=socketio.sleep)
+        
+        if reader == 'native':
+            pcap_file = PcapReader(path)
+            records = iter(pcap_file)
+        else:
+            tshark_cmd = ["tshark", "-r", path, "-n"] + summary_tshark_args()
+            print(f"Running command: {' '.join(tshark_cmd)}")
+            
+            tshark_process = subprocess.Popen(
+                tshark_cmd,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE
+            )
+            tshark_reader = TsharkReader(tshark_process, make_decoder("fields")).start()
+            records = iter(tshark_reader)
+        
+        socketio.emit('captureStatus', {
+            "status": "started",
+            "message": f"Replaying {capture_file} (pace: {pace}, reader: {reader})"
+        })
+        
+        last_update_time = time.time()
+        
+        for batch in pacer.batches(records, REPLAY_BATCH_SIZE):
+            actor.ingest('add_summaries', batch)
+            stats.packets += len(batch)
+            
+            if time.time() - last_update_time > 0.5:
+                _emit_replay_progress(capture_file, stats)
+                last_update_time = time.time()
+        
+        if pcap_file:
+            stats.errors = pcap_file.skipped
+        else:
+            tshark_reader.join(timeout=3)
+            error_output = "\n".join(tshark_reader.stderr_lines())
+            if tshark_process.wait() != 0:
+                print(f"tshark replay failed: {error_output}", file=sys.stderr)
+                socketio.emit('error', {
+                    "message": f"Failed to read {capture_file}: {error_output}"
+                })
+        
+        _emit_replay_progress(capture_file, stats)
+        socketio.emit('captureStatus', {
+            "status": "completed",
+            "message": f"Replay of {capture_file} finished: {stats.packets} packets",
+            "stats": stats.as_dict(),
+            "packetStore": packet_store_stats()
+        })
+                
+    except Exception as e:
+        print(f"Failed to replay capture: {e}", file=sys.stderr)
+        import traceback
+        traceback.print_exc()
+        socketio.emit('error', {
+            "message": f"Failed to replay capture file. {str(e)}"
+        })
+    finally:
+        actor.detach(replay_clock)
+        if pcap_file:
+            pcap_file.close()
+        if tshark_process and tshark_process.poll() is None:
+            tshark_process.terminate()
+            try:
+                tshark_process.wait(timeout=3)
+            except subprocess.TimeoutExpired:
+                tshark_process.kill()
+
+def replay_clock(aggregator: NetworkTrafficAggregator) -> float:
+    # Replayed traffic is aged by its own capture clock
+    return aggregator.last_timestamp / 1000
+
+def _emit_replay_progress(capture_file, stats):
+    status = actor.status
+    socketio.emit('captureStatus', {
+        "status": "replaying",
+        "message": f"Replayed {stats.packets} packets from {capture_file}",
+        "stats": stats.as_dict(),
+        "packetStore": status.get("packetStore")
+    })
+    print(f"Replayed {stats.packets} packets ({stats.packets_per_second():.0f} packets/sec), "
+          f"{status.get('hosts', 0)} hosts, {status.get('streams', 0)} streams")
+
 class TestTrafficGenerator:
     def __init__(self):
         self.running = False
-        self.aggregator = NetworkTrafficAggregator()
         self.ips = [
             '192.168.1.1', '192.168.1.2', '192.168.1.100', 
             '10.0.0.1', '10.0.0.2', '10.0.0.3',
@@ -570,16 +1476,189 @@ def favicon():
 # Health check endpoint
 @app.route('/health')
 def health():
-    return jsonify({"status": "ok"})
+    status = {"status": "ok"}
+    store = packet_store_stats()
+    if store is not None:
+        status["packetStore"] = store
+    if history is not None:
+        status["history"] = history.stats()
+    return jsonify(status)
+
+# State restored from CHECKPOINT_PATH at startup, picked up by the next capture, replay or simulation
+restored_aggregator: Optional[NetworkTrafficAggregator] = None
+
+checkpointer = Checkpointer(CHECKPOINT_PATH, CHECKPOINT_INTERVAL) if CHECKPOINT_PATH else None
+
+# Packet history written by whichever aggregator owns the graph; opened at startup
+history: Optional[HistoryStore] = None
+
+def open_history() -> Optional[HistoryStore]:
+    """Open the HISTORY_DIR history, if configured"""
+    global history
+    if HISTORY_DIR:
+        history = HistoryStore(HISTORY_DIR, HISTORY_SEGMENT_SECONDS, HISTORY_SEGMENT_BYTES,
+                               HISTORY_MAX_BYTES, HISTORY_MAX_AGE)
+        print(f"Packet history in {HISTORY_DIR}: {history.stats()['packets']} packets")
+    return history
+
+def history_graph(params: Dict[str, Any]) -> Dict[str, Any]:
+    """The history graph of [params["from"], params["to"]) ms, with an optional stream limit
+
+    Raises ValueError for missing or invalid parameters.
+    """
+    try:
+        start = float(params["from"])
+        end = float(params["to"])
+        limit = int(params["limit"]) if params.get("limit") is not None else None
+    except (KeyError, TypeError, ValueError):
+        raise ValueError("Expected numeric 'from' and 'to' (ms) and an optional integer 'limit'")
+    if not (math.isfinite(start) and math.isfinite(end) and start < end) or (limit is not None and limit < 0):
+        raise ValueError("Expected 'from' before 'to' and a non-negative 'limit'")
+    return history.graph(start, end, limit)
+
+# Graph of a past time range, from the packet history rather than the live aggregator
+@app.route('/history/graph')
+def history_graph_route():
+    if history is None:
+        return jsonify({"error": "Packet history is not enabled (set HISTORY_DIR)"}), 404
+    try:
+        return jsonify(history_graph(request.args))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+def restore_checkpoint(path: Optional[str] = CHECKPOINT_PATH) -> Optional[NetworkTrafficAggregator]:
+    """Load the checkpoint at path, if any, and make it the graph"""
+    global restored_aggregator
+    if not path or not os.path.exists(path):
+        return None
+    started = time.time()
+    # Millions of new objects would otherwise trigger repeated full collections
+    gc.disable()
+    try:
+        aggregator = NetworkTrafficAggregator.from_checkpoint(read_checkpoint(path))
+    except (CheckpointError, KeyError, ValueError) as e:
+        print(f"Ignoring checkpoint {path}: {e}", file=sys.stderr)
+        return None
+    finally:
+        gc.enable()
+    # Restored state lives on, so keep later collections from rescanning it
+    gc.freeze()
+    print(f"Restored {len(aggregator.hosts)} hosts, {len(aggregator.streams)} streams and "
+          f"{aggregator.packets.total} packets from {path} in {time.time() - started:.2f}s")
+    restored_aggregator = aggregator
+    actor.replace(aggregator)
+    return aggregator
+
+def take_aggregator(top_k: int = HEAVY_HITTER_K) -> NetworkTrafficAggregator:
+    """The restored aggregator the first time (if it has the same top_k), otherwise a new one
+    
+    Either way it appends to the packet history, if one is open.
+    """
+    global restored_aggregator
+    aggregator, restored_aggregator = restored_aggregator, None
+    if aggregator is None or aggregator.top_k != top_k:
+        aggregator = NetworkTrafficAggregator(top_k)
+    aggregator.history = history
+    return aggregator
+
+def publish_graph(aggregator: NetworkTrafficAggregator):
+    """Send the full graph of a new or restored aggregator to every client"""
+    aggregator.flush_delta()
+    socketio.emit('networkUpdate', actor.snapshot())
+
+# Sole owner of the graph: every capture, replay and simulation feeds it, every reader queries it
+actor = AggregatorActor(on_tick=emit_network_changes, on_replace=publish_graph)
+
+def packet_store_stats() -> Optional[Dict[str, Any]]:
+    return actor.call(lambda aggregator: aggregator.packets.stats() if aggregator is not None else None)
+
+def emit_snapshot():
+    """Send the full graph to the requesting client; later changes arrive as networkDelta"""
+    graph = actor.snapshot()
+    if graph is not None:
+        emit('networkUpdate', graph)
 
 # Socket.IO event handlers
 @socketio.on('connect')
 def handle_connect():
     print('Client connected')
+    emit_snapshot()
+
+@socketio.on('requestResync')
+def handle_request_resync():
+    print('Client requested a full snapshot')
+    emit_snapshot()
+
+@socketio.on('requestGraphView')
+def handle_request_graph_view(data):
+    # {"prefixLength": 8 | 16 | 24 (IPv4) or 32 | 48 | 64 (IPv6) | null for hosts,
+    #  "expand": [subnet ids to show one level finer]}
+    data = data or {}
+    prefix_length = data.get('prefixLength')
+    expand = data.get('expand') or []
+    try:
+        prefix_length_value = int(prefix_length) if prefix_length is not None else None
+        view = actor.call(lambda aggregator: aggregator.view(prefix_length_value, expand)
+                          if aggregator is not None else None)
+    except (TypeError, ValueError) as e:
+        emit('error', {"message": str(e)})
+        return
+    if view is None:
+        return
+    view.update(prefixLength=prefix_length, expand=expand)
+    emit('networkView', view)
+
+@socketio.on('requestFlows')
+def handle_request_flows(data):
+    # {"hostIds": [only flows involving these hosts], "limit": most recently active flows to send}
+    data = data or {}
+    try:
+        limit = int(data['limit']) if data.get('limit') is not None else None
+    except (TypeError, ValueError):
+        emit('error', {"message": "Expected an integer 'limit'"})
+        return
+    host_ids = data.get('hostIds') or []
+    flows = actor.call(lambda aggregator: aggregator.flow_view(host_ids, limit)
+                       if aggregator is not None else None)
+    if flows is None:
+        return
+    emit('flowView', {"hostIds": host_ids, "flows": flows})
+
+@socketio.on('searchPackets')
+def handle_search_packets(data):
+    # {"ip", "port", "dnsName", "httpHost", "httpUri": values all matching packets must have,
+    #  "limit": page size, "beforeId": last packet id of the previous page}
+    data = data or {}
+    query = {name: data[name] for name in SEARCH_FIELDS if data.get(name) not in (None, "")}
+    try:
+        limit = max(1, min(int(data.get('limit') or SEARCH_PAGE_SIZE), MAX_SEARCH_PAGE_SIZE))
+        before_id = int(data['beforeId']) if data.get('beforeId') is not None else None
+        result = actor.call(lambda aggregator: aggregator.search_packets(query, limit, before_id)
+                            if aggregator is not None else None)
+    except (TypeError, ValueError) as e:
+        emit('error', {"message": str(e)})
+        return
+    if result is None:
+        return
+    result["query"] = query
+    emit('packetSearchResults', result)
+
+@socketio.on('requestHistoryGraph')
+def handle_request_history_graph(data):
+    # {"from": ms, "to": ms, "limit": streams with the most bytes to send}
+    if history is None:
+        emit('error', {"message": "Packet history is not enabled"})
+        return
+    try:
+        graph = history_graph(data or {})
+    except ValueError as e:
+        emit('error', {"message": str(e)})
+        return
+    emit('historyGraph', graph)
 
 def start_realistic_simulation():
     """Generate more realistic network traffic simulation with common services and protocols"""
-    aggregator = NetworkTrafficAggregator()
+    actor.attach(take_aggregator)
     
     # Create a more realistic network topology
     network_topology = {
@@ -626,7 +1705,7 @@ def start_realistic_simulation():
     packet_count = 0
     is_running = True
     last_update_time = time.time()
-    update_batch = []
+    batch = []
     
     try:
         while is_running:
@@ -712,24 +1791,23 @@ def start_realistic_simulation():
             if udp_data:
                 packet["_source"]["layers"]["udp"] = udp_data
                 
-            # Process the packet
-            visualization_data = aggregator.add_packet(packet)
-            update_batch.append(visualization_data)
+            # Queue the packet for the next micro-batch
+            batch.append(packet)
             packet_count += 1
             
-            # Emit updates periodically
+            # Ingest and emit updates periodically
             current_time = time.time()
-            if update_batch and (current_time - last_update_time > 0.2 or len(update_batch) >= 5):
-                # Send the most recent update
-                recent_update = update_batch[-1]
-                socketio.emit('networkUpdate', recent_update)
+            if current_time - last_update_time > 0.2 or len(batch) >= 5:
+                actor.ingest('add_packets', batch)
                 
                 # Log statistics occasionally
                 if packet_count % 20 == 0:
-                    print(f"Simulated {packet_count} packets, {len(recent_update['hosts'])} hosts, {len(recent_update['streams'])} streams")
+                    status = actor.status
+                    print(f"Simulated {packet_count} packets, {status.get('hosts', 0)} hosts, "
+                          f"{status.get('streams', 0)} streams")
                 
                 # Reset batch tracking
-                update_batch = []
+                batch = []
                 last_update_time = current_time
                 
             # Add a short delay based on the pattern frequency
@@ -741,12 +1819,29 @@ def start_realistic_simulation():
         traceback.print_exc()
     finally:
         print("Realistic simulation stopped")
-        if update_batch:
-            socketio.emit('networkUpdate', update_batch[-1])
+        if batch:
+            actor.ingest('add_packets', batch)
+        actor.detach()
 
 # Update the Socket.IO event handler to support realistic simulation
 @socketio.on('startCapture')
 def handle_start_capture(network_interface):
+    # Either an interface name, {"interface": ..., "mode": "full" | "summary",
+    # "queueSize": N, "dropPolicy": "block" | "drop-newest" | "drop-oldest" | "sample",
+    # "workers": N, "topK": N}
+    # or {"file": ..., "pace": "max" | "realtime" | N, "reader": "tshark" | "native"}
+    # to replay a capture file
+    options = {}
+    if isinstance(network_interface, dict):
+        if 'file' in network_interface:
+            print(f"Starting replay of capture file: {network_interface['file']}")
+            socketio.start_background_task(start_replay, network_interface['file'],
+                                           network_interface.get('pace', 'max'),
+                                           network_interface.get('reader', 'tshark'))
+            return
+        options = network_interface
+        network_interface = options.get('interface', 'any')
+    
     print(f'Starting capture on interface: {network_interface}')
     
     if network_interface == 'test':
@@ -759,7 +1854,22 @@ def handle_start_capture(network_interface):
         socketio.start_background_task(start_realistic_simulation)
     else:
         # Start real traffic capture in a background task
-        socketio.start_background_task(start_capture, network_interface)
+        drop_policy = options.get('dropPolicy', 'block')
+        if drop_policy not in IngestQueue.POLICIES:
+            socketio.emit('error', {"message": f"Unknown drop policy: {drop_policy}"})
+            return
+        try:
+            queue_size = int(options.get('queueSize', 10000))
+            workers = int(options.get('workers', 0))
+            top_k = int(options.get('topK', HEAVY_HITTER_K))
+        except (TypeError, ValueError):
+            socketio.emit('error', {"message": "Expected integer 'queueSize', 'workers' and 'topK'"})
+            return
+        if queue_size <= 0 or workers < 0 or top_k < 0:
+            socketio.emit('error', {"message": "Expected 'queueSize' > 0, 'workers' >= 0 and 'topK' >= 0"})
+            return
+        socketio.start_background_task(start_capture, network_interface, options.get('mode', 'full'),
+                                       queue_size, drop_policy, workers, top_k)
 
 @socketio.on('stopTestTraffic')
 def handle_stop_test_traffic():
@@ -776,21 +1886,60 @@ def start_test_traffic():
     global test_traffic_generator
     test_traffic_generator.running = True
     test_traffic_generator.connection_attempts = 0
+    actor.attach(take_aggregator)
     
-    while test_traffic_generator.running:
-        try:
-            packet = test_traffic_generator.generate_random_packet()
-            visualization_data = test_traffic_generator.aggregator.add_packet(packet)
-            socketio.emit('networkUpdate', visualization_data)
-            socketio.sleep(0.5)  # Generate traffic every 500ms
-        except Exception as e:
-            print(f"Error generating test traffic: {e}")
-            # Don't stop completely on error, just log it
-            socketio.sleep(1)
+    try:
+        while test_traffic_generator.running:
+            try:
+                packet = test_traffic_generator.generate_random_packet()
+                actor.ingest('add_packets', [packet])
+                socketio.sleep(0.5)  # Generate traffic every 500ms
+            except Exception as e:
+                print(f"Error generating test traffic: {e}")
+                # Don't stop completely on error, just log it
+                socketio.sleep(1)
+    finally:
+        actor.detach()
+
+@socketio.on('requestPacketDetails')
+def handle_packet_details_request(data):
+    """Handler for packet detail requests from frontend"""
+    source_id = data.get('sourceId')
+    target_id = data.get('targetId')
+    protocol = data.get('protocol')
+    
+    if not all([source_id, target_id, protocol]):
+        print(f"Invalid packet details request: missing parameters. Got: {data}")
+        return
+    
+    print(f"Packet details requested for connection: {source_id}-{target_id}-{protocol}")
+    
+    # Optional range: the newest `limit` packets, and/or only those after packet `sinceId`
+    try:
+        limit = int(data['limit']) if data.get('limit') is not None else None
+        since_id = int(data['sinceId']) if data.get('sinceId') is not None else None
+    except (TypeError, ValueError):
+        emit('error', {"message": "Expected integer 'limit' and 'sinceId'"})
+        return
+    
+    # Read on the actor thread, between ingest batches
+    packets = actor.call(lambda aggregator: aggregator.get_packet_details(source_id, target_id, protocol,
+                                                                          limit, since_id)
+                         if aggregator is not None else [])
+    
+    print(f"Found {len(packets)} packets for connection")
+    socketio.emit('packetDetails', {"packets": packets})
 
 # Signal handlers
 def cleanup(signum, frame):
     print('Cleaning up...')
+    if history is not None:
+        # Write out and seal the current history segment
+        actor.call(lambda aggregator: history.close())
+    if checkpointer is not None and actor.aggregator is not None:
+        # Final checkpoint, so a restart resumes from the state at shutdown
+        actor.call(lambda aggregator: checkpointer.save(aggregator.to_checkpoint))
+    actor.stop()
     print('Server shut down successfully')
     sys.exit(0)
 
@@ -803,6 +1952,9 @@ if __name__ == '__main__':
     print("Frontend (3D): http://localhost:3001/network")
     print("Backend Socket.IO: port 3001")
     print("\nNote: For capturing real network traffic, you may need to run with sudo privileges")
+    actor.start()
+    open_history()
+    restore_checkpoint()
     
     try:
         socketio.run(app, host='0.0.0.0', port=3001, debug=False)
@@ -810,28 +1962,3 @@ if __name__ == '__main__':
         print(f"Error starting server: {e}")
         print("\nTIP: Make sure you're running this script from within the virtual environment.")
         print("Use: source venv/bin/activate && python serve_visualization.py")
-
-@socketio.on('requestPacketDetails')
-def handle_packet_details_request(data):
-    """Handler for packet detail requests from frontend"""
-    source_id = data.get('sourceId')
-    target_id = data.get('targetId')
-    protocol = data.get('protocol')
-    
-    if not all([source_id, target_id, protocol]):
-        print(f"Invalid packet details request: missing parameters. Got: {data}")
-        return
-    
-    print(f"Packet details requested for connection: {source_id}-{target_id}-{protocol}")
-    
-    # Use the global test traffic generator's aggregator if it exists and is running
-    if test_traffic_generator.running:
-        packets = test_traffic_generator.aggregator.get_packet_details(source_id, target_id, protocol)
-    else:
-        # Create a new aggregator just for this request
-        # This is a temporary solution - in a production app, you'd want to keep the aggregator in a global state
-        aggregator = NetworkTrafficAggregator()
-        packets = aggregator.get_packet_details(source_id, target_id, protocol)
-    
-    print(f"Found {len(packets)} packets for connection")
-    socketio.emit('packetDetails', {"packets": packets})
\ No newline at end of file
@@ -1,6 +1,10 @@
+from tshark_ingest import EKDecoder, TsharkReader
+
 def start_capture(network_interface='any'):
     aggregator = NetworkTrafficAggregator()
-    packet_buffer = {}  # Store partial packets until complete
+    tshark_process = None
+    decoder = EKDecoder()
+    pending = 0
     
     try:
         # Check if running as root (required for packet capture)
@@ -10,13 +14,11 @@ def start_capture(network_interface='any'):
                 "message": "Not running with sudo privileges. Real traffic capture requires sudo."
             })
             
-        # Use tshark to capture network traffic with more verbose output
-        # -V produces verbose output with all fields
-        # -T json outputs as JSON
-        # -e fields select specific fields for extraction
+        # Use tshark to capture network traffic
+        # -T ek outputs one JSON document per line with all fields
         tshark_cmd = [
-            "tshark", "-i", network_interface, "-T", "json", 
-            "-l", "-V", "-n", "-q",
+            "tshark", "-i", network_interface, "-T", "ek", 
+            "-l", "-n",
             # Capture HTTP, DNS, and other application layer data
             "-d", "tcp.port==80,http", 
             "-d", "tcp.port==443,tls",
@@ -25,18 +27,17 @@ def start_capture(network_interface='any'):
         
         print(f"Running command: {' '.join(tshark_cmd)}")
         
+        # Binary pipes: TsharkReader drains both of them on its own threads
         tshark_process = subprocess.Popen(
             tshark_cmd,
             stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            bufsize=1  # Line buffered
+            stderr=subprocess.PIPE
         )
         
         # Check for immediate startup errors
         time.sleep(0.5)
         if tshark_process.poll() is not None:
-            error_output = tshark_process.stderr.read()
+            error_output = tshark_process.stderr.read().decode(errors='replace')
             print(f"tshark failed to start: {error_output}")
             socketio.emit('error', {
                 "message": f"Failed to start packet capture: {error_output}"
@@ -44,6 +45,7 @@ def start_capture(network_interface='any'):
             return
             
         print(f"tshark started successfully on interface {network_interface}")
+        reader = TsharkReader(tshark_process, decoder).start()
         
         # Notify client that capture has started successfully
         socketio.emit('captureStatus', {
@@ -51,84 +53,38 @@ def start_capture(network_interface='any'):
             "message": f"Packet capture started on {network_interface}"
         })
         
-        buffer = ""
         packet_count = 0
         last_update_time = time.time()
-        update_batch = []
         
-        while True:
-            # Process stderr to catch warnings but don't stop on them
-            error = tshark_process.stderr.readline()
-            if error:
-                print(f"tshark stderr: {error.strip()}", file=sys.stderr)
+        while not reader.finished:
+            # Report tshark warnings but don't stop on them
+            for error in reader.stderr_lines():
+                print(f"tshark stderr: {error}", file=sys.stderr)
                 if "Permission denied" in error:
                     socketio.emit('error', {
                         "message": "Permission denied. Please run the server with sudo privileges."
                     })
-                    break
+                    return
             
-            # Process stdout for packet data
-            output = tshark_process.stdout.readline()
-            if output == "" and tshark_process.poll() is not None:
-                print("tshark process ended")
-                break
-                
-            if output:
-                # Check if the line is a complete JSON object 
-                try:
-                    # Clean the output and try to parse it
-                    cleaned_output = output.strip()
-                    if cleaned_output.startswith('[') and cleaned_output.endswith(']'):
-                        # If it's an array, take the first item
-                        packet_list = json.loads(cleaned_output)
-                        if packet_list and len(packet_list) > 0:
-                            packet = packet_list[0]
-                            visualization_data = aggregator.add_packet(packet)
-                            update_batch.append(visualization_data)
-                            packet_count += 1
-                    elif cleaned_output.startswith('{') and cleaned_output.endswith('}'):
-                        # It's a single packet
-                        packet = json.loads(cleaned_output)
-                        visualization_data = aggregator.add_packet(packet)
-                        update_batch.append(visualization_data)
-                        packet_count += 1
-                    else:
-                        # Incomplete JSON, add to buffer
-                        buffer += output
-                except json.JSONDecodeError:
-                    # Not valid JSON, add to buffer and try to process
-                    buffer += output
-                    
-                    # Try to extract complete JSON objects from buffer
-                    if buffer.strip().startswith('{') and '}' in buffer:
-                        try:
-                            # Find the position of the closing brace
-                            end_pos = buffer.find('}') + 1
-                            json_part = buffer[:end_pos]
-                            buffer = buffer[end_pos:]
-                            
-                            packet = json.loads(json_part)
-                            visualization_data = aggregator.add_packet(packet)
-                            update_batch.append(visualization_data)
-                            packet_count += 1
-                        except json.JSONDecodeError:
-                            # Still not valid JSON
-                            if len(buffer) > 50000:  # Reset if buffer gets too large
-                                print("Buffer overflow, resetting")
-                                buffer = ""
+            # Waits only until packets arrive (or the update interval passes), then
+            # ingests everything already queued as one micro-batch
+            added = aggregator.add_packets(reader.get_batch(timeout=0.5))
+            pending += added
+            packet_count += added
             
             # Send batch updates every 0.5 seconds to reduce network traffic
             current_time = time.time()
-            if update_batch and (current_time - last_update_time > 0.5 or len(update_batch) >= 10):
-                # Send the most recent update
-                recent_update = update_batch[-1]
-                socketio.emit('networkUpdate', recent_update)
+            if pending and (current_time - last_update_time > 0.5 or pending >= 10):
+                # Send only what changed since the last update
+                delta = aggregator.flush_delta()
+                if delta:
+                    socketio.emit('networkDelta', delta)
                 
                 # Log statistics
-                print(f"Processed {packet_count} packets, {len(recent_update['hosts'])} hosts, {len(recent_update['streams'])} streams")
+                print(f"Processed {packet_count} packets, {len(aggregator.hosts)} hosts, {len(aggregator.streams)} streams")
                 
                 # Reset batch tracking
-                update_batch = []
+                pending = 0
                 last_update_time = current_time
                     
     except Exception as e:
@@ -140,8 +96,9 @@ def start_capture(network_interface='any'):
         })
     finally:
         # Send final update if there are any pending
-        if update_batch:
-            socketio.emit('networkUpdate', update_batch[-1])
+        delta = aggregator.flush_delta()
+        if delta:
+            socketio.emit('networkDelta', delta)
             
         if tshark_process and tshark_process.poll() is None:
             print("Terminating tshark process...")
@@ -20,6 +20,12 @@ except ImportError:
     print("Please run: source venv/bin/activate && pip install flask flask-socketio flask-cors")
     sys.exit(1)
 
+# Shared modules live in the repository root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from protocol_classifier import load_classifier
+
+PROTOCOL_CLASSIFIER = load_classifier()
+
 # Create Flask app
 app = Flask(__name__)
 CORS(app)
@@ -143,20 +149,7 @@ class NetworkTrafficAggregator:
         return host
 
     def _get_protocol(self, packet: Dict[str, Any]) -> str:
-        layers = packet["_source"]["layers"]
-        if "http" in layers:
-            return "HTTP"
-        elif "tls" in layers:
-            return "HTTPS"
-        elif "dns" in layers:
-            return "DNS"
-        elif "icmp" in layers:
-            return "ICMP"
-        elif "tcp" in layers:
-            return "TCP"
-        elif "udp" in layers:
-            return "UDP"
-        return "OTHER"
+        return PROTOCOL_CLASSIFIER.classify_packet(packet)
 
     def _extract_tcp_flags(self, packet: Dict[str, Any]) -> Optional[Dict[str, bool]]:
         layers = packet["_source"]["layers"]
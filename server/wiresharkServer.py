@@ -4,6 +4,7 @@ import signal
 import subprocess
 import sys
 import time
+import os
 from dataclasses import dataclass, field, asdict
 from typing import Dict, List, Optional, Any, Tuple
 import random
@@ -12,6 +13,12 @@ from flask import Flask, jsonify, request
 from flask_cors import CORS
 from flask_socketio import SocketIO, emit, disconnect
 
+# Shared modules live in the repository root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from protocol_classifier import load_classifier
+
+PROTOCOL_CLASSIFIER = load_classifier()
+
 app = Flask(__name__)
 CORS(app)
 socketio = SocketIO(app, cors_allowed_origins=["http://localhost:5173", 
@@ -97,12 +104,7 @@ class NetworkTrafficAggregator:
         return host
 
     def _get_protocol(self, packet: Dict[str, Any]) -> str:
-        layers = packet["_source"]["layers"]
-        if "tcp" in layers:
-            return "TCP"
-        elif "udp" in layers:
-            return "UDP"
-        return "OTHER"
+        return PROTOCOL_CLASSIFIER.classify_packet(packet)
 
     def _get_visualization_data(self) -> Dict[str, Any]:
         return {
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""Fixed-memory summaries for high-cardinality traffic"""
+import array
+import hashlib
+import heapq
+import math
+import sys
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Tuple
+
+
+class CountMinSketch:
+    """Approximate per-key totals in `depth` rows of `width` counters
+
+    Estimates never undercount; they overcount by at most 2/width of the total
+    weight with probability 1 - 0.5**depth. Keys are hashed by their str()
+    with BLAKE2b, so estimates are the same in every process.
+    """
+
+    def __init__(self, width: int = 4096, depth: int = 4):
+        self.width = width
+        self.depth = depth
+        self.total = 0
+        self._rows = [[0] * width for _ in range(depth)]
+
+    def _indexes(self, key: Hashable):
+        # Double hashing: row i uses h1 + i*h2
+        h = int.from_bytes(hashlib.blake2b(str(key).encode(), digest_size=8).digest(), "big")
+        h1 = h & 0xFFFFFFFF
+        h2 = ((h >> 32) & 0xFFFFFFFF) | 1
+        width = self.width
+        return [(h1 + i * h2) % width for i in range(self.depth)]
+
+    def add(self, key: Hashable, weight: int = 1) -> int:
+        """Count weight for key and return its new estimate"""
+        self.total += weight
+        estimate = None
+        for row, index in zip(self._rows, self._indexes(key)):
+            row[index] += weight
+            if estimate is None or row[index] < estimate:
+                estimate = row[index]
+        return estimate
+
+    def estimate(self, key: Hashable) -> int:
+        return min(row[index] for row, index in zip(self._rows, self._indexes(key)))
+
+    def to_bytes(self) -> bytes:
+        values = array.array("q", [self.width, self.depth, self.total])
+        for row in self._rows:
+            values.extend(row)
+        if sys.byteorder == "big":
+            values.byteswap()
+        return values.tobytes()
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "CountMinSketch":
+        values = array.array("q", data)
+        if sys.byteorder == "big":
+            values.byteswap()
+        width, depth, total = values[:3]
+        if len(values) != 3 + width * depth:
+            raise ValueError(f"Count-Min sketch of {len(data)} bytes does not hold {depth} rows of {width}")
+        sketch = cls(width, depth)
+        sketch.total = total
+        sketch._rows = [values[3 + i * width:3 + (i + 1) * width].tolist() for i in range(depth)]
+        return sketch
+
+
+class SpaceSaving:
+    """Track the `capacity` heaviest keys of a stream (Space-Saving)
+
+    Tracked keys are counted exactly from the moment they are admitted. In
+    the classic algorithm a new key always replaces the lightest one and
+    inherits its count. With an `admission` sketch, a new key replaces it only
+    once its sketch estimate is larger, so a flood of one-off keys (a scan)
+    cannot push out real heavy hitters.
+    """
+
+    def __init__(self, capacity: int, admission: Optional[CountMinSketch] = None):
+        self.capacity = capacity
+        self.admission = admission
+        self.counts: Dict[Hashable, int] = {}
+        # (count, key) min-heap; entries go stale as counts grow and are refreshed lazily
+        self._heap: List[Tuple[int, Any]] = []
+
+    def offer(self, key: Hashable, weight: int = 1) -> Tuple[bool, Optional[Hashable]]:
+        """Count weight for key; return (key is tracked, key evicted to make room or None)"""
+        estimate = self.admission.add(key, weight) if self.admission is not None else None
+        counts = self.counts
+        if key in counts:
+            counts[key] += weight
+            return True, None
+
+        count = estimate if estimate is not None else weight
+        if len(counts) < self.capacity:
+            counts[key] = count
+            heapq.heappush(self._heap, (count, key))
+            return True, None
+        if not self.capacity:
+            return False, None
+
+        lightest, lightest_count = self._lightest()
+        if estimate is None:
+            count = lightest_count + weight
+        elif estimate <= lightest_count:
+            return False, None
+
+        del counts[lightest]
+        counts[key] = count
+        heapq.heapreplace(self._heap, (count, key))
+        return True, lightest
+
+    def load(self, counts: Dict[Hashable, int]):
+        """Track keys with saved counts (from .counts), without counting them in the admission sketch"""
+        self.counts = dict(counts)
+        self._heap = [(count, key) for key, count in self.counts.items()]
+        heapq.heapify(self._heap)
+
+    def _lightest(self) -> Tuple[Hashable, int]:
+        heap = self._heap
+        counts = self.counts
+        while True:
+            count, key = heap[0]
+            actual = counts.get(key)
+            if actual is None:
+                heapq.heappop(heap)
+            elif actual != count:
+                heapq.heapreplace(heap, (actual, key))
+            else:
+                return key, count
+
+    def discard(self, key: Hashable):
+        """Stop tracking key (its heap entry is dropped lazily)"""
+        if self.counts.pop(key, None) is not None and len(self._heap) > 2 * self.capacity:
+            self._heap = [(count, tracked) for tracked, count in self.counts.items()]
+            heapq.heapify(self._heap)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self.counts
+
+    def __len__(self) -> int:
+        return len(self.counts)
+
+    def top(self, n: Optional[int] = None) -> List[Tuple[Hashable, int]]:
+        """Tracked keys, heaviest first"""
+        ranked = sorted(self.counts.items(), key=lambda item: item[1], reverse=True)
+        return ranked if n is None else ranked[:n]
+
+
+# 2**-rank for every possible register value
+_INVERSE_POWERS = [2.0 ** -rank for rank in range(65)]
+
+
+class HyperLogLog:
+    """Approximate count of distinct values in 2**precision one-byte registers
+
+    Standard error is about 1.04 / sqrt(2**precision), 6.5% at the default
+    precision of 8 (256 bytes). Values are hashed with BLAKE2b rather than
+    hash(), so sketches built in different processes, windows or capture
+    sources can be merged. Registers are allocated on the first add.
+    """
+
+    __slots__ = ("precision", "registers", "_count")
+
+    def __init__(self, precision: int = 8):
+        self.precision = precision
+        self.registers: Optional[bytearray] = None
+        self._count: Optional[int] = 0  # Cached estimate, None once registers change
+
+    @staticmethod
+    def hash(value: str) -> int:
+        """Stable 64-bit hash of value"""
+        return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+
+    def add(self, value: str) -> bool:
+        return self.add_hash(self.hash(value))
+
+    def add_hash(self, value_hash: int) -> bool:
+        """Count a value by its hash(); True if the sketch changed"""
+        registers = self.registers
+        if registers is None:
+            registers = self.registers = bytearray(1 << self.precision)
+        bits = 64 - self.precision
+        index = value_hash >> bits
+        rank = bits - (value_hash & ((1 << bits) - 1)).bit_length() + 1
+        if rank > registers[index]:
+            registers[index] = rank
+            self._count = None
+            return True
+        return False
+
+    def merge(self, other: "HyperLogLog"):
+        """Add other's values to this sketch (union)"""
+        if other.precision != self.precision:
+            raise ValueError("Cannot merge HyperLogLog sketches of different precision")
+        if other.registers is None:
+            return
+        if self.registers is None:
+            self.registers = bytearray(other.registers)
+        else:
+            self.registers = bytearray(map(max, self.registers, other.registers))
+        self._count = None
+
+    def count(self) -> int:
+        if self._count is None:
+            registers = self.registers
+            m = len(registers)
+            alpha = 0.7213 / (1 + 1.079 / m)
+            estimate = alpha * m * m / sum(map(_INVERSE_POWERS.__getitem__, registers))
+            zeros = registers.count(0)
+            if estimate <= 2.5 * m and zeros:
+                # Small cardinalities: linear counting is more accurate
+                estimate = m * math.log(m / zeros)
+            self._count = int(round(estimate))
+        return self._count
+
+    def to_bytes(self) -> bytes:
+        return bytes([self.precision]) + (self.registers or bytes(1 << self.precision))
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "HyperLogLog":
+        sketch = cls(data[0])
+        if data.count(0, 1) < len(data) - 1:
+            sketch.registers = bytearray(data[1:])
+            sketch._count = None
+        return sketch
+
+    @classmethod
+    def unpack_many(cls, data: bytes, lengths: Iterable[int]) -> List["HyperLogLog"]:
+        """Sketches from to_bytes() values stored back to back, `lengths` bytes each
+
+        A value of just the precision byte is an empty sketch. For restoring
+        many sketches at once, skipping from_bytes()' per-sketch slicing and checks.
+        """
+        sketches = []
+        new = cls.__new__
+        end = 0
+        for length in lengths:
+            start = end
+            end += length
+            sketch = new(cls)
+            sketch.precision = data[start]
+            if length > 1:
+                sketch.registers = bytearray(data[start + 1:end])
+                sketch._count = None
+            else:
+                sketch.registers = None
+                sketch._count = 0
+            sketches.append(sketch)
+        return sketches
@@ -3,7 +3,7 @@ import { Canvas, useFrame } from '@react-three/fiber';
 import { OrbitControls, Html, Stars } from '@react-three/drei';
 import * as THREE from 'three';
 import { io, Socket } from 'socket.io-client';
-import { WiresharkData, NetworkHost, NetworkStream } from '../types/wireshark';
+import { WiresharkData, NetworkDelta, NetworkHost, NetworkStream } from '../types/wireshark';
 import TestTrafficControls from './TestTrafficControls';
 import PacketInspector, { DetailedPacket } from './PacketInspector';
 
@@ -371,6 +371,21 @@ const calculateNodePositions = (hosts: NetworkHost[]): Map<string, [number, numb
   return positions;
 };
 
+const streamKey = (stream: NetworkStream): string => `${stream.source}-${stream.target}-${stream.protocol}`;
+
+// Merge a networkDelta into the current graph, keeping existing order for unchanged entities
+const applyNetworkDelta = (data: WiresharkData, delta: NetworkDelta): WiresharkData => {
+  const hosts = new Map(data.hosts.map(host => [host.id, host] as [string, NetworkHost]));
+  const streams = new Map(data.streams.map(stream => [streamKey(stream), stream] as [string, NetworkStream]));
+
+  delta.removedHosts.forEach(id => hosts.delete(id));
+  delta.removedStreams.forEach(key => streams.delete(key));
+  delta.hosts.forEach(host => hosts.set(host.id, host));
+  delta.streams.forEach(stream => streams.set(streamKey(stream), stream));
+
+  return { hosts: Array.from(hosts.values()), streams: Array.from(streams.values()) };
+};
+
 const NetworkGraph: React.FC<{ 
   data: WiresharkData;
   onSelectConnection: (sourceId: string, targetId: string, protocol: string) => void;
@@ -535,6 +550,10 @@ export const NetworkVisualization: React.FC<NetworkVisualizationProps> = ({
         setData(newData);
       });
 
+      socketRef.current.on('networkDelta', (delta: NetworkDelta) => {
+        setData(prev => applyNetworkDelta(prev, delta));
+      });
+
       socketRef.current.on('disconnect', (reason) => {
         console.log('Disconnected from server:', reason);
         setIsConnected(false);
@@ -1,8 +1,12 @@
 export interface NetworkHost {
+  // "other" collects hosts outside the top K in heavy-hitter mode
   id: string;
   ip: string;
   packets: number;
   bytesTransferred: number;
+  // HyperLogLog estimates (about 6% error): addresses talked to, destination ports sent to
+  distinctPeers: number;
+  distinctPorts: number;
 }
 
 export interface NetworkStream {
@@ -17,4 +21,146 @@ export interface NetworkStream {
 export interface WiresharkData {
   hosts: NetworkHost[];
   streams: NetworkStream[];
-}
\ No newline at end of file
+}
+
+// Changes since the previous update; removedStreams holds "source-target-protocol" keys
+export interface NetworkDelta {
+  hosts: NetworkHost[];
+  streams: NetworkStream[];
+  removedHosts: string[];
+  removedStreams: string[];
+}
+
+// Sent as networkRates; each list follows `windows` (seconds). Entities without
+// traffic in the longest window are omitted.
+export interface TrafficRates {
+  packetsPerSecond: number[];
+  bytesPerSecond: number[];
+}
+
+export interface NetworkRates {
+  time: number;
+  windows: number[];
+  hosts: Record<string, TrafficRates>;
+  streams: Record<string, TrafficRates>;
+}
+
+// A subnet drawn in place of its hosts; ip holds the CIDR, like id
+export interface SubnetNode extends Omit<NetworkHost, 'distinctPeers' | 'distinctPorts'> {
+  hostCount: number;
+  prefixLength: number | null;
+}
+
+// Reply to requestGraphView: hosts are subnets except inside expanded ones
+export interface NetworkView {
+  prefixLength: 8 | 16 | 24 | 32 | 48 | 64 | null;
+  expand: string[];
+  hosts: Array<SubnetNode | NetworkHost>;
+  streams: NetworkStream[];
+}
+
+// One connection from the flow table; the client sent the SYN (or the first packet seen)
+export interface NetworkFlow {
+  id: string;
+  client: string;
+  clientPort: string | null;
+  server: string;
+  serverPort: string | null;
+  // Host ids, null once the host has expired or is folded into "other"
+  clientId: string | null;
+  serverId: string | null;
+  transport: 'tcp' | 'udp' | 'ip';
+  protocol: string;
+  state: 'SYN_SENT' | 'SYN_RECEIVED' | 'ESTABLISHED' | 'CLOSING' | 'CLOSED' | 'RESET' | 'ACTIVE';
+  start: number;
+  lastSeen: number;
+  duration: number;
+  packets: number;
+  bytes: number;
+  packetsToServer: number;
+  packetsToClient: number;
+  bytesToServer: number;
+  bytesToClient: number;
+  // Handshake SYN to ACK in ms, null if the handshake was not seen
+  rtt: number | null;
+  retransmissions: number;
+  outOfOrder: number;
+}
+
+// Reply to requestFlows, most recently active first
+export interface FlowView {
+  hostIds: string[];
+  flows: NetworkFlow[];
+}
+
+// Reply to requestHistoryGraph (and GET /history/graph): traffic in [from, to) ms from the
+// packet history. Hosts are identified by address; with a limit, only the streams with the
+// most bytes and their hosts are included, out of totalStreams
+export interface HistoryGraph {
+  from: number;
+  to: number;
+  hosts: Array<Pick<NetworkHost, 'id' | 'ip' | 'packets' | 'bytesTransferred'>>;
+  streams: Array<{
+    source: string;
+    target: string;
+    protocol: string;
+    packets: number;
+    bytes: number;
+    // Time of the last packet in the range
+    timestamp: number;
+  }>;
+  totalStreams: number;
+}
+
+// searchPackets fields; a packet must match all that are given
+export interface PacketSearchQuery {
+  ip?: string;
+  port?: string | number;
+  dnsName?: string;
+  httpHost?: string;
+  httpUri?: string;
+}
+
+// Reply to searchPackets: a page of matching stored packets, newest first. Packets have the
+// shape sent as packetDetails plus the key of their stream; request the next page with
+// beforeId set to nextBeforeId (null on the last page)
+export interface PacketSearchResults {
+  query: PacketSearchQuery;
+  packets: Array<Record<string, unknown> & { id: string; streamId: string }>;
+  streams: Array<{ id: string; packets: number }>;
+  total: number;
+  nextBeforeId: number | null;
+}
+
+export interface IngestQueueStats {
+  policy: 'block' | 'drop-newest' | 'drop-oldest' | 'sample';
+  capacity: number;
+  received: number;
+  enqueued: number;
+  dropped: number;
+  processed: number;
+  pending: number;
+}
+
+// Detailed packets retained for the packet inspector, under MAX_RETAINED_PACKETS
+export interface PacketStoreStats {
+  packets: number;
+  maxPackets: number;
+  streams: number;
+  estimatedBytes: number;
+  evictedPackets: number;
+  evictedStreams: number;
+}
+
+export interface CaptureStatus {
+  status: 'started' | 'running' | 'replaying' | 'completed' | 'stopped';
+  message: string;
+  stats?: {
+    packets: number;
+    bytes?: number;
+    errors: number;
+    packetsPerSecond: number;
+    queue?: IngestQueueStats;
+  };
+  packetStore?: PacketStoreStats;
+}
@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+"""Subnet rollups of the host graph for level-of-detail views"""
+import ipaddress
+import socket
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from checkpoint import pack_array, unpack_array
+
+# (IPv4, IPv6) prefix lengths of each rollup level, coarsest first
+ROLLUP_LEVELS = ((8, 32), (16, 48), (24, 64))
+
+
+def rollup_level(prefix_length: int) -> int:
+    """Index in ROLLUP_LEVELS of an IPv4 or IPv6 prefix length"""
+    for level, lengths in enumerate(ROLLUP_LEVELS):
+        if prefix_length in lengths:
+            return level
+    raise ValueError(f"No rollup level for prefix length {prefix_length}")
+
+
+class SubnetNode:
+    """Traffic of the hosts in one subnet at one level"""
+
+    __slots__ = ("key", "id", "level", "prefix_length", "parents", "hosts", "packets", "bytes")
+
+    def __init__(self, key: Tuple[int, Any], subnet_id: str, level: int, prefix_length: Optional[int],
+                 parents: Tuple["SubnetNode", ...]):
+        self.key = key
+        self.id = subnet_id
+        self.level = level
+        self.prefix_length = prefix_length  # None for hosts that are not addresses
+        self.parents = parents  # Enclosing subnets, coarsest first
+        self.hosts = 0
+        self.packets = 0
+        self.bytes = 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        # Same shape as a host, so clients can draw subnets as nodes
+        return {
+            "id": self.id,
+            "ip": self.id,
+            "packets": self.packets,
+            "bytesTransferred": self.bytes,
+            "hostCount": self.hosts,
+            "prefixLength": self.prefix_length
+        }
+
+
+class SubnetStream:
+    """Traffic between two subnets over one protocol at one level"""
+
+    __slots__ = ("source", "target", "protocol", "streams", "packets", "bytes", "timestamp")
+
+    def __init__(self, source: SubnetNode, target: SubnetNode, protocol: str):
+        self.source = source
+        self.target = target
+        self.protocol = protocol
+        self.streams = 0
+        self.packets = 0
+        self.bytes = 0
+        self.timestamp = 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "source": self.source.id,
+            "target": self.target.id,
+            "protocol": self.protocol,
+            "packets": self.packets,
+            "bytes": self.bytes,
+            "timestamp": self.timestamp
+        }
+
+
+class SubnetRollup:
+    """Per-level subnet nodes and streams, updated with every host and stream change
+
+    Each host and stream keeps references to its subnet entries at every level,
+    so counting a packet is a few additions and nothing is recomputed. Removing
+    a stream subtracts its totals, so each level always sums to the live graph.
+    """
+
+    def __init__(self):
+        self.nodes: List[Dict[Tuple[int, Any], SubnetNode]] = [{} for _ in ROLLUP_LEVELS]
+        self.streams: List[Dict[Tuple[str, str, str], SubnetStream]] = [{} for _ in ROLLUP_LEVELS]
+        self._host_subnets: Dict[str, Tuple[SubnetNode, ...]] = {}
+        self._stream_links: Dict[str, Tuple[SubnetStream, ...]] = {}
+
+    @staticmethod
+    def _address(ip: str) -> Optional[Tuple[int, int, int]]:
+        """(family, address as int, address bits), or None if ip is not an address"""
+        for family, bits in ((socket.AF_INET, 32), (socket.AF_INET6, 128)):
+            try:
+                return family, int.from_bytes(socket.inet_pton(family, ip), "big"), bits
+            except OSError:
+                pass
+        return None
+
+    def add_host(self, host_id: str, ip: str):
+        address = self._address(ip)
+        subnets: List[SubnetNode] = []
+        for level, lengths in enumerate(ROLLUP_LEVELS):
+            if address is None:
+                # Names and placeholders such as "other" are their own subnet at every level
+                key = (0, ip)
+                prefix_length = None
+            else:
+                family, value, bits = address
+                prefix_length = lengths[0] if family == socket.AF_INET else lengths[1]
+                key = (family, value >> (bits - prefix_length))
+            node = self.nodes[level].get(key)
+            if node is None:
+                subnet_id = ip if address is None else str(ipaddress.ip_network(
+                    (key[1] << (bits - prefix_length), prefix_length)))
+                node = self.nodes[level][key] = SubnetNode(key, subnet_id, level, prefix_length, tuple(subnets))
+            node.hosts += 1
+            subnets.append(node)
+        self._host_subnets[host_id] = tuple(subnets)
+
+    def remove_host(self, host_id: str):
+        """Forget a host; subnets left without hosts are dropped"""
+        for level, node in enumerate(self._host_subnets.pop(host_id, ())):
+            node.hosts -= 1
+            if not node.hosts:
+                del self.nodes[level][node.key]
+
+    def add_stream(self, stream_key: str, source_id: str, target_id: str, protocol: str):
+        links = []
+        for level, (source, target) in enumerate(zip(self._host_subnets[source_id], self._host_subnets[target_id])):
+            key = (source.id, target.id, protocol)
+            link = self.streams[level].get(key)
+            if link is None:
+                link = self.streams[level][key] = SubnetStream(source, target, protocol)
+            link.streams += 1
+            links.append(link)
+        self._stream_links[stream_key] = tuple(links)
+
+    def remove_stream(self, stream_key: str, packets: int, bytes_transferred: int):
+        """Forget a stream and subtract its totals; subnet streams left empty are dropped"""
+        self.count(stream_key, -packets, -bytes_transferred)
+        for level, link in enumerate(self._stream_links.pop(stream_key, ())):
+            link.streams -= 1
+            if not link.streams:
+                del self.streams[level][link.source.id, link.target.id, link.protocol]
+
+    def count(self, stream_key: str, packets: int, bytes_transferred: int, timestamp: float = 0.0):
+        """Add a stream's new traffic to every level"""
+        for link in self._stream_links.get(stream_key, ()):
+            link.packets += packets
+            link.bytes += bytes_transferred
+            if timestamp > link.timestamp:
+                link.timestamp = timestamp
+            link.source.packets += packets
+            link.source.bytes += bytes_transferred
+            link.target.packets += packets
+            link.target.bytes += bytes_transferred
+
+    def to_sections(self, refs: Callable[[Iterable[Optional[str]]], bytes], host_ids: List[str],
+                    stream_keys: List[str]) -> Dict[str, bytes]:
+        """Every level's subnets and subnet streams as checkpoint sections
+
+        refs() packs strings as string table indexes (see
+        NetworkTrafficAggregator.to_checkpoint). Each host and stream is saved as
+        the positions of its subnet entries, in host_ids and stream_keys order.
+        """
+        sections = {}
+        host_subnets = list(map(self._host_subnets.__getitem__, host_ids))
+        stream_links = list(map(self._stream_links.__getitem__, stream_keys))
+        # Positions by id() of the previous level's nodes, for the parent column
+        parents: Dict[int, int] = {}
+        for level, (nodes, links) in enumerate(zip(self.nodes, self.streams)):
+            nodes = list(nodes.values())
+            positions = {id(node): i for i, node in enumerate(nodes)}
+            links = list(links.values())
+            link_positions = {id(link): i for i, link in enumerate(links)}
+            prefix = f"rollup.{level}."
+            sections.update({
+                prefix + "nodes.family": pack_array("B", [node.key[0] for node in nodes]),
+                prefix + "nodes.value": pack_array("Q", [node.key[1] if node.key[0] else 0 for node in nodes]),
+                prefix + "nodes.id": refs(node.id for node in nodes),
+                prefix + "nodes.prefixLength": pack_array(
+                    "h", [-1 if node.prefix_length is None else node.prefix_length for node in nodes]),
+                prefix + "nodes.parent": pack_array(
+                    "i", [parents[id(node.parents[-1])] if node.parents else -1 for node in nodes]),
+                prefix + "nodes.hosts": pack_array("q", [node.hosts for node in nodes]),
+                prefix + "nodes.packets": pack_array("q", [node.packets for node in nodes]),
+                prefix + "nodes.bytes": pack_array("q", [node.bytes for node in nodes]),
+                prefix + "links.source": pack_array("I", [positions[id(link.source)] for link in links]),
+                prefix + "links.target": pack_array("I", [positions[id(link.target)] for link in links]),
+                prefix + "links.protocol": refs(link.protocol for link in links),
+                prefix + "links.streams": pack_array("q", [link.streams for link in links]),
+                prefix + "links.packets": pack_array("q", [link.packets for link in links]),
+                prefix + "links.bytes": pack_array("q", [link.bytes for link in links]),
+                prefix + "links.timestamp": pack_array("d", [link.timestamp for link in links]),
+                prefix + "hosts": pack_array("I", [positions[id(subnets[level])] for subnets in host_subnets]),
+                prefix + "streams": pack_array("I", [link_positions[id(links_of[level])] for links_of in stream_links])
+            })
+            parents = positions
+        return sections
+
+    def load_sections(self, sections: Dict[str, bytes], strs: Callable[[str], List[Optional[str]]],
+                      host_ids: List[str], stream_keys: List[str]):
+        """Restore an empty rollup from to_sections() sections, without recomputing any subnet
+
+        strs(name) unpacks a section saved with refs().
+        """
+        host_subnets = []
+        stream_links = []
+        parents: List[SubnetNode] = []
+        for level in range(len(ROLLUP_LEVELS)):
+            prefix = f"rollup.{level}."
+
+            def column(name: str, typecode: str) -> Any:
+                return unpack_array(typecode, sections[prefix + name])
+
+            nodes = []
+            for family, value, subnet_id, prefix_length, parent, hosts, packets, bytes_transferred in zip(
+                    column("nodes.family", "B"), column("nodes.value", "Q"), strs(prefix + "nodes.id"),
+                    column("nodes.prefixLength", "h"), column("nodes.parent", "i"), column("nodes.hosts", "q"),
+                    column("nodes.packets", "q"), column("nodes.bytes", "q")):
+                enclosing = parents[parent].parents + (parents[parent],) if parent >= 0 else ()
+                node = SubnetNode((family, value) if family else (0, subnet_id), subnet_id, level,
+                                  None if prefix_length < 0 else prefix_length, enclosing)
+                node.hosts = hosts
+                node.packets = packets
+                node.bytes = bytes_transferred
+                nodes.append(node)
+            self.nodes[level] = {node.key: node for node in nodes}
+
+            links = []
+            for source, target, protocol, streams, packets, bytes_transferred, timestamp in zip(
+                    column("links.source", "I"), column("links.target", "I"), strs(prefix + "links.protocol"),
+                    column("links.streams", "q"), column("links.packets", "q"), column("links.bytes", "q"),
+                    column("links.timestamp", "d")):
+                link = SubnetStream(nodes[source], nodes[target], protocol)
+                link.streams = streams
+                link.packets = packets
+                link.bytes = bytes_transferred
+                link.timestamp = timestamp
+                links.append(link)
+            self.streams[level] = {(link.source.id, link.target.id, link.protocol): link for link in links}
+
+            host_subnets.append([nodes[i] for i in column("hosts", "I")])
+            stream_links.append([links[i] for i in column("streams", "I")])
+            parents = nodes
+        self._host_subnets = dict(zip(host_ids, zip(*host_subnets)))
+        self._stream_links = dict(zip(stream_keys, zip(*stream_links)))
+
+    def view(self, level: int, expand: Iterable[str] = (),
+             hosts: Optional[Dict[str, Any]] = None, streams: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Graph with subnets of `level` as nodes, each subnet in `expand` replaced by its children
+
+        Expanding a subnet of the finest level shows its hosts, which then come
+        from `hosts` and `streams` (the aggregator's NetworkHost/NetworkStream dicts).
+        """
+        expanded: Set[str] = set(expand)
+        if not expanded:
+            return {
+                "hosts": [node.to_dict() for node in self.nodes[level].values()],
+                "streams": [link.to_dict() for link in self.streams[level].values()]
+            }
+
+        # Aggregate from just below the deepest expanded subnet
+        depth = max((node.level for nodes in self.nodes[level:] for node in nodes.values()
+                     if node.id in expanded), default=level - 1) + 1
+        depth = max(depth, level)
+        if depth >= len(ROLLUP_LEVELS) and hosts is not None:
+            members = [(host.id, host, self._host_subnets[host.id]) for host in hosts.values()]
+            links = [(stream.source, stream.target, stream.protocol, stream) for stream in streams.values()]
+        else:
+            depth = min(depth, len(ROLLUP_LEVELS) - 1)
+            members = [(node.id, node, node.parents) for node in self.nodes[depth].values()]
+            links = [(link.source.id, link.target.id, link.protocol, link) for link in self.streams[depth].values()]
+
+        shown: Dict[str, Any] = {}
+        node_of: Dict[str, str] = {}
+        for member_id, member, ancestors in members:
+            chain = ancestors[level:] + (member,)
+            i = 0
+            while i < len(chain) - 1 and chain[i].id in expanded:
+                i += 1
+            node = chain[i]
+            shown[node.id] = node
+            node_of[member_id] = node.id
+
+        merged: Dict[Tuple[str, str, str], Dict[str, Any]] = {}
+        for source_id, target_id, protocol, link in links:
+            key = (node_of[source_id], node_of[target_id], protocol)
+            entry = merged.get(key)
+            if entry is None:
+                entry = merged[key] = {"source": key[0], "target": key[1], "protocol": protocol,
+                                       "packets": 0, "bytes": 0, "timestamp": 0.0}
+            entry["packets"] += link.packets
+            entry["bytes"] += link.bytes
+            entry["timestamp"] = max(entry["timestamp"], link.timestamp)
+
+        return {"hosts": [node.to_dict() for node in shown.values()], "streams": list(merged.values())}
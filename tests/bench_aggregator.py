@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""Micro-benchmarks for NetworkTrafficAggregator
+
+Not part of the unit test suite; run directly:
+
+    python tests/bench_aggregator.py
+"""
+
+import gc
+import sys
+import os
+import time
+import tracemalloc
+
+# Add the parent directory to the path so we can import the modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from checkpoint import decode_checkpoint, encode_checkpoint
+from packet_store import PacketRing, PacketStore
+from protocol_classifier import ProtocolClassifier
+from serve_visualization import NetworkTrafficAggregator
+
+def int_to_ip(value):
+    return f"{value >> 24 & 255}.{value >> 16 & 255}.{value >> 8 & 255}.{value & 255}"
+
+def bench_host_lookup(host_counts=(10, 1000, 100000, 1000000), lookups=200000):
+    """Per-packet host lookup cost against the number of known hosts"""
+    print("Host lookup (source + destination _get_or_create_host per packet)")
+    for host_count in host_counts:
+        aggregator = NetworkTrafficAggregator()
+        ips = [int_to_ip(0x0A000000 + i) for i in range(host_count)]
+        for ip in ips:
+            aggregator._get_or_create_host(ip)
+
+        # Cycle through existing hosts so every lookup is a hit
+        pairs = [(ips[i % host_count], ips[(i * 7 + 1) % host_count]) for i in range(lookups)]
+        get_or_create_host = aggregator._get_or_create_host
+        started = time.perf_counter()
+        for src_ip, dst_ip in pairs:
+            get_or_create_host(src_ip)
+            get_or_create_host(dst_ip)
+        elapsed = time.perf_counter() - started
+
+        print(f"  {host_count:>9,} hosts: {elapsed / lookups * 1e9:8.0f} ns/packet")
+
+def make_packet(src_ip, dst_ip):
+    return {
+        "_source": {
+            "layers": {
+                "frame": {"frame.time_epoch": "1700000000.5"},
+                "ip": {"ip.src": src_ip, "ip.dst": dst_ip, "ip.len": "100"},
+                "tcp": {"tcp.srcport": "40000", "tcp.dstport": "443"}
+            }
+        }
+    }
+
+def bench_add_packets(packet_count=100000, batch_size=1000, conversations=50):
+    """add_packet per packet against add_packets micro-batches"""
+    print(f"Ingest of {packet_count:,} packets over {conversations} conversations")
+    packets = [make_packet(int_to_ip(0x0A000000 + i % conversations), "10.1.0.1") for i in range(packet_count)]
+
+    aggregator = NetworkTrafficAggregator()
+    started = time.perf_counter()
+    for packet in packets:
+        aggregator.add_packet(packet)
+    single = time.perf_counter() - started
+
+    aggregator = NetworkTrafficAggregator()
+    started = time.perf_counter()
+    for i in range(0, packet_count, batch_size):
+        aggregator.add_packets(packets[i:i + batch_size])
+    batched = time.perf_counter() - started
+
+    print(f"  add_packet:               {single / packet_count * 1e9:8.0f} ns/packet")
+    print(f"  add_packets ({batch_size:>5} each): {batched / packet_count * 1e9:8.0f} ns/packet")
+
+def bench_memory(stream_count=2000, packets_per_stream=100):
+    """Retained bytes per stored packet and per stream (hosts, stream and its packet list)"""
+    print(f"Memory for {stream_count:,} streams x {packets_per_stream} packets")
+    records = []
+    for i in range(stream_count * packets_per_stream):
+        stream = i % stream_count
+        flags = "0x0018" if i % 3 else "0x0010"
+        records.append((str(1700000000 + i / 1000), "eth:ethertype:ip:tcp", int_to_ip(0x0A000000 + stream),
+                        int_to_ip(0x0A800000 + stream), "1500", "64", str(30000 + stream), "443", "", "", flags,
+                        str(1 + i // stream_count * 1460), "1460"))
+
+    tracemalloc.start()
+    aggregator = NetworkTrafficAggregator()
+    aggregator.max_packets_per_stream = packets_per_stream
+    for i in range(0, len(records), 10000):
+        aggregator.add_summaries(records[i:i + 10000])
+    aggregator.flush_delta()
+    total = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    packet_count = sum(len(packets) for packets in aggregator.packets.values())
+    print(f"  total:      {total / 2 ** 20:8.1f} MiB")
+    print(f"  per packet: {total / packet_count:8.0f} bytes")
+    print(f"  per stream: {total / stream_count:8.0f} bytes")
+
+def bench_packet_ring(capacities=(100, 1000, 10000), appends=200000):
+    """Appending to a full stream: list.pop(0) trimming against PacketRing and PacketStore.add"""
+    print("Append to a full packet store")
+    for capacity in capacities:
+        packets = list(range(capacity))
+        started = time.perf_counter()
+        for i in range(appends):
+            packets.append(i)
+            packets.pop(0)
+        shifted = time.perf_counter() - started
+
+        ring = PacketRing(capacity)
+        for i in range(capacity):
+            ring.append(i)
+        started = time.perf_counter()
+        for i in range(appends):
+            ring.append(i)
+        ringed = time.perf_counter() - started
+
+        store = PacketStore(capacity_per_stream=capacity)
+        for i in range(capacity):
+            store.add("stream", i)
+        started = time.perf_counter()
+        for i in range(appends):
+            store.add("stream", i)
+        stored = time.perf_counter() - started
+
+        print(f"  capacity {capacity:>6,}: list.pop(0) {shifted / appends * 1e9:6.0f} ns, "
+              f"PacketRing {ringed / appends * 1e9:6.0f} ns, PacketStore.add {stored / appends * 1e9:6.0f} ns")
+
+def bench_packet_details(packet_count=50000, requested=100):
+    """Parsing HTTP/payload packets, whose details are decoded only when requested"""
+    print(f"Parse {packet_count:,} HTTP packets with payloads, then request {requested} details")
+    packets = []
+    for i in range(packet_count):
+        packet = make_packet("10.0.0.1", "10.1.0.1")
+        packet["_source"]["layers"]["http"] = {"http.request.method": "GET", "http.request.uri": f"/item/{i}",
+                                               "http.host": "example.com", "http.user_agent": "bench"}
+        packet["_source"]["layers"]["data"] = {"data.data": "68656c6c6f20776f726c64" * 20}
+        packets.append(packet)
+
+    started = time.perf_counter()
+    records = [NetworkTrafficAggregator.extract_record(packet) for packet in packets]
+    parsed = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for _, _, _, _, _, detailed_packet in records[:requested]:
+        detailed_packet.to_dict()
+    decoded = time.perf_counter() - started
+
+    print(f"  extract_record: {parsed / packet_count * 1e9:8.0f} ns/packet")
+    print(f"  to_dict:        {decoded / requested * 1e9:8.0f} ns/requested packet")
+
+def legacy_get_protocol(packet):
+    """The if/elif chain protocol_classifier replaced (destination ports only), for comparison"""
+    layers = packet["_source"]["layers"]
+    if "http" in layers:
+        return "HTTP"
+    elif "tls" in layers:
+        return "HTTPS"
+    elif "dns" in layers:
+        return "DNS"
+    if "tcp" in layers:
+        tcp_layer = layers["tcp"]
+        if "tcp.dstport" in tcp_layer:
+            dst_port = tcp_layer["tcp.dstport"]
+            if dst_port == "80":
+                return "HTTP"
+            elif dst_port == "443":
+                return "HTTPS"
+            elif dst_port == "22":
+                return "SSH"
+            elif dst_port == "21":
+                return "FTP"
+            elif dst_port == "23":
+                return "TELNET"
+        return "TCP"
+    elif "udp" in layers:
+        udp_layer = layers["udp"]
+        if "udp.dstport" in udp_layer:
+            dst_port = udp_layer["udp.dstport"]
+            if dst_port == "53":
+                return "DNS"
+            elif dst_port == "123":
+                return "NTP"
+            elif dst_port == "67" or dst_port == "68":
+                return "DHCP"
+        return "UDP"
+    elif "icmp" in layers:
+        return "ICMP"
+    return "OTHER"
+
+def bench_protocol_classifier(packet_count=200000):
+    """ProtocolClassifier against the old if/elif chain on a mix of ports and layers"""
+    print(f"Classify {packet_count:,} packets")
+    classifier = ProtocolClassifier()
+    shapes = [{"tcp": {"tcp.srcport": "40000", "tcp.dstport": port}} for port in ("443", "80", "23", "8080")]
+    shapes += [{"udp": {"udp.srcport": "40000", "udp.dstport": port}} for port in ("53", "68", "5000")]
+    shapes += [{"tcp": {"tcp.srcport": "40000", "tcp.dstport": "80"}, "http": {}}, {"icmp": {}}]
+    packets = [{"_source": {"layers": shapes[i % len(shapes)]}} for i in range(packet_count)]
+    
+    for name, classify in (("if/elif chain", legacy_get_protocol), ("ProtocolClassifier", classifier.classify_packet)):
+        started = time.perf_counter()
+        for packet in packets:
+            classify(packet)
+        elapsed = time.perf_counter() - started
+        print(f"  {name:<18} {elapsed / packet_count * 1e9:6.0f} ns/packet")
+
+def bench_checkpoint(stream_count=200000, packets_per_stream=5):
+    """Checkpoint encode/decode and restore time for a graph of many streams"""
+    print(f"Checkpoint of {stream_count:,} streams x {packets_per_stream} packets")
+    aggregator = NetworkTrafficAggregator()
+    aggregator.idle_ttl = 0
+    batch = []
+    for i in range(stream_count * packets_per_stream):
+        stream = i % stream_count
+        batch.append((str(1700000000 + i / 1000), "eth:ethertype:ip:tcp", int_to_ip(0x0A000000 + stream % 65536),
+                      int_to_ip(0x0B000000 + stream), "1500", "64", str(30000 + stream % 30000), "443", "", "",
+                      "0x0018", str(1 + i // stream_count * 1460), "1460"))
+        if len(batch) == 10000:
+            aggregator.add_summaries(batch)
+            batch = []
+    aggregator.add_summaries(batch)
+
+    started = time.perf_counter()
+    data = encode_checkpoint(aggregator.to_checkpoint())
+    encoded = time.perf_counter() - started
+    # As restore_checkpoint does, keep the collector out of the restore
+    gc.disable()
+    started = time.perf_counter()
+    restored = NetworkTrafficAggregator.from_checkpoint(decode_checkpoint(data))
+    decoded = time.perf_counter() - started
+    gc.enable()
+    assert len(restored.streams) == stream_count
+    print(f"  size:     {len(data) / 2 ** 20:6.1f} MiB")
+    print(f"  encode:   {encoded:6.2f} s ({encoded / stream_count * 1e6:.1f} us/stream)")
+    print(f"  restore:  {decoded:6.2f} s ({decoded / stream_count * 1e6:.1f} us/stream)")
+
+BENCHMARKS = [bench_host_lookup, bench_add_packets, bench_memory, bench_packet_ring, bench_packet_details,
+              bench_protocol_classifier, bench_checkpoint]
+
+if __name__ == "__main__":
+    selected = sys.argv[1:]
+    for benchmark in BENCHMARKS:
+        if not selected or benchmark.__name__ in selected:
+            benchmark()
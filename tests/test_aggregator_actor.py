@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+
+import unittest
+import sys
+import os
+import threading
+
+# Add the parent directory to the path so we can import the modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aggregator_actor import AggregatorActor
+from serve_visualization import NetworkTrafficAggregator
+
+def summary(src, dst, timestamp="1700000000.0"):
+    return (timestamp, "ip:udp", src, dst, "60", "64", "", "", "5000", "53", "", "", "")
+
+class TestAggregatorActor(unittest.TestCase):
+    def setUp(self):
+        self.ticks = []
+        self.replaced = []
+        self.actor = AggregatorActor(on_tick=lambda aggregator, now: self.ticks.append(now),
+                                     on_replace=self.replaced.append, interval=0.01)
+
+    def tearDown(self):
+        self.actor.stop()
+
+    def test_concurrent_sources_feed_one_graph(self):
+        """Batches from several threads all land in the one aggregator, never half-applied"""
+        self.actor.start()
+        self.actor.attach(NetworkTrafficAggregator)
+        aggregator = self.actor.aggregator
+
+        def produce(source):
+            self.actor.attach(NetworkTrafficAggregator)
+            for i in range(50):
+                self.actor.ingest('add_summaries', [summary(f"10.{source}.0.1", f"10.{source}.0.{i % 5 + 2}")] * 4)
+            self.actor.detach()
+
+        producers = [threading.Thread(target=produce, args=(source,)) for source in range(4)]
+        for producer in producers:
+            producer.start()
+        while any(producer.is_alive() for producer in producers):
+            # Every read sees a whole number of batches
+            packets = self.actor.call(lambda a: sum(stream.packets for stream in a.streams.values()))
+            self.assertEqual(packets % 4, 0)
+        for producer in producers:
+            producer.join()
+
+        self.assertIs(self.actor.aggregator, aggregator)
+        self.assertEqual(self.replaced, [aggregator])
+        self.assertEqual(self.actor.call(lambda a: a.packets.total), 800)
+        self.assertEqual(len(self.actor.snapshot()["streams"]), 20)
+        self.actor.detach()
+        self.assertEqual(self.actor.status["packetStore"]["packets"], 800)
+        self.assertTrue(self.ticks)
+
+    def test_snapshot_is_reused_until_the_graph_changes(self):
+        self.assertIsNone(self.actor.snapshot())
+        self.actor.replace(NetworkTrafficAggregator())
+        self.actor.ingest('add_summaries', [summary("10.0.0.1", "10.0.0.2")])
+        snapshot = self.actor.snapshot()
+        self.assertIs(self.actor.snapshot(), snapshot)
+        self.actor.ingest('add_summaries', [summary("10.0.0.1", "10.0.0.3")])
+        self.assertIsNot(self.actor.snapshot(), snapshot)
+        self.assertEqual(len(self.actor.snapshot()["hosts"]), 3)
+
+    def test_replay_clock(self):
+        """Without a live source, idle entries age by the replay's clock"""
+        replay_clock = lambda aggregator: aggregator.last_timestamp / 1000
+        self.actor.attach(NetworkTrafficAggregator, replay_clock)
+        self.actor.ingest('add_summaries', [summary("10.0.0.1", "10.0.0.2", "1500000000.0")])
+        self.actor.detach(replay_clock)
+        self.assertEqual(self.ticks, [1500000000.0])
+
+        # The next source after an idle period starts a new graph
+        first = self.actor.aggregator
+        self.actor.attach(NetworkTrafficAggregator)
+        self.assertIsNot(self.actor.aggregator, first)
+
+    def test_errors_reach_the_caller(self):
+        self.actor.start()
+        self.actor.replace(NetworkTrafficAggregator())
+        with self.assertRaises(ValueError):
+            self.actor.call(lambda aggregator: aggregator.view(12))
+        # A bad batch is logged and skipped
+        self.actor.ingest('add_summaries', [("bad",)])
+        self.actor.ingest('add_summaries', [summary("10.0.0.1", "10.0.0.2")])
+        self.assertEqual(self.actor.call(lambda aggregator: len(aggregator.hosts)), 2)
+
+if __name__ == "__main__":
+    unittest.main()
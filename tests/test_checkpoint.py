@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+
+import unittest
+import sys
+import os
+import threading
+import tempfile
+
+# Add the parent directory to the path so we can import the modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from checkpoint import (FORMAT_VERSION, CheckpointError, Checkpointer, decode_checkpoint, encode_checkpoint,
+                        iter_checkpoints, pack_array, pack_strings, read_checkpoint, unpack_array, unpack_strings)
+
+class TestCheckpoint(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "state.ckpt")
+        self.sections = {"meta": b'{"a": 1}', "empty": b"", "numbers": pack_array("q", [1, -2, 3])}
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_round_trip(self):
+        for compress in (True, False):
+            sections = decode_checkpoint(encode_checkpoint(self.sections, compress))
+            self.assertEqual(sections, self.sections)
+        self.assertEqual(list(unpack_array("q", sections["numbers"])), [1, -2, 3])
+        self.assertEqual(unpack_strings(pack_strings(["10.0.0.1", "", "443"])), ["10.0.0.1", "", "443"])
+        self.assertEqual(unpack_strings(pack_strings([""])), [""])
+        self.assertEqual(unpack_strings(pack_strings([])), [])
+
+    def test_rejects_bad_files(self):
+        data = bytearray(encode_checkpoint(self.sections))
+        with self.assertRaisesRegex(CheckpointError, "damaged"):
+            decode_checkpoint(bytes(data[:-1]))
+        data[-1] ^= 0xFF
+        with self.assertRaisesRegex(CheckpointError, "damaged"):
+            decode_checkpoint(bytes(data))
+        for version in (FORMAT_VERSION - 1, FORMAT_VERSION + 1):
+            data[8] = version
+            with self.assertRaisesRegex(CheckpointError, "version"):
+                decode_checkpoint(bytes(data))
+        with self.assertRaisesRegex(CheckpointError, "Not a checkpoint"):
+            decode_checkpoint(b"x" * 64)
+
+    def test_log(self):
+        """Checkpoints appended back to back decode in order, up to a torn tail"""
+        first = encode_checkpoint(self.sections)
+        second = encode_checkpoint({"meta": b"{}"})
+        log = first + second + second[:-3]
+        self.assertEqual(list(iter_checkpoints(log)), [(self.sections, len(first)), ({"meta": b"{}"}, len(second))])
+        self.assertEqual(list(iter_checkpoints(b"")), [])
+
+    def test_checkpointer(self):
+        """Due checkpoints are snapshotted by the caller and written in the background; save() writes one at once"""
+        checkpointer = Checkpointer(self.path, interval=0.01)
+        builders = []
+        def build():
+            builders.append(threading.current_thread())
+            return self.sections
+        self.assertFalse(checkpointer.maybe_save(build))
+        checkpointer._last -= 1
+        self.assertTrue(checkpointer.maybe_save(build))
+        self.assertEqual(builders, [threading.current_thread()])
+        checkpointer.poll(block=True)
+        self.assertEqual(checkpointer.written, 1)
+        self.assertEqual(read_checkpoint(self.path), self.sections)
+
+        checkpointer.save(lambda: {"meta": b"{}"})
+        self.assertEqual((checkpointer.written, checkpointer.failed), (2, 0))
+        self.assertEqual(read_checkpoint(self.path), {"meta": b"{}"})
+        self.assertFalse(os.path.exists(self.path + ".tmp"))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+
+import unittest
+import sys
+import os
+from types import SimpleNamespace
+
+# Add the parent directory to the path so we can import the modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flow_table import ACK, FIN, RST, SYN, FlowTable
+
+CLIENT = ("10.0.0.1", "40000")
+SERVER = ("10.0.0.2", "443")
+
+def segment(timestamp, source, target, flags, seq=None, tcp_len=0):
+    return SimpleNamespace(sourceIP=source[0], sourcePort=source[1], destinationIP=target[0],
+                           destinationPort=target[1], protocol="HTTPS", tcpFlags=flags, tcpSeq=seq,
+                           tcpLen=tcp_len, timestamp=float(timestamp), length=40 + tcp_len)
+
+class TestFlowTable(unittest.TestCase):
+    def setUp(self):
+        self.table = FlowTable()
+
+    def handshake(self):
+        self.table.add(segment(0, CLIENT, SERVER, SYN, seq=100))
+        self.table.add(segment(10, SERVER, CLIENT, SYN | ACK, seq=500))
+        return self.table.add(segment(25, CLIENT, SERVER, ACK, seq=101))
+
+    def test_connection_lifecycle(self):
+        """Both directions share one flow that follows the TCP handshake and teardown"""
+        flow = self.handshake()
+        self.assertEqual(flow.state, "ESTABLISHED")
+        self.assertEqual(flow.rtt, 25)
+
+        self.table.add(segment(30, CLIENT, SERVER, ACK, seq=101, tcp_len=100))
+        self.table.add(segment(40, SERVER, CLIENT, ACK, seq=501, tcp_len=1000))
+        self.table.add(segment(50, CLIENT, SERVER, FIN | ACK, seq=201))
+        self.assertEqual(flow.state, "CLOSING")
+        self.table.add(segment(60, SERVER, CLIENT, FIN | ACK, seq=1501))
+        self.assertEqual(flow.state, "CLOSED")
+
+        self.assertEqual(len(self.table), 1)
+        view = self.table.view()[0]
+        self.assertEqual((view["client"], view["clientPort"], view["server"], view["serverPort"]),
+                         CLIENT + SERVER)
+        self.assertEqual((view["packetsToServer"], view["packetsToClient"]), (4, 3))
+        self.assertEqual(view["bytesToClient"], 3 * 40 + 1000)
+        self.assertEqual((view["start"], view["duration"]), (0.0, 60.0))
+        self.assertEqual((view["retransmissions"], view["outOfOrder"]), (0, 0))
+
+    def test_retransmission_and_reordering(self):
+        """A late resend is a retransmission; a segment filling a fresh gap is out of order"""
+        flow = self.handshake()
+        self.table.add(segment(30, CLIENT, SERVER, ACK, seq=101, tcp_len=100))
+        self.table.add(segment(31, CLIENT, SERVER, ACK, seq=301, tcp_len=100))
+        self.table.add(segment(32, CLIENT, SERVER, ACK, seq=201, tcp_len=100))
+        self.assertEqual((flow.retransmissions, flow.out_of_order), (0, 1))
+
+        self.table.add(segment(500, CLIENT, SERVER, ACK, seq=101, tcp_len=100))
+        self.assertEqual((flow.retransmissions, flow.out_of_order), (1, 1))
+        # Pure ACKs carry no data and are never counted
+        self.table.add(segment(501, CLIENT, SERVER, ACK, seq=101))
+        self.assertEqual(flow.retransmissions, 1)
+
+    def test_sequence_wraparound(self):
+        flow = self.table.add(segment(0, CLIENT, SERVER, ACK, seq=2 ** 32 - 50, tcp_len=100))
+        self.table.add(segment(1, CLIENT, SERVER, ACK, seq=50, tcp_len=100))
+        self.assertEqual((flow.retransmissions, flow.out_of_order), (0, 0))
+        self.assertEqual(flow.state, "ESTABLISHED")
+
+    def test_reset_and_port_reuse(self):
+        """A SYN on a reset 5-tuple starts a new flow"""
+        flow = self.handshake()
+        self.table.add(segment(30, SERVER, CLIENT, RST | ACK, seq=501))
+        self.assertEqual(flow.state, "RESET")
+
+        reused = self.table.add(segment(100, CLIENT, SERVER, SYN, seq=9000))
+        self.assertIsNot(reused, flow)
+        self.assertEqual((reused.state, reused.first_seen), ("SYN_SENT", 100.0))
+        self.assertEqual(len(self.table), 1)
+
+    def test_midstream_and_udp(self):
+        """Flows seen without a SYN are established; a lone SYN/ACK names its sender the server"""
+        midstream = self.table.add(segment(0, SERVER, CLIENT, ACK, seq=1, tcp_len=10))
+        self.assertEqual((midstream.state, midstream.client_ip), ("ESTABLISHED", SERVER[0]))
+
+        late = self.table.add(segment(0, ("10.0.0.3", "443"), ("10.0.0.4", "50000"), SYN | ACK, seq=7))
+        self.assertEqual((late.client_ip, late.state), ("10.0.0.4", "SYN_RECEIVED"))
+
+        udp = self.table.add(segment(0, ("10.0.0.1", "5353"), ("10.0.0.5", "53"), None))
+        self.assertEqual((udp.transport, udp.state, udp.rtt), ("udp", "ACTIVE", None))
+
+    def test_expiry_and_capacity(self):
+        """Idle flows expire oldest first and the table never exceeds max_flows"""
+        table = FlowTable(max_flows=2)
+        for i in range(3):
+            table.add(segment(i * 1000, (f"10.0.0.{i + 1}", "40000"), SERVER, SYN, seq=0))
+        self.assertEqual(len(table), 2)
+        self.assertEqual(table.evicted, 1)
+        self.assertEqual([flow["client"] for flow in table.view()], ["10.0.0.3", "10.0.0.2"])
+        self.assertEqual([flow["client"] for flow in table.view(ips=["10.0.0.3"])], ["10.0.0.3"])
+        self.assertEqual(len(table.view(limit=1)), 1)
+
+        self.assertEqual(table.expire(1500), 1)
+        self.assertEqual([flow["client"] for flow in table.view()], ["10.0.0.3"])
+        self.assertIsNone(FlowTable(max_flows=0).add(segment(0, CLIENT, SERVER, SYN)))
+
+if __name__ == "__main__":
+    unittest.main()
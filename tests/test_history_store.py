@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+
+import unittest
+import sys
+import os
+import tempfile
+import time
+
+# Add the parent directory to the path so we can import the modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from history_store import HOUR, HOUR_SUFFIX, INDEX_SUFFIX, HistoryStore
+from serve_visualization import DetailedPacket, NetworkTrafficAggregator
+
+def packet(packet_id, timestamp, src="10.0.0.1", dst="10.0.0.2"):
+    return DetailedPacket(id=packet_id, timestamp=timestamp, sourceIP=src, destinationIP=dst, protocol="DNS",
+                          length=60, ttl=64, sourcePort="5000", destinationPort="53")
+
+class TestHistoryStore(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = self.directory.name
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_write_and_query(self):
+        """Packets survive a reopen; time and host queries skip segments that cannot match"""
+        store = HistoryStore(self.path, block_packets=10)
+        for i in range(25):
+            store.append(packet(i + 1, 1000.0 * i))
+        store.flush()
+        # A separate segment for a later host
+        store.close()
+        store = HistoryStore(self.path)
+        store.append(packet(26, 50000.0, src="10.0.0.9"))
+        store.close()
+
+        store = HistoryStore(self.path)
+        self.assertEqual([segment.blocks for segment in store.segments], [3, 1])
+        self.assertEqual(store.stats()["packets"], 26)
+        records = list(store.records(5000, 8000))
+        self.assertEqual([record[0] for record in records], [6, 7, 8])
+        self.assertEqual(records[0], (6, 5000.0, "10.0.0.1", "10.0.0.2", "DNS", 60, 5000, 53, 64, -1))
+        self.assertEqual(len(store.segments_between(start=30000)), 1)
+        self.assertEqual(len(store.segments_between(ip="10.0.0.9")), 1)
+        self.assertEqual([record[0] for record in store.records(ip="10.0.0.9")], [26])
+        self.assertEqual(store.segments_between(end=0), [])
+        store.close()
+
+    def test_recovers_unsealed_segment(self):
+        """A segment left without an index (crash) is re-indexed, ignoring a torn last block"""
+        store = HistoryStore(self.path, block_packets=5)
+        for i in range(10):
+            store.append(packet(i + 1, 1000.0 * i))
+        store.close()
+        (segment,) = store.segments
+        os.remove(segment.path[:-4] + INDEX_SUFFIX)
+        with open(segment.path, "ab") as f:
+            f.write(b"AWXCKPT\n\x01\x00")
+
+        store = HistoryStore(self.path)
+        self.assertEqual(store.segments[0].packets, 10)
+        self.assertEqual(store.segments[0].hosts, {"10.0.0.1", "10.0.0.2"})
+        self.assertEqual(len(list(store.records())), 10)
+        store.close()
+
+    def test_rollover_and_retention(self):
+        """Segments roll over by size; the oldest are deleted past max_bytes"""
+        store = HistoryStore(self.path, block_packets=1, segment_bytes=1, max_bytes=2000)
+        for i in range(20):
+            store.append(packet(i + 1, 1000.0 * i))
+        store.close()
+        segments = store.segments
+        self.assertLess(len(segments), 20)
+        self.assertLessEqual(sum(segment.size for segment in segments), 2000)
+        self.assertEqual(segments[-1].min_time, 19000.0)
+        self.assertEqual(sorted(os.listdir(self.path)),
+                         sorted(os.path.basename(segment.path[:-4]) + suffix
+                                for segment in segments for suffix in (".seg", INDEX_SUFFIX)))
+
+        # Hour files go with the segments they count
+        store = HistoryStore(self.path)
+        self.assertEqual(store.graph(0, HOUR)["streams"][0]["packets"], sum(segment.packets for segment in segments))
+        self.assertIn("00000000" + HOUR_SUFFIX, os.listdir(self.path))
+        store.close()
+        HistoryStore(self.path, max_bytes=1).close()
+        self.assertEqual(os.listdir(self.path), [])
+
+    def test_graph(self):
+        """Range graphs from hour files, minute rollups and raw edges match a scan of the packets"""
+        start = 1700000000000.0
+        store = HistoryStore(self.path, block_packets=7)
+        for segment in range(3):
+            for i in range(60):
+                timestamp = start + segment * 2000000 + i * 40000
+                store.append(packet(segment * 60 + i + 1, timestamp, dst=f"10.0.0.{2 + min(i % 4, 2)}"))
+            store.close()
+            store = HistoryStore(self.path, block_packets=7)
+        # Still being written
+        store.append(packet(181, start + 6500000, dst="10.0.0.9"))
+        store.flush()
+        while store.active is None:
+            time.sleep(0.01)
+        self.assertTrue(any(name.endswith(HOUR_SUFFIX) for name in os.listdir(self.path)))
+
+        records = list(store.records())
+        for first, last in ((start, start + 7000000), (start + 1234.5, start + 5 * HOUR / 3),
+                            (start + 61000, start + 61500), (start + 6400000, start + 6600000)):
+            expected = {}
+            for record in records:
+                if first <= record[1] < last:
+                    row = expected.setdefault((record[2], record[3], record[4]), [0, 0, 0])
+                    row[0] += 1
+                    row[1] += record[5]
+                    row[2] = max(row[2], record[1])
+            graph = store.graph(first, last)
+            self.assertEqual({(stream["source"], stream["target"], stream["protocol"]):
+                              [stream["packets"], stream["bytes"], stream["timestamp"]]
+                              for stream in graph["streams"]}, expected)
+        store.close()
+
+        # Hour files survive a restart, and a limit keeps the streams with the most bytes
+        store = HistoryStore(self.path)
+        graph = store.graph(start, start + 7000000, limit=1)
+        self.assertEqual(graph["totalStreams"], 4)
+        self.assertEqual([(stream["target"], stream["packets"]) for stream in graph["streams"]], [("10.0.0.4", 90)])
+        self.assertEqual({host["ip"]: host["packets"] for host in graph["hosts"]},
+                         {"10.0.0.1": 181, "10.0.0.4": 90})
+        store.close()
+
+    def test_aggregator_appends_stored_packets(self):
+        store = HistoryStore(self.path)
+        aggregator = NetworkTrafficAggregator()
+        aggregator.history = store
+        aggregator.add_summaries([("1700000000.0", "ip:udp", "10.0.0.1", "10.0.0.2", "60", "64",
+                                   "", "", "5000", "53", "", "", "")] * 3)
+        aggregator.add_summary(("1700000001.0", "ip:tcp", "10.0.0.2", "10.0.0.1", "40", "64",
+                                "443", "5001", "", "", "0x0012", "0", "0"))
+        store.close()
+        self.assertEqual([(record[0], record[4], record[9]) for record in store.records()],
+                         [(1, "DNS", -1), (2, "DNS", -1), (3, "DNS", -1), (4, "HTTPS", 0x12)])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+
+import unittest
+import sys
+import os
+from types import SimpleNamespace
+
+# Add the parent directory to the path so we can import the modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from packet_index import PacketIndex, packet_terms
+from packet_store import PacketStore
+
+def packet(packet_id, src="10.0.0.1", dst="10.0.0.2", sport="5000", dport="53", layers=None):
+    return SimpleNamespace(id=packet_id, sourceIP=src, destinationIP=dst, sourcePort=sport,
+                           destinationPort=dport, layers=layers)
+
+def dns(name):
+    return {"dns": {"dns.qry.name": name}}
+
+class TestPacketIndex(unittest.TestCase):
+    def setUp(self):
+        self.index = PacketIndex()
+        self.store = PacketStore(capacity_per_stream=3, max_packets=6, on_evict=self.index.remove)
+
+    def add(self, stream_key, item):
+        self.index.replace(stream_key, item, self.store.add(stream_key, item))
+
+    def ids(self, result):
+        return [(stream_key, item.id) for stream_key, item in result["packets"]]
+
+    def test_terms(self):
+        http = {"http": {"http.host": "Example.COM", "http.request.uri": ["/a", "/b"]}}
+        self.assertEqual(packet_terms(packet(1, sport="80", dport="80", layers=http)),
+                         {("ip", "10.0.0.1"), ("ip", "10.0.0.2"), ("port", "80"), ("httpHost", "example.com"),
+                          ("httpUri", "/a"), ("httpUri", "/b")})
+        self.assertEqual(packet_terms(packet(2, sport=None, layers=dns("Example.com."))),
+                         {("ip", "10.0.0.1"), ("ip", "10.0.0.2"), ("port", "53"), ("dnsName", "example.com")})
+        # Each term once, however often the packet holds it; addresses in their canonical spelling
+        self.assertEqual(packet_terms(packet(3, src="2001:DB8:0:0::1", dst="2001:db8::1",
+                                             layers=dns(["a.example", "A.example."]))),
+                         {("ip", "2001:db8::1"), ("port", "5000"), ("port", "53"), ("dnsName", "a.example")})
+
+    def test_duplicate_terms_count_once(self):
+        """A packet to itself, or naming one host twice, is one match for the term"""
+        self.add("1-1-DNS", packet(1, dst="10.0.0.1", layers=dns(["a.example", "a.example"])))
+        result = self.index.search(self.store, {"ip": "10.0.0.1"})
+        self.assertEqual((self.ids(result), result["streams"]), ([("1-1-DNS", 1)], {"1-1-DNS": 1}))
+        self.assertEqual(self.index.search(self.store, {"dnsName": "a.example"})["total"], 1)
+
+    def test_ipv6_spellings(self):
+        self.add("1-2-DNS", packet(1, src="2001:DB8::0:1", dst="::ffff:10.0.0.2"))
+        for spelling in ("2001:db8::1", "2001:0DB8:0000::1", " 2001:db8:0:0:0:0:0:1 "):
+            self.assertEqual(self.ids(self.index.search(self.store, {"ip": spelling})), [("1-2-DNS", 1)])
+        self.assertEqual(self.index.search(self.store, {"ip": "::FFFF:10.0.0.2"})["total"], 1)
+
+    def test_search(self):
+        """Single terms come from the counts, several terms only match packets holding them all"""
+        self.add("1-2-DNS", packet(1, layers=dns("example.com")))
+        self.add("1-2-DNS", packet(2, layers=dns("other.org")))
+        self.add("3-2-DNS", packet(3, src="10.0.0.3", layers=dns("example.com")))
+        self.add("1-4-RDP", packet(4, dst="10.0.0.4", dport="3389"))
+
+        result = self.index.search(self.store, {"dnsName": "EXAMPLE.com."})
+        self.assertEqual(self.ids(result), [("3-2-DNS", 3), ("1-2-DNS", 1)])
+        self.assertEqual((result["streams"], result["total"]), ({"1-2-DNS": 1, "3-2-DNS": 1}, 2))
+        self.assertEqual(self.ids(self.index.search(self.store, {"port": 3389})), [("1-4-RDP", 4)])
+
+        result = self.index.search(self.store, {"ip": "10.0.0.1", "dnsName": "other.org"})
+        self.assertEqual((self.ids(result), result["total"]), ([("1-2-DNS", 2)], 1))
+        self.assertEqual(self.index.search(self.store, {"ip": "10.0.0.3", "port": "3389"})["total"], 0)
+
+        # Pages, newest first
+        self.assertEqual(self.ids(self.index.search(self.store, {"ip": "10.0.0.1"}, limit=2)),
+                         [("1-4-RDP", 4), ("1-2-DNS", 2)])
+        self.assertEqual(self.ids(self.index.search(self.store, {"ip": "10.0.0.1"}, limit=2, before_id=2)),
+                         [("1-2-DNS", 1)])
+
+        with self.assertRaises(ValueError):
+            self.index.search(self.store, {"mac": "00:00:00:00:00:00"})
+        with self.assertRaises(ValueError):
+            self.index.search(self.store, {})
+
+    def test_follows_the_store(self):
+        """Overwritten, evicted and popped packets leave the index, so it stays as small as the store"""
+        for i in range(1, 11):
+            self.add("1-2-DNS", packet(i, sport=str(5000 + i), layers=dns(f"host{i}.example.com")))
+        self.assertEqual(self.index.search(self.store, {"dnsName": "host1.example.com"})["total"], 0)
+        self.assertEqual(self.index.search(self.store, {"ip": "10.0.0.1"})["total"], 3)
+        # 2 addresses, port 53, and a client port and name for each of 3 packets
+        self.assertEqual(self.index.stats(), {"terms": 9, "entries": 9})
+
+        for i in range(11, 18):
+            self.add(f"stream-{i}", packet(i, src=f"10.1.0.{i}"))
+        self.assertNotIn("1-2-DNS", self.store)
+        self.assertEqual(self.index.search(self.store, {"port": "53"})["total"], self.store.total)
+        self.store.pop("stream-17")
+        self.assertEqual(self.index.search(self.store, {"ip": "10.0.0.2"})["streams"],
+                         {f"stream-{i}": 1 for i in range(12, 17)})
+        self.assertEqual(self.index.stats()["entries"], 5 * 4)
+
+if __name__ == "__main__":
+    unittest.main()
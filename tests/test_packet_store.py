@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+
+import unittest
+import sys
+import os
+from types import SimpleNamespace
+
+# Add the parent directory to the path so we can import the modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from packet_store import PacketRing, PacketStore
+
+def packet(packet_id):
+    return SimpleNamespace(id=packet_id)
+
+def ids(packets):
+    return [item.id for item in packets]
+
+class TestPacketRing(unittest.TestCase):
+    def test_wraps_without_growing(self):
+        """A full ring overwrites its oldest packet and reports the eviction"""
+        ring = PacketRing(3)
+        evicted = [ring.push(packet(i)) for i in range(1, 8)]
+        
+        self.assertEqual(len(ring), 3)
+        self.assertEqual(ids(item for item in evicted if item), [1, 2, 3, 4])
+        self.assertEqual(ids(ring), [5, 6, 7])
+        self.assertEqual(ids(ring.newest_first()), [7, 6, 5])
+
+    def test_partial_ring(self):
+        ring = PacketRing(100)
+        for i in range(1, 4):
+            ring.append(packet(i))
+        self.assertEqual(ids(ring), [1, 2, 3])
+        self.assertEqual(ids(ring.newest_first()), [3, 2, 1])
+
+    def test_recent(self):
+        """Ranges are read newest-first and returned oldest first"""
+        ring = PacketRing(5)
+        for i in range(1, 10):
+            ring.append(packet(i))
+        
+        self.assertEqual(ids(ring.recent()), [5, 6, 7, 8, 9])
+        self.assertEqual(ids(ring.recent(limit=2)), [8, 9])
+        self.assertEqual(ids(ring.recent(since_id=6)), [7, 8, 9])
+        self.assertEqual(ids(ring.recent(limit=2, since_id=3)), [8, 9])
+        self.assertEqual(ids(ring.recent(since_id=9)), [])
+        self.assertEqual(ids(ring.recent(limit=0)), [])
+
+    def test_zero_capacity(self):
+        ring = PacketRing(0)
+        self.assertEqual(ring.push(packet(1)).id, 1)
+        self.assertEqual(len(ring), 0)
+
+class TestPacketStore(unittest.TestCase):
+    def test_budget_evicts_least_recently_used_stream(self):
+        """Over budget, the stream nobody stored to or viewed lately loses its packets"""
+        store = PacketStore(capacity_per_stream=3, max_packets=6)
+        for i in range(1, 7):
+            store.add(f"stream-{i % 3}", packet(i))
+        self.assertEqual(store.total, 6)
+        
+        # Viewing stream-1 makes stream-2 the coldest
+        store.get("stream-1")
+        store.add("stream-new", packet(7))
+        
+        self.assertNotIn("stream-2", store)
+        self.assertEqual(ids(store["stream-1"]), [1, 4])
+        self.assertEqual(store.total, 5)
+        stats = store.stats()
+        self.assertEqual((stats["evictedStreams"], stats["evictedPackets"], stats["streams"]), (1, 2, 3))
+        self.assertEqual(stats["estimatedBytes"], 5 * 250)
+
+    def test_full_rings_do_not_grow_the_total(self):
+        store = PacketStore(capacity_per_stream=2, max_packets=10)
+        for i in range(100):
+            store.add("scan", packet(i))
+        self.assertEqual(store.total, 2)
+        self.assertEqual(store.pop("scan").capacity, 2)
+        self.assertEqual(store.total, 0)
+
+    def test_reports_packets_leaving(self):
+        """add() returns the packet it overwrote; evicted and popped streams go to on_evict"""
+        left = []
+        store = PacketStore(capacity_per_stream=2, max_packets=3,
+                            on_evict=lambda stream_key, packets: left.append((stream_key, ids(packets))))
+        self.assertIsNone(store.add("a", packet(1)))
+        store.add("a", packet(2))
+        self.assertEqual(store.add("a", packet(3)).id, 1)
+        store.add("b", packet(4))
+        store.add("c", packet(5))
+        store.pop("b")
+        self.assertEqual(left, [("a", [2, 3]), ("b", [4])])
+
+    def test_newest_stream_is_never_evicted(self):
+        store = PacketStore(capacity_per_stream=10, max_packets=3)
+        for i in range(5):
+            store.add("only", packet(i))
+        self.assertEqual(len(store["only"]), 5)
+        store.add("other", packet(5))
+        self.assertEqual(list(store.values())[0], store["other"])
+        self.assertNotIn("only", store)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+
+import unittest
+import sys
+import os
+import socket
+import struct
+import tempfile
+from unittest.mock import patch
+
+# Add the parent directory to the path so we can import the modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pcap_reader import PcapFormatError, PcapReader, read_summaries
+from serve_visualization import NetworkTrafficAggregator
+
+def ethernet(ethertype, payload):
+    return b"\x00" * 12 + struct.pack("!H", ethertype) + payload
+
+def ipv4(src, dst, proto, payload, ttl=64):
+    header = struct.pack("!BBHHHBBH4s4s", 0x45, 0, 20 + len(payload), 0, 0, ttl, proto, 0,
+                         socket.inet_aton(src), socket.inet_aton(dst))
+    return header + payload
+
+def ipv6(src, dst, next_header, payload, hop_limit=64):
+    header = struct.pack("!IHBB16s16s", 6 << 28, len(payload), next_header, hop_limit,
+                         socket.inet_pton(socket.AF_INET6, src), socket.inet_pton(socket.AF_INET6, dst))
+    return header + payload
+
+def tcp(src_port, dst_port, flags, seq=0):
+    return struct.pack("!HHIIHHHH", src_port, dst_port, seq, 0, (5 << 12) | flags, 0, 0, 0)
+
+def udp(src_port, dst_port):
+    return struct.pack("!HHHH", src_port, dst_port, 8, 0)
+
+FRAMES = [
+    (1700000000.25, ethernet(0x0800, ipv4("10.0.0.1", "10.0.0.2", 6, tcp(40000, 443, 0x02, seq=1000)))),
+    (1700000000.5, ethernet(0x0806, b"\x00" * 28)),  # ARP
+    (1700000001.0, ethernet(0x86DD, ipv6("2001:db8::1", "2001:db8::53", 17, udp(5353, 53)))),
+]
+
+def write_pcap(path, frames):
+    with open(path, "wb") as f:
+        f.write(struct.pack("<IHHiIII", 0xA1B2C3D4, 2, 4, 0, 0, 65535, 1))
+        for timestamp, frame in frames:
+            seconds = int(timestamp)
+            micros = round((timestamp - seconds) * 1e6)
+            f.write(struct.pack("<IIII", seconds, micros, len(frame), len(frame)))
+            f.write(frame)
+
+def pcapng_block(block_type, body):
+    body += b"\x00" * (-len(body) % 4)
+    length = len(body) + 12
+    return struct.pack("<II", block_type, length) + body + struct.pack("<I", length)
+
+def write_pcapng(path, frames):
+    with open(path, "wb") as f:
+        f.write(pcapng_block(0x0A0D0D0A, struct.pack("<IHHq", 0x1A2B3C4D, 1, 0, -1)))
+        # Interface with nanosecond resolution (if_tsresol = 9)
+        options = struct.pack("<HHB3x", 9, 1, 9) + struct.pack("<HH", 0, 0)
+        f.write(pcapng_block(1, struct.pack("<HHI", 1, 0, 65535) + options))
+        for timestamp, frame in frames:
+            ticks = round(timestamp * 1e9)
+            f.write(pcapng_block(6, struct.pack("<IIIII", 0, ticks >> 32, ticks & 0xFFFFFFFF,
+                                                len(frame), len(frame)) + frame))
+
+class TestPcapReader(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def check_records(self, path):
+        with PcapReader(path) as reader:
+            records = list(reader)
+            self.assertEqual(reader.skipped, 1)
+
+        self.assertEqual(len(records), 2)
+        tcp_record, udp_record = records
+        self.assertAlmostEqual(tcp_record[0], 1700000000.25, places=5)
+        self.assertEqual(tcp_record[1:8], ("ip:tcp", "10.0.0.1", "10.0.0.2", 40, 64, "40000", "443"))
+        self.assertEqual(tcp_record[10:], (0x02, 1000, 0))
+        self.assertEqual(udp_record[1:4], ("ipv6:udp", "2001:db8::1", "2001:db8::53"))
+        self.assertEqual(udp_record[4], 48)
+        self.assertEqual(udp_record[8:10], ("5353", "53"))
+        return records
+
+    def test_pcap(self):
+        path = os.path.join(self.tmpdir.name, "trace.pcap")
+        write_pcap(path, FRAMES)
+        self.check_records(path)
+
+    def test_pcapng(self):
+        path = os.path.join(self.tmpdir.name, "trace.pcapng")
+        write_pcapng(path, FRAMES)
+        self.check_records(path)
+
+    def test_records_feed_aggregator(self):
+        """Native records go through add_summary like tshark summary lines"""
+        path = os.path.join(self.tmpdir.name, "trace.pcap")
+        write_pcap(path, FRAMES)
+
+        aggregator = NetworkTrafficAggregator()
+        for record in read_summaries(path):
+            aggregator.add_summary(record)
+        result = aggregator._get_visualization_data()
+
+        protocols = sorted(stream["protocol"] for stream in result["streams"])
+        self.assertEqual(protocols, ["DNS", "HTTPS"])
+        packet = aggregator.get_packet_details("1", "2", "HTTPS")[0]
+        self.assertTrue(packet["tcpFlags"]["syn"])
+        self.assertEqual(packet["sourcePort"], "40000")
+
+    def test_pcapng_caplen_past_block(self):
+        """An enhanced packet block claiming more bytes than it holds is reported, not read past"""
+        path = os.path.join(self.tmpdir.name, "corrupt.pcapng")
+        write_pcapng(path, FRAMES[:1])
+        with open(path, "r+b") as f:
+            data = f.read()
+            # The packet block follows the section header and interface blocks
+            idb = struct.unpack_from("<I", data, 4)[0]
+            epb = idb + struct.unpack_from("<I", data, idb + 4)[0]
+            f.seek(epb + 20)
+            f.write(struct.pack("<I", 10000))
+
+        with self.assertRaises(PcapFormatError) as raised:
+            list(read_summaries(path))
+        self.assertIn("captures 10000 bytes", str(raised.exception))
+
+    def test_not_a_capture(self):
+        path = os.path.join(self.tmpdir.name, "notes.txt")
+        with open(path, "wb") as f:
+            f.write(b"this is not a capture file at all")
+        with self.assertRaises(PcapFormatError):
+            list(read_summaries(path))
+
+    @patch('serve_visualization.socketio')
+    def test_native_replay(self, mock_socketio):
+        """start_replay with the native reader ingests the whole file"""
+        import serve_visualization
+        write_pcap(os.path.join(self.tmpdir.name, "trace.pcap"), FRAMES)
+
+        with patch('serve_visualization.CAPTURE_DIR', self.tmpdir.name):
+            serve_visualization.start_replay("trace.pcap", "max", "native")
+
+        events = [call.args for call in mock_socketio.emit.call_args_list]
+        completed = [data for name, data in events if name == 'captureStatus' and data["status"] == "completed"]
+        self.assertEqual(completed[0]["stats"]["packets"], 2)
+        self.assertEqual(completed[0]["stats"]["errors"], 1)
+        deltas = [data for name, data in events if name == 'networkDelta']
+        self.assertEqual(len(deltas), 1)
+        self.assertEqual(len(deltas[0]["hosts"]), 4)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+
+import unittest
+import sys
+import os
+import json
+import tempfile
+
+# Add the parent directory to the path so we can import the modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from protocol_classifier import ProtocolClassifier, load_classifier
+
+def packet(**layers):
+    return {"_source": {"layers": layers}}
+
+class TestProtocolClassifier(unittest.TestCase):
+    def setUp(self):
+        self.classifier = ProtocolClassifier()
+
+    def test_defaults(self):
+        """Application layers win over ports, ports over the bare transport"""
+        cases = [
+            (packet(tcp={"tcp.srcport": "40000", "tcp.dstport": "443"}, http={}), "HTTP"),
+            (packet(udp={"udp.srcport": "40000", "udp.dstport": "9999"}, dns={}), "DNS"),
+            (packet(tcp={"tcp.srcport": "40000", "tcp.dstport": "22"}), "SSH"),
+            (packet(tcp={"tcp.srcport": "40000", "tcp.dstport": "8080"}), "TCP"),
+            (packet(udp={"udp.srcport": "68", "udp.dstport": "67"}), "DHCP"),
+            (packet(udp={"udp.srcport": "40000", "udp.dstport": "5000"}), "UDP"),
+            (packet(icmp={}), "ICMP"),
+            (packet(arp={}), "OTHER"),
+        ]
+        for tshark_packet, expected in cases:
+            self.assertEqual(self.classifier.classify_packet(tshark_packet), expected)
+
+    def test_source_port(self):
+        """Replies are classified like requests, whichever side the well-known port is on"""
+        reply = packet(tcp={"tcp.srcport": "443", "tcp.dstport": "40000"})
+        self.assertEqual(self.classifier.classify_packet(reply), "HTTPS")
+        self.assertEqual(self.classifier.classify_summary(["ip", "udp"], "", "", "53", "40000"), "DNS")
+        # The destination port decides when both are known
+        self.assertEqual(self.classifier.classify_summary(["ip", "tcp"], "22", "80", "", ""), "HTTP")
+
+    def test_rules_file(self):
+        """Rules from a config file extend and override the defaults"""
+        with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as f:
+            json.dump({"layers": [["quic", "QUIC"]], "transports": [["sctp", "SCTP"]],
+                       "ports": {"tcp": {"8080": "HTTP-ALT", "22": "GIT"}, "sctp": {"3868": "DIAMETER"}}}, f)
+        self.addCleanup(os.remove, f.name)
+        classifier = load_classifier(f.name)
+        
+        self.assertEqual(classifier.classify_summary(["ip", "udp", "quic", "dns"], "", "", "443", "40000"), "QUIC")
+        self.assertEqual(classifier.classify_packet(packet(tcp={"tcp.dstport": "8080"})), "HTTP-ALT")
+        self.assertEqual(classifier.classify_packet(packet(tcp={"tcp.dstport": "22"})), "GIT")
+        self.assertEqual(classifier.classify_packet(packet(tcp={"tcp.dstport": "80"})), "HTTP")
+        self.assertEqual(classifier.classify_packet(packet(sctp={"sctp.srcport": "3868", "sctp.dstport": "5000"})),
+                         "DIAMETER")
+        self.assertEqual(classifier.classify_packet(packet(sctp={"sctp.dstport": "5000"})), "SCTP")
+        self.assertEqual(self.classifier.classify_packet(packet(sctp={"sctp.dstport": "3868"})), "OTHER")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+
+import unittest
+import sys
+import os
+
+# Add the parent directory to the path so we can import the modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rate_counter import RATE_WINDOWS, RateCounter
+
+class TestRateCounter(unittest.TestCase):
+    def test_windows(self):
+        """Each window averages the completed seconds it covers"""
+        counter = RateCounter()
+        for second in range(1000, 1060):
+            counter.add(second, 2, 100)
+        counter.add(1059, 8, 400)
+        
+        rates = counter.rates(1060.5)
+        self.assertEqual(RATE_WINDOWS, (1, 10, 60))
+        self.assertEqual(rates["packetsPerSecond"], [10.0, 28 / 10, 128 / 60])
+        self.assertEqual(rates["bytesPerSecond"], [500.0, 1400 / 10, 6400 / 60])
+
+    def test_buckets_are_reused(self):
+        """Old seconds fall out of the ring as time advances, including across gaps"""
+        counter = RateCounter()
+        counter.add(1000, 5, 500)
+        counter.add(1030, 1, 100)
+        self.assertEqual(counter.totals(1030, 60), (6, 600))
+        
+        counter.add(1065, 1, 100)
+        self.assertEqual(counter.totals(1065, 60), (2, 200))
+        counter.add(1500, 3, 300)
+        self.assertEqual(counter.totals(1500, 60), (3, 300))
+        self.assertEqual(len(counter._packets), RateCounter.BUCKETS)
+
+    def test_late_and_idle(self):
+        counter = RateCounter()
+        counter.add(1000, 1, 10)
+        counter.add(990, 1, 10)  # Late, but still inside the ring
+        counter.add(900, 1, 10)  # Too old to count
+        self.assertEqual(counter.totals(1000, 60), (2, 20))
+        
+        self.assertFalse(counter.idle(1060.0))
+        self.assertTrue(counter.idle(1061.0))
+        self.assertEqual(counter.rates(1100)["packetsPerSecond"], [0.0, 0.0, 0.0])
+
+if __name__ == "__main__":
+    unittest.main()
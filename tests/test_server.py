@@ -54,6 +54,117 @@ class TestServer(unittest.TestCase):
         # Check that the test traffic generator was started
         mock_socketio.start_background_task.assert_called_once_with(mock_start_test)
 
+    @patch('serve_visualization.start_capture')
+    @patch('serve_visualization.socketio')
+    def test_start_capture_handler_options(self, mock_socketio, mock_start_capture):
+        """Capture options are checked before a capture starts"""
+        from serve_visualization import handle_start_capture
+        
+        handle_start_capture({"interface": "eth0", "queueSize": "500", "workers": 2, "topK": 0})
+        mock_socketio.start_background_task.assert_called_once_with(
+            mock_start_capture, "eth0", "full", 500, "block", 2, 0)
+        
+        for options in ({"queueSize": "lots"}, {"workers": [1]}, {"topK": None}, {"queueSize": 0},
+                        {"workers": -1}, {"topK": -5}):
+            mock_socketio.reset_mock()
+            handle_start_capture(dict(options, interface="eth0"))
+            mock_socketio.start_background_task.assert_not_called()
+            self.assertEqual(mock_socketio.emit.call_args.args[0], 'error', options)
+
+    @patch('serve_visualization.start_replay')
+    @patch('serve_visualization.socketio')
+    def test_start_capture_handler_replay(self, mock_socketio, mock_start_replay):
+        """A startCapture request with a file starts a replay"""
+        from serve_visualization import handle_start_capture
+        
+        handle_start_capture({"file": "incident.pcapng", "pace": "realtime"})
+        
+        mock_socketio.start_background_task.assert_called_once_with(
+            mock_start_replay, "incident.pcapng", "realtime", "tshark")
+
+    def test_health_reports_packet_store(self):
+        """The health endpoint includes the retained packet budget of the running capture"""
+        import serve_visualization
+        
+        client = serve_visualization.app.test_client()
+        with patch.object(serve_visualization.actor, 'aggregator', None):
+            self.assertEqual(client.get('/health').get_json(), {"status": "ok"})
+        
+        aggregator = serve_visualization.NetworkTrafficAggregator()
+        aggregator.add_summary(("1700000000.0", "ip:udp", "10.0.0.1", "10.0.0.2", "60", "64",
+                                "", "", "5000", "53", "", "", ""))
+        with patch.object(serve_visualization.actor, 'aggregator', aggregator):
+            store = client.get('/health').get_json()["packetStore"]
+        self.assertEqual(store["packets"], 1)
+        self.assertEqual(store["maxPackets"], serve_visualization.MAX_RETAINED_PACKETS)
+
+    def test_history_graph_endpoint(self):
+        """Past time ranges are served from the packet history, if it is enabled"""
+        import serve_visualization
+        
+        client = serve_visualization.app.test_client()
+        with patch('serve_visualization.history', None):
+            self.assertEqual(client.get('/history/graph?from=0&to=60000').status_code, 404)
+        
+        history = MagicMock()
+        history.graph.return_value = {"from": 0.0, "to": 60000.0, "hosts": [], "streams": [], "totalStreams": 0}
+        with patch('serve_visualization.history', history):
+            response = client.get('/history/graph?from=0&to=60000&limit=50')
+            self.assertEqual(response.get_json()["to"], 60000.0)
+            history.graph.assert_called_once_with(0.0, 60000.0, 50)
+            for query in ('from=0', 'from=a&to=1', 'from=5&to=1', 'from=0&to=1&limit=-1', 'from=0&to=inf'):
+                self.assertEqual(client.get('/history/graph?' + query).status_code, 400)
+
+    @patch('serve_visualization.socketio')
+    def test_warm_restart(self, mock_socketio):
+        """Shutdown writes a checkpoint; startup restores it for the next capture"""
+        import tempfile
+        import serve_visualization
+        from checkpoint import Checkpointer
+
+        aggregator = serve_visualization.NetworkTrafficAggregator()
+        aggregator.add_summary(("1700000000.0", "ip:udp", "10.0.0.1", "10.0.0.2", "60", "64",
+                                "", "", "5000", "53", "", "", ""))
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "state.ckpt")
+            with patch('serve_visualization.checkpointer', Checkpointer(path)), \
+                    patch.object(serve_visualization.actor, 'aggregator', aggregator):
+                with self.assertRaises(SystemExit):
+                    serve_visualization.cleanup(None, None)
+
+            with patch.object(serve_visualization.actor, 'aggregator', None), \
+                    patch('serve_visualization.restored_aggregator', None):
+                restored = serve_visualization.restore_checkpoint(path)
+                self.assertIs(serve_visualization.actor.aggregator, restored)
+                self.assertEqual(restored._get_visualization_data(), aggregator._get_visualization_data())
+                mock_socketio.emit.assert_called_with('networkUpdate', restored._get_visualization_data())
+                # Only the first capture continues from the restored state
+                self.assertIs(serve_visualization.take_aggregator(0), restored)
+                self.assertIsNot(serve_visualization.take_aggregator(0), restored)
+
+            with open(path, "r+b") as f:
+                f.seek(-1, os.SEEK_END)
+                last = f.read(1)[0]
+                f.seek(-1, os.SEEK_END)
+                f.write(bytes([last ^ 0xFF]))
+            self.assertIsNone(serve_visualization.restore_checkpoint(path))
+
+    def test_resolve_capture_file(self):
+        """Replay files must stay inside the capture directory"""
+        import tempfile
+        import serve_visualization
+        
+        with tempfile.TemporaryDirectory() as capture_dir:
+            with open(os.path.join(capture_dir, "trace.pcap"), "wb") as f:
+                f.write(b"")
+            with patch('serve_visualization.CAPTURE_DIR', capture_dir):
+                path = serve_visualization.resolve_capture_file("trace.pcap")
+                self.assertEqual(path, os.path.realpath(os.path.join(capture_dir, "trace.pcap")))
+                with self.assertRaises(ValueError):
+                    serve_visualization.resolve_capture_file("../etc/passwd")
+                with self.assertRaises(FileNotFoundError):
+                    serve_visualization.resolve_capture_file("missing.pcap")
+
     @patch('serve_visualization.socketio')
     def test_stop_test_traffic_handler(self, mock_socketio):
         """Test the stop_test_traffic event handler"""
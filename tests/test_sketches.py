@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+
+import unittest
+import sys
+import os
+
+# Add the parent directory to the path so we can import the modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sketches import CountMinSketch, HyperLogLog, SpaceSaving
+
+class TestCountMinSketch(unittest.TestCase):
+    def test_estimates_never_undercount(self):
+        sketch = CountMinSketch(width=64, depth=4)
+        for i in range(1000):
+            sketch.add(f"10.0.{i // 256}.{i % 256}", 1)
+        self.assertEqual(sketch.add("heavy", 500), sketch.estimate("heavy"))
+        self.assertGreaterEqual(sketch.estimate("heavy"), 500)
+        self.assertGreaterEqual(sketch.estimate("10.0.0.1"), 1)
+        self.assertEqual(sketch.total, 1500)
+
+class TestSpaceSaving(unittest.TestCase):
+    def test_classic_replaces_lightest(self):
+        """Without a sketch a newcomer always replaces the lightest key and inherits its count"""
+        hitters = SpaceSaving(2)
+        self.assertEqual(hitters.offer("a", 5), (True, None))
+        self.assertEqual(hitters.offer("b", 3), (True, None))
+        self.assertEqual(hitters.offer("c", 1), (True, "b"))
+        self.assertEqual(hitters.top(), [("a", 5), ("c", 4)])
+
+    def test_count_min_bytes(self):
+        sketch = CountMinSketch(width=64, depth=3)
+        for i in range(100):
+            sketch.add(f"key-{i % 7}", i)
+        restored = CountMinSketch.from_bytes(sketch.to_bytes())
+        self.assertEqual((restored.width, restored.depth, restored.total), (64, 3, sketch.total))
+        self.assertEqual([restored.estimate(f"key-{i}") for i in range(7)], [sketch.estimate(f"key-{i}") for i in range(7)])
+        with self.assertRaises(ValueError):
+            CountMinSketch.from_bytes(sketch.to_bytes()[:-8])
+
+    def test_admission_resists_scans(self):
+        """With a sketch, one-off keys do not displace heavy hitters"""
+        hitters = SpaceSaving(3, CountMinSketch())
+        for _ in range(50):
+            for key in ("a", "b", "c"):
+                hitters.offer(key, 100)
+        for i in range(5000):
+            self.assertEqual(hitters.offer(f"scan-{i}", 1), (False, None))
+        self.assertEqual(sorted(hitters.counts), ["a", "b", "c"])
+        
+        # A newcomer heavier than the lightest tracked key takes its place
+        hitters.offer("c", 1)
+        tracked, evicted = hitters.offer("d", 6000)
+        self.assertEqual((tracked, evicted), (True, "a"))
+        self.assertEqual(hitters.top(1), [("d", 6000)])
+
+    def test_discard(self):
+        hitters = SpaceSaving(2, CountMinSketch())
+        hitters.offer("a", 10)
+        hitters.offer("b", 20)
+        hitters.discard("a")
+        self.assertNotIn("a", hitters)
+        self.assertEqual(hitters.offer("c", 1), (True, None))
+        self.assertEqual(len(hitters), 2)
+
+class TestHyperLogLog(unittest.TestCase):
+    def test_count(self):
+        """Small counts are near exact, large ones within a few standard errors"""
+        sketch = HyperLogLog()
+        self.assertEqual(sketch.count(), 0)
+        for port in range(20):
+            sketch.add(str(port))
+            sketch.add(str(port))
+        self.assertAlmostEqual(sketch.count(), 20, delta=2)
+        
+        for i in range(20000):
+            sketch.add(f"10.{i // 65536}.{i // 256 % 256}.{i % 256}")
+        self.assertLess(abs(sketch.count() - 20020) / 20020, 0.2)
+        self.assertEqual(len(sketch.registers), 256)
+
+    def test_merge(self):
+        """Merging sketches counts the union, and survives a bytes round trip"""
+        first, second = HyperLogLog(), HyperLogLog()
+        for i in range(300):
+            first.add(f"a{i}")
+            second.add(f"a{i + 200}")
+        union = HyperLogLog.from_bytes(first.to_bytes())
+        union.merge(second)
+        self.assertLess(abs(union.count() - 500) / 500, 0.2)
+        self.assertEqual(HyperLogLog.from_bytes(HyperLogLog().to_bytes()).count(), 0)
+        with self.assertRaises(ValueError):
+            union.merge(HyperLogLog(precision=10))
+
+    def test_unpack_many(self):
+        """Back-to-back to_bytes() values, empty ones as just their precision byte, restore as saved"""
+        sketches = [HyperLogLog(), HyperLogLog(precision=6), HyperLogLog()]
+        for i in range(40):
+            sketches[1].add(f"a{i}")
+            sketches[2].add(f"b{i % 3}")
+        data = [bytes([sketches[0].precision]), sketches[1].to_bytes(), sketches[2].to_bytes()]
+        restored = HyperLogLog.unpack_many(b"".join(data), map(len, data))
+        self.assertEqual([(sketch.precision, sketch.count()) for sketch in restored],
+                         [(sketch.precision, sketch.count()) for sketch in sketches])
+        self.assertIsNone(restored[0].registers)
+        restored[0].add("c")
+        self.assertEqual(restored[0].count(), 1)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -10,17 +10,140 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 # Test the socket event handlers
 class TestSocketHandlers(unittest.TestCase):
+    @patch('serve_visualization.emit')
     @patch('serve_visualization.socketio')
-    def test_connect_handler(self, mock_socketio):
+    def test_connect_handler(self, mock_socketio, mock_emit):
         """Test the connect event handler"""
         # Import the handler function
+        from aggregator_actor import AggregatorActor
         from serve_visualization import handle_connect
         
         # Call the handler
-        handle_connect()
+        with patch('serve_visualization.actor', AggregatorActor()):
+            handle_connect()
         
-        # No assertions since it just prints a message
-        # This test just ensures the function runs without errors
+        # Nothing is running yet, so there is no snapshot to send
+        mock_emit.assert_not_called()
+
+    @patch('serve_visualization.emit')
+    @patch('serve_visualization.socketio')
+    def test_connect_sends_snapshot(self, mock_socketio, mock_emit):
+        """A client connecting mid-capture gets the full graph once"""
+        from aggregator_actor import AggregatorActor
+        from serve_visualization import NetworkTrafficAggregator, handle_connect
+        
+        aggregator = NetworkTrafficAggregator()
+        aggregator._get_or_create_host("10.0.0.1")
+        with patch('serve_visualization.actor', AggregatorActor(aggregator)):
+            handle_connect()
+        
+        mock_emit.assert_called_once_with('networkUpdate', {
+            "hosts": [{"id": "1", "ip": "10.0.0.1", "packets": 0, "bytesTransferred": 0,
+                       "distinctPeers": 0, "distinctPorts": 0}],
+            "streams": []
+        })
+
+    @patch('serve_visualization.emit')
+    def test_request_graph_view(self, mock_emit):
+        """Clients get the graph rolled up to the requested subnet level"""
+        from aggregator_actor import AggregatorActor
+        from serve_visualization import NetworkTrafficAggregator, handle_request_graph_view
+
+        aggregator = NetworkTrafficAggregator()
+        aggregator._get_or_create_host("10.0.0.1")
+        with patch('serve_visualization.actor', AggregatorActor(aggregator)):
+            handle_request_graph_view({"prefixLength": 8})
+            handle_request_graph_view({"prefixLength": 12})
+
+        mock_emit.assert_any_call('networkView', {
+            "prefixLength": 8,
+            "expand": [],
+            "hosts": [{"id": "10.0.0.0/8", "ip": "10.0.0.0/8", "packets": 0, "bytesTransferred": 0,
+                       "hostCount": 1, "prefixLength": 8}],
+            "streams": []
+        })
+        mock_emit.assert_called_with('error', {"message": "No rollup level for prefix length 12"})
+        with patch('serve_visualization.actor', AggregatorActor(aggregator)):
+            handle_request_graph_view({"prefixLength": "eight"})
+        self.assertEqual(mock_emit.call_args.args[0], 'error')
+
+    @patch('serve_visualization.emit')
+    def test_request_flows(self, mock_emit):
+        """Clients get the flow table, optionally for some hosts only"""
+        from aggregator_actor import AggregatorActor
+        from serve_visualization import NetworkTrafficAggregator, handle_request_flows
+
+        aggregator = NetworkTrafficAggregator()
+        aggregator.add_summary(("1700000000.0", "ip:udp", "10.0.0.1", "10.0.0.2", "60", "64",
+                                "", "", "5000", "53", "", "", ""))
+        with patch('serve_visualization.actor', AggregatorActor(aggregator)):
+            handle_request_flows({"hostIds": ["2"], "limit": 10})
+
+        reply = mock_emit.call_args.args
+        self.assertEqual(reply[0], 'flowView')
+        self.assertEqual(reply[1]["hostIds"], ["2"])
+        self.assertEqual([(flow["clientId"], flow["serverId"], flow["transport"], flow["protocol"])
+                          for flow in reply[1]["flows"]], [("1", "2", "udp", "DNS")])
+
+        handle_request_flows({"limit": "ten"})
+        mock_emit.assert_called_with('error', {"message": "Expected an integer 'limit'"})
+
+    @patch('serve_visualization.emit')
+    def test_packet_details_rejects_bad_range(self, mock_emit):
+        from serve_visualization import handle_packet_details_request
+
+        handle_packet_details_request({"sourceId": "1", "targetId": "2", "protocol": "DNS", "sinceId": "latest"})
+        mock_emit.assert_called_once_with('error', {"message": "Expected integer 'limit' and 'sinceId'"})
+
+    @patch('serve_visualization.emit')
+    def test_search_packets(self, mock_emit):
+        """Clients search the stored packets by address, port, DNS name or HTTP host/URI"""
+        from aggregator_actor import AggregatorActor
+        from serve_visualization import NetworkTrafficAggregator, handle_search_packets
+
+        aggregator = NetworkTrafficAggregator()
+        aggregator.add_summaries([("1700000000.0", "ip:tcp", "10.0.0.1", "10.0.0.2", "60", "64",
+                                   "50000", "3389", "", "", "0x0002", "0", "0")] * 3)
+        with patch('serve_visualization.actor', AggregatorActor(aggregator)):
+            handle_search_packets({"port": "3389", "dnsName": "", "limit": 2})
+            reply = mock_emit.call_args.args
+            self.assertEqual(reply[0], 'packetSearchResults')
+            self.assertEqual((reply[1]["query"], reply[1]["total"], reply[1]["nextBeforeId"]),
+                             ({"port": "3389"}, 3, 2))
+            self.assertEqual([packet["id"] for packet in reply[1]["packets"]], ["3", "2"])
+
+            handle_search_packets({"limit": 2})
+            self.assertEqual(mock_emit.call_args.args[0], 'error')
+            for bad in ({"port": ["3389"]}, {"port": "3389", "limit": [2]}, {"port": "3389", "beforeId": {}}):
+                mock_emit.reset_mock()
+                handle_search_packets(bad)
+                self.assertEqual(mock_emit.call_args.args[0], 'error', bad)
+
+    @patch('serve_visualization.emit')
+    def test_request_history_graph(self, mock_emit):
+        """Clients get the graph of a past time range from the packet history"""
+        import tempfile
+        from history_store import HistoryStore
+        from serve_visualization import DetailedPacket, handle_request_history_graph
+
+        with tempfile.TemporaryDirectory() as directory:
+            history = HistoryStore(directory)
+            history.append(DetailedPacket(id=1, timestamp=1700000000000.0, sourceIP="10.0.0.1",
+                                          destinationIP="10.0.0.2", protocol="DNS", length=60))
+            history.close()
+            with patch('serve_visualization.history', history):
+                handle_request_history_graph({"from": 1700000000000, "to": 1700000060000})
+                mock_emit.assert_called_with('historyGraph', {
+                    "from": 1700000000000.0,
+                    "to": 1700000060000.0,
+                    "hosts": [{"id": "10.0.0.1", "ip": "10.0.0.1", "packets": 1, "bytesTransferred": 60},
+                              {"id": "10.0.0.2", "ip": "10.0.0.2", "packets": 1, "bytesTransferred": 60}],
+                    "streams": [{"source": "10.0.0.1", "target": "10.0.0.2", "protocol": "DNS", "packets": 1,
+                                 "bytes": 60, "timestamp": 1700000000000.0}],
+                    "totalStreams": 1
+                })
+                handle_request_history_graph({"from": 1700000000000})
+                self.assertEqual(mock_emit.call_args.args[0], 'error')
 
     @patch('serve_visualization.socketio')
     def test_disconnect_handler(self, mock_socketio):
@@ -37,14 +160,19 @@ class TestSocketHandlers(unittest.TestCase):
     @patch('serve_visualization.test_traffic_generator')
     def test_start_test_traffic(self, mock_generator):
         """Test the start_test_traffic function"""
+        import serve_visualization
+        from aggregator_actor import AggregatorActor
+        
         # Set up mocks
         mock_socketio = MagicMock()
+        mock_aggregator = MagicMock()
+        actor = AggregatorActor(on_tick=serve_visualization.emit_network_changes,
+                                on_replace=serve_visualization.publish_graph)
         
-        # Patch socketio.emit and socketio.sleep
-        with patch('serve_visualization.socketio', mock_socketio):
-            # Import the function
-            from serve_visualization import start_test_traffic
-            
+        # Patch socketio.emit and socketio.sleep, and feed a fresh actor
+        with patch('serve_visualization.socketio', mock_socketio), \
+                patch('serve_visualization.actor', actor), \
+                patch('serve_visualization.take_aggregator', return_value=mock_aggregator):
             # Set the generator to running first, then it will stop after one iteration
             mock_generator.running = True
             
@@ -69,21 +197,29 @@ class TestSocketHandlers(unittest.TestCase):
             }
             mock_generator.generate_random_packet.return_value = mock_packet
             
-            # Mock the visualization data returned by add_packet
-            mock_viz_data = {"hosts": [], "streams": []}
-            mock_generator.aggregator.add_packet.return_value = mock_viz_data
+            # Mock the changes reported after add_packet
+            mock_delta = {"hosts": [], "streams": [], "removedHosts": [], "removedStreams": []}
+            mock_aggregator.flush_delta.return_value = mock_delta
+            mock_rates = {"time": 123456789.0, "windows": [1, 10, 60], "hosts": {}, "streams": {}}
+            mock_aggregator.rates.return_value = mock_rates
             
             # Call the function
-            start_test_traffic()
+            serve_visualization.start_test_traffic()
             
             # Check that the packet was generated
             mock_generator.generate_random_packet.assert_called_once()
             
-            # Check that add_packet was called
-            mock_generator.aggregator.add_packet.assert_called_once_with(mock_packet)
+            # Check that the packet was ingested into the actor's aggregator
+            self.assertIs(actor.aggregator, mock_aggregator)
+            mock_aggregator.add_packets.assert_called_once_with([mock_packet])
+            
+            # Check that idle entries were expired before the delta was built
+            mock_aggregator.expire.assert_called_once()
             
-            # Check that the update was emitted
-            mock_socketio.emit.assert_called_once_with('networkUpdate', mock_viz_data)
+            # Check that clients got the full graph once, then only the delta (no rates while idle)
+            self.assertEqual(mock_socketio.emit.call_count, 2)
+            self.assertEqual(mock_socketio.emit.call_args_list[0].args[0], 'networkUpdate')
+            mock_socketio.emit.assert_called_with('networkDelta', mock_delta)
 
 if __name__ == "__main__":
     unittest.main()
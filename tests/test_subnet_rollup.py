@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+
+import unittest
+import sys
+import os
+
+# Add the parent directory to the path so we can import the modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from subnet_rollup import SubnetRollup, rollup_level
+
+class TestSubnetRollup(unittest.TestCase):
+    def setUp(self):
+        self.rollup = SubnetRollup()
+        for host_id, ip in (("1", "10.1.1.1"), ("2", "10.1.2.2"), ("3", "10.2.0.3"),
+                            ("4", "2001:db8:1::4"), ("5", "other")):
+            self.rollup.add_host(host_id, ip)
+        for key, source, target in (("1-3", "1", "3"), ("2-3", "2", "3"), ("4-5", "4", "5")):
+            self.rollup.add_stream(key, source, target, "TCP")
+            self.rollup.count(key, 2, 100, 1000.0)
+
+    def test_levels(self):
+        self.assertEqual([rollup_level(length) for length in (8, 16, 24, 32, 48, 64)], [0, 1, 2, 0, 1, 2])
+        with self.assertRaises(ValueError):
+            rollup_level(12)
+        
+        top = self.rollup.view(0)
+        nodes = {node["id"]: node for node in top["hosts"]}
+        self.assertEqual(sorted(nodes), ["10.0.0.0/8", "2001:db8::/32", "other"])
+        self.assertEqual(nodes["10.0.0.0/8"]["hostCount"], 3)
+        # Both directions count towards a subnet, as for hosts
+        self.assertEqual(nodes["10.0.0.0/8"]["bytesTransferred"], 400)
+        self.assertEqual(nodes["other"]["prefixLength"], None)
+        intra = [stream for stream in top["streams"] if stream["source"] == "10.0.0.0/8"]
+        self.assertEqual(intra, [{"source": "10.0.0.0/8", "target": "10.0.0.0/8", "protocol": "TCP",
+                                  "packets": 4, "bytes": 200, "timestamp": 1000.0}])
+        
+        ids = sorted(node["id"] for node in self.rollup.view(1)["hosts"])
+        self.assertEqual(ids, ["10.1.0.0/16", "10.2.0.0/16", "2001:db8:1::/48", "other"])
+
+    def test_expand(self):
+        """An expanded subnet is replaced by its children; the rest stay rolled up"""
+        view = self.rollup.view(0, ["10.0.0.0/8"])
+        self.assertEqual(sorted(node["id"] for node in view["hosts"]),
+                         ["10.1.0.0/16", "10.2.0.0/16", "2001:db8::/32", "other"])
+        streams = {(s["source"], s["target"]): s["bytes"] for s in view["streams"]}
+        self.assertEqual(streams, {("10.1.0.0/16", "10.2.0.0/16"): 200, ("2001:db8::/32", "other"): 100})
+        
+        # Hosts can only be shown when given
+        view = self.rollup.view(1, ["10.1.0.0/16", "10.1.1.0/24"])
+        self.assertEqual(sorted(node["id"] for node in view["hosts"]),
+                         ["10.1.1.0/24", "10.1.2.0/24", "10.2.0.0/16", "2001:db8:1::/48", "other"])
+
+    def test_removal(self):
+        """Removing streams and hosts subtracts their traffic and drops empty subnets"""
+        self.rollup.remove_stream("1-3", 2, 100)
+        self.rollup.remove_host("1")
+        nodes = {node["id"]: node for node in self.rollup.view(2)["hosts"]}
+        self.assertNotIn("10.1.1.0/24", nodes)
+        self.assertEqual(nodes["10.2.0.0/24"]["bytesTransferred"], 100)
+        self.assertEqual(len(self.rollup.view(2)["streams"]), 2)
+
+if __name__ == "__main__":
+    unittest.main()
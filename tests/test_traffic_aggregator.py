@@ -11,7 +11,9 @@ import time
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 # Import the NetworkTrafficAggregator class from serve_visualization
-from serve_visualization import NetworkTrafficAggregator
+import serve_visualization
+from checkpoint import decode_checkpoint, encode_checkpoint
+from serve_visualization import NetworkTrafficAggregator, ip_to_int
 
 class TestNetworkTrafficAggregator(unittest.TestCase):
     def setUp(self):
@@ -43,7 +45,8 @@ class TestNetworkTrafficAggregator(unittest.TestCase):
         }
 
         # Add the packet
-        result = self.aggregator.add_packet(mock_packet)
+        stream_key = self.aggregator.add_packet(mock_packet)
+        result = self.aggregator._get_visualization_data()
 
         # Check that hosts were created
         self.assertEqual(len(self.aggregator.hosts), 2)
@@ -68,6 +71,7 @@ class TestNetworkTrafficAggregator(unittest.TestCase):
         self.assertIn("streams", result)
         self.assertEqual(len(result["hosts"]), 2)
         self.assertEqual(len(result["streams"]), 1)
+        self.assertEqual(stream_key, "1-2-HTTP")
 
     def test_protocol_detection(self):
         """Test that protocols are correctly detected"""
@@ -244,6 +248,392 @@ class TestNetworkTrafficAggregator(unittest.TestCase):
         self.assertEqual(host3.id, "2")
         self.assertIsNot(host1, host3)  # Should be different objects
         
+    def test_host_index(self):
+        """Hosts are indexed by packed IP, so equivalent address spellings share a host"""
+        self.assertEqual(ip_to_int("10.0.0.1"), 0x0A000001)
+        self.assertNotEqual(ip_to_int("0.0.0.1"), ip_to_int("::1"))
+        
+        host = self.aggregator._get_or_create_host("2001:db8::1")
+        self.assertIs(self.aggregator._get_or_create_host("2001:0db8:0:0::1"), host)
+        
+        for i in range(1000):
+            self.aggregator._get_or_create_host(f"10.0.{i // 256}.{i % 256}")
+        self.assertEqual(len(self.aggregator.hosts), 1001)
+        self.assertEqual(len(self.aggregator.host_index), 1001)
+        self.assertEqual(self.aggregator._get_or_create_host("10.0.3.231").id, "1001")
+        
+    def make_packet(self, src, dst, dst_port="80"):
+        return {
+            "_source": {
+                "layers": {
+                    "frame": {"frame.time_epoch": "1700000000.5"},
+                    "ip": {"ip.src": src, "ip.dst": dst, "ip.len": "100"},
+                    "tcp": {"tcp.srcport": "40000", "tcp.dstport": dst_port}
+                }
+            }
+        }
+
+    def test_flush_delta(self):
+        """A delta holds only the hosts and streams touched since the last flush"""
+        self.assertIsNone(self.aggregator.flush_delta())
+        
+        self.aggregator.add_packet(self.make_packet("10.0.0.1", "10.0.0.2"))
+        self.aggregator.add_packet(self.make_packet("10.0.0.1", "10.0.0.2"))
+        self.aggregator.add_packet(self.make_packet("10.0.0.3", "10.0.0.4", "22"))
+        delta = self.aggregator.flush_delta()
+        self.assertEqual(len(delta["hosts"]), 4)
+        self.assertEqual(len(delta["streams"]), 2)
+        self.assertIsNone(self.aggregator.flush_delta())
+        
+        self.aggregator.add_packet(self.make_packet("10.0.0.1", "10.0.0.5"))
+        delta = self.aggregator.flush_delta()
+        self.assertEqual(sorted(host["ip"] for host in delta["hosts"]), ["10.0.0.1", "10.0.0.5"])
+        self.assertEqual(delta["streams"], [{"source": "1", "target": "5", "protocol": "HTTP", "packets": 1,
+                                             "bytes": 100, "timestamp": 1700000000500.0}])
+        self.assertEqual(delta["hosts"][0]["packets"] + delta["hosts"][1]["packets"], 4)
+        self.assertEqual((delta["removedHosts"], delta["removedStreams"]), ([], []))
+
+    def test_add_packets_matches_add_packet(self):
+        """A batch builds the same graph, packet ids and delta as one call per packet"""
+        packets = [self.make_packet(f"10.0.0.{i % 3}", f"10.0.1.{i % 2}", "80" if i % 4 else "22")
+                   for i in range(40)]
+        for packet in packets:
+            self.aggregator.add_packet(packet)
+        
+        batched = NetworkTrafficAggregator()
+        self.assertEqual(batched.add_packets(iter(packets)), 40)
+        self.assertEqual(batched._get_visualization_data(), self.aggregator._get_visualization_data())
+        self.assertEqual(batched.flush_delta(), self.aggregator.flush_delta())
+        self.assertEqual(batched.get_packet_details("1", "2", "HTTP"),
+                         self.aggregator.get_packet_details("1", "2", "HTTP"))
+        self.assertEqual(batched.add_packets([]), 0)
+
+    def test_compact_packet_storage(self):
+        """Stored packets share host strings and pack TCP flags, but details keep the client shape"""
+        packet = self.make_packet("10.0.0.1", "10.0.0.2")
+        packet["_source"]["layers"]["tcp"].update({"tcp.flags.syn": "1", "tcp.flags.ack": "1"})
+        self.aggregator.add_packets([packet])
+        self.aggregator.add_packet(self.make_packet("10.0.0.1", "10.0.0.2"))
+        
+        first, second = self.aggregator.packets["1-2-HTTP"]
+        self.assertFalse(hasattr(first, "__dict__"))
+        self.assertIs(first.sourceIP, self.aggregator.hosts["1"].ip)
+        self.assertIs(second.destinationIP, self.aggregator.hosts["2"].ip)
+        self.assertEqual(first.tcpFlags, 0x12)
+        
+        details = self.aggregator.get_packet_details("1", "2", "HTTP")
+        self.assertEqual(details[0]["id"], "1")
+        self.assertEqual(details[0]["tcpFlags"], {"syn": True, "ack": True, "fin": False,
+                                                  "rst": False, "psh": False, "urg": False})
+        self.assertEqual(details[1]["tcpFlags"]["syn"], False)
+        self.assertEqual(set(details[0]), {"id", "timestamp", "sourceIP", "destinationIP", "protocol", "length",
+                                           "ttl", "sourcePort", "destinationPort", "tcpFlags", "tcpSeq",
+                                           "tcpLen", "httpInfo", "dnsInfo", "payload", "raw_data"})
+
+    def test_lazy_packet_details(self):
+        """HTTP details are decoded when requested, once while cached"""
+        packet = self.make_packet("10.0.0.1", "10.0.0.2")
+        packet["_source"]["layers"]["http"] = {"http.request.method": "GET", "http.request.uri": "/",
+                                               "http.host": "example.com"}
+        packet["_source"]["layers"]["data"] = {"data.data": "6869"}
+        self.aggregator.add_packets([packet, self.make_packet("10.0.0.1", "10.0.0.2")])
+        
+        stored = self.aggregator.packets["1-2-HTTP"]
+        self.assertEqual([p.layers is None for p in stored], [False, True])
+        self.assertEqual(set(next(iter(stored)).layers), {"http", "data"})
+        
+        with patch("serve_visualization.decode_detail_layers",
+                   wraps=serve_visualization.decode_detail_layers) as decode:
+            details = self.aggregator.get_packet_details("1", "2", "HTTP")
+            self.assertEqual(self.aggregator.get_packet_details("1", "2", "HTTP", limit=2), details)
+        self.assertEqual(decode.call_count, 1)
+        self.assertEqual(details[0]["httpInfo"]["host"], "example.com")
+        self.assertEqual(details[0]["payload"], "hi")
+        self.assertEqual((details[1]["httpInfo"], details[1]["dnsInfo"], details[1]["payload"]), (None, None, None))
+
+    def test_packet_details_range(self):
+        """Stored packets are capped per stream and can be read as a range"""
+        self.aggregator.max_packets_per_stream = 10
+        self.aggregator.add_packets(self.make_packet("10.0.0.1", "10.0.0.2") for _ in range(25))
+        
+        details = self.aggregator.get_packet_details("1", "2", "HTTP")
+        self.assertEqual([packet["id"] for packet in details], [str(i) for i in range(16, 26)])
+        recent = self.aggregator.get_packet_details("2", "1", "HTTP", limit=3, since_id=23)
+        self.assertEqual([packet["id"] for packet in recent], ["24", "25"])
+
+    def test_search_packets(self):
+        """Stored packets are found by DNS name or port across streams, a page at a time"""
+        for i in range(5):
+            packet = self.make_packet(f"10.0.0.{i + 1}", "8.8.8.8")
+            packet["_source"]["layers"]["dns"] = {"dns.qry.name": "example.com" if i % 2 else "example.org"}
+            self.aggregator.add_packet(packet)
+        self.aggregator.add_summary(self.summary(1000, "10.0.0.9", "10.0.0.10", dst_port="3389"))
+
+        result = self.aggregator.search_packets({"dnsName": "example.com"}, limit=1)
+        self.assertEqual([(packet["id"], packet["streamId"]) for packet in result["packets"]], [("4", "5-2-DNS")])
+        self.assertEqual(result["packets"][0]["dnsInfo"]["queryName"], "example.com")
+        self.assertEqual((result["total"], result["streams"]),
+                         (2, [{"id": "3-2-DNS", "packets": 1}, {"id": "5-2-DNS", "packets": 1}]))
+        self.assertEqual(result["nextBeforeId"], 4)
+        result = self.aggregator.search_packets({"dnsName": "example.com"}, limit=1, before_id=4)
+        self.assertEqual(([packet["id"] for packet in result["packets"]], result["nextBeforeId"]), (["2"], None))
+        self.assertEqual(self.aggregator.search_packets({"port": 3389})["packets"][0]["destinationIP"], "10.0.0.10")
+
+        # Expired streams take their packets out of the index
+        self.aggregator.expire(time.time() + self.aggregator.idle_ttl + 1)
+        self.assertEqual(self.aggregator.search_packets({"ip": "8.8.8.8"})["total"], 0)
+        self.assertEqual(self.aggregator.index.stats()["entries"], 0)
+
+    def summary(self, time_epoch, src, dst, dst_port="443", length="100"):
+        return (str(time_epoch), "ip:tcp", src, dst, length, "64", "40000", dst_port, "", "", "0x0010", "1", "0")
+
+    def test_malformed_packets_are_skipped(self):
+        """A bad packet is counted and skipped; the rest of its batch still reaches rates and subnets"""
+        summary = self.summary(1000, "10.0.0.1", "10.1.0.1")
+        self.assertEqual(self.aggregator.add_summaries([summary, summary, ("bad",), summary,
+                                                        self.summary("x", "10.0.0.1", "10.1.0.1")]), 3)
+        self.assertEqual(self.aggregator.add_packets([{"_source": {}}]), 0)
+        self.assertEqual(self.aggregator.malformed_packets, 3)
+        (stream_key, stream), = self.aggregator.streams.items()
+        self.assertEqual(stream.packets, 3)
+        self.assertEqual(self.aggregator.stream_rates[stream_key].totals(1000, 60)[0], 3)
+        self.assertEqual([subnet["packets"] for subnet in self.aggregator.view(8)["streams"]], [3])
+
+    def test_add_generated_packets(self):
+        """Test traffic (with "tcp": None or "udp": None layers) is added, not skipped"""
+        generator = serve_visualization.TestTrafficGenerator()
+        packets = [generator.generate_random_packet() for _ in range(200)]
+        self.assertEqual(self.aggregator.add_packets(packets), 200)
+        self.assertEqual(self.aggregator.malformed_packets, 0)
+        self.assertEqual(sum(stream.packets for stream in self.aggregator.streams.values()), 200)
+        protocols = {stream.protocol for stream in self.aggregator.streams.values()}
+        self.assertTrue({"DNS", "HTTP", "HTTPS"} <= protocols, protocols)
+        # Ports come from whichever transport layer is present
+        self.assertTrue(all(packet.sourcePort and packet.destinationPort
+                            for ring in self.aggregator.packets.values() for packet in ring))
+
+    def test_expire_idle_streams(self):
+        """Idle streams are removed, then hosts without streams, and clients are told"""
+        self.aggregator.idle_ttl = 60
+        self.aggregator.add_summary(self.summary(1000, "10.0.0.1", "10.0.0.2"))
+        self.aggregator.add_summary(self.summary(1000, "10.0.0.3", "10.0.0.1"))
+        self.aggregator.add_summaries([self.summary(1050, "10.0.0.3", "10.0.0.1"),
+                                       self.summary(1055, "10.0.0.4", "10.0.0.5")])
+        self.aggregator.flush_delta()
+        
+        self.assertEqual(self.aggregator.expire(1059), 0)
+        self.assertEqual(self.aggregator.expire(1060), 1)
+        delta = self.aggregator.flush_delta()
+        self.assertEqual(delta["removedStreams"], ["1-2-HTTPS"])
+        # 10.0.0.1 still talks to 10.0.0.3
+        self.assertEqual(delta["removedHosts"], ["2"])
+        self.assertEqual(sorted(host.ip for host in self.aggregator.hosts.values()),
+                         ["10.0.0.1", "10.0.0.3", "10.0.0.4", "10.0.0.5"])
+        self.assertEqual(self.aggregator.get_packet_details("1", "2", "HTTPS"), [])
+        
+        self.assertEqual(self.aggregator.expire(1200), 2)
+        self.assertEqual((self.aggregator.hosts, self.aggregator.streams), ({}, {}))
+        self.assertEqual(len(self.aggregator.flush_delta()["removedHosts"]), 4)
+        
+        # A returning address becomes a new host
+        self.aggregator.add_summary(self.summary(1300, "10.0.0.1", "10.0.0.2"))
+        self.assertEqual(sorted(self.aggregator.hosts), ["6", "7"])
+
+    def test_batch_refreshes_activity(self):
+        """A conversation whose later packets arrive in a batch is not expired by its first packet"""
+        self.aggregator.idle_ttl = 60
+        self.aggregator.add_summaries([self.summary(1000, "10.0.0.1", "10.0.0.2"),
+                                       self.summary(1010, "10.0.0.3", "10.0.0.4"),
+                                       self.summary(1050, "10.0.0.1", "10.0.0.2")])
+        self.assertEqual(list(self.aggregator._stream_activity), ["3-4-HTTPS", "1-2-HTTPS"])
+
+        self.assertEqual(self.aggregator.expire(1070), 1)
+        self.assertEqual(list(self.aggregator.streams), ["1-2-HTTPS"])
+
+    def test_expire_disabled(self):
+        self.aggregator.idle_ttl = 0
+        self.aggregator.add_summary(self.summary(1000, "10.0.0.1", "10.0.0.2"))
+        self.assertEqual(self.aggregator.expire(10 ** 9), 0)
+        self.assertEqual(len(self.aggregator.streams), 1)
+
+    def test_rates(self):
+        """Batched and single ingest count the same rates; idle entities drop out"""
+        summaries = [self.summary(1000 + i / 10, "10.0.0.1", "10.0.0.2", length="200") for i in range(100)]
+        summaries += [self.summary(1005.5, "10.0.0.3", "10.0.0.2", dst_port="22")]
+        for fields in summaries:
+            self.aggregator.add_summary(fields)
+        batched = NetworkTrafficAggregator()
+        batched.add_summaries(summaries)
+        
+        rates = self.aggregator.rates(1010)
+        self.assertEqual(rates, batched.rates(1010))
+        self.assertEqual(rates["windows"], [1, 10, 60])
+        self.assertEqual(rates["streams"]["1-2-HTTPS"]["packetsPerSecond"], [10.0, 10.0, 100 / 60])
+        self.assertEqual(rates["hosts"]["2"]["bytesPerSecond"][1], (100 * 200 + 100) / 10)
+        self.assertEqual(rates["streams"]["3-2-SSH"]["packetsPerSecond"][0], 0.0)
+        
+        self.assertEqual(self.aggregator.rates(1070)["streams"], {})
+        self.assertEqual((self.aggregator.host_rates, self.aggregator.stream_rates), ({}, {}))
+
+    def test_distinct_peers_and_ports(self):
+        """A port scan shows up as many distinct ports; batched and single ingest agree"""
+        summaries = [self.summary(1000, "10.0.0.1", "10.0.0.2", dst_port=str(port)) for port in range(1, 101)]
+        summaries += [self.summary(1000, "10.0.0.1", f"10.0.1.{i}") for i in range(1, 11)]
+        for fields in summaries:
+            self.aggregator.add_summary(fields)
+        batched = NetworkTrafficAggregator()
+        batched.add_summaries(summaries)
+        
+        data = self.aggregator._get_visualization_data()
+        self.assertEqual(data, batched._get_visualization_data())
+        scanner = data["hosts"][0]
+        self.assertEqual(scanner["ip"], "10.0.0.1")
+        self.assertEqual(scanner["distinctPeers"], 11)
+        self.assertLess(abs(scanner["distinctPorts"] - 100), 10)
+        self.assertEqual((data["hosts"][1]["distinctPeers"], data["hosts"][1]["distinctPorts"]), (1, 0))
+
+    def test_subnet_view(self):
+        """Rollups follow every ingest path and expiry, and expand down to hosts"""
+        summaries = [self.summary(1000, "10.0.1.1", "10.0.2.1"),
+                     self.summary(1000, "10.0.1.2", "192.168.0.1", length="300"),
+                     self.summary(1001, "10.0.1.1", "10.0.2.1")]
+        self.aggregator.idle_ttl = 60
+        self.aggregator.add_summaries(summaries[:2])
+        self.aggregator.add_summary(summaries[2])
+        
+        view = self.aggregator.view(8)
+        self.assertEqual(sorted((s["source"], s["target"], s["bytes"]) for s in view["streams"]),
+                         [("10.0.0.0/8", "10.0.0.0/8", 200), ("10.0.0.0/8", "192.0.0.0/8", 300)])
+        self.assertEqual(self.aggregator.view(None), self.aggregator._get_visualization_data())
+        
+        view = self.aggregator.view(16, ["10.0.0.0/16", "10.0.1.0/24"])
+        self.assertEqual(sorted(node["ip"] for node in view["hosts"]),
+                         ["10.0.1.1", "10.0.1.2", "10.0.2.0/24", "192.168.0.0/16"])
+        streams = {(s["source"], s["target"]): s["packets"] for s in view["streams"]}
+        self.assertEqual(streams, {("1", "10.0.2.0/24"): 2, ("3", "192.168.0.0/16"): 1})
+        
+        # Expiring the 10.0.1.2 conversation removes it from every level
+        self.aggregator.add_summary(self.summary(1061, "10.0.1.1", "10.0.2.1"))
+        self.aggregator.expire(1061)
+        self.assertEqual([node["id"] for node in self.aggregator.view(24)["hosts"]],
+                         ["10.0.1.0/24", "10.0.2.0/24"])
+        self.assertEqual(self.aggregator.view(24)["hosts"][0]["bytesTransferred"], 300)
+
+    def test_flow_view(self):
+        """Packets of both directions land in one flow, from both ingest paths, until it expires"""
+        self.aggregator.idle_ttl = 60
+        self.aggregator.add_summaries([self.summary(1000, "10.0.0.1", "10.0.0.2"),
+                                       self.summary(1000, "10.0.0.3", "10.0.0.2", dst_port="80")])
+        reply = ("1001", "ip:tcp", "10.0.0.2", "10.0.0.1", "100", "64", "443", "40000", "", "", "0x0010", "1", "0")
+        self.aggregator.add_summary(reply)
+
+        flows = self.aggregator.flow_view()
+        self.assertEqual(len(flows), 2)
+        self.assertEqual((flows[0]["clientId"], flows[0]["serverId"], flows[0]["serverPort"]), ("1", "2", "443"))
+        self.assertEqual((flows[0]["packets"], flows[0]["duration"], flows[0]["state"]), (2, 1000.0, "ESTABLISHED"))
+        self.assertEqual([flow["clientId"] for flow in self.aggregator.flow_view(["3"])], ["3"])
+        self.assertEqual(self.aggregator.flow_view(["missing"]), [])
+
+        self.aggregator.add_summary(self.summary(1061, "10.0.0.1", "10.0.0.2"))
+        self.aggregator.expire(1061)
+        self.assertEqual([flow["clientId"] for flow in self.aggregator.flow_view()], ["1"])
+
+    def test_checkpoint_round_trip(self):
+        """A restored aggregator has the same graph, packets and subnets, and keeps numbering"""
+        packet = self.make_packet("10.0.0.1", "10.0.0.2")
+        packet["_source"]["layers"]["http"] = {"http.request.method": "GET", "http.host": "example.com"}
+        self.aggregator.add_packet(packet)
+        self.aggregator.add_summaries([self.summary(1000, "10.0.0.3", "2001:db8::1", dst_port="22"),
+                                       self.summary(1001, "10.0.0.1", "10.0.0.2")])
+        self.aggregator.max_packets_per_stream = 1
+        self.aggregator.add_summary(self.summary(1002, "10.0.0.1", "10.0.0.2"))
+
+        sections = decode_checkpoint(encode_checkpoint(self.aggregator.to_checkpoint()))
+        restored = NetworkTrafficAggregator.from_checkpoint(sections)
+        self.assertIsNone(restored.flush_delta())
+        self.assertEqual(restored._get_visualization_data(), self.aggregator._get_visualization_data())
+        for prefix_length in (8, 16, 24):
+            self.assertEqual(restored.view(prefix_length, ["10.0.0.0/24"]),
+                             self.aggregator.view(prefix_length, ["10.0.0.0/24"]))
+        self.assertEqual(list(restored._stream_activity), list(self.aggregator._stream_activity))
+        self.assertEqual(restored._host_streams, self.aggregator._host_streams)
+        self.assertEqual(restored.index.stats(), self.aggregator.index.stats())
+        self.assertEqual(restored.search_packets({"ip": "10.0.0.2"}), self.aggregator.search_packets({"ip": "10.0.0.2"}))
+        for stream in self.aggregator.streams.values():
+            args = (stream.source, stream.target, stream.protocol)
+            self.assertEqual(restored.get_packet_details(*args), self.aggregator.get_packet_details(*args))
+        self.assertEqual(restored.packets.total, self.aggregator.packets.total)
+
+        restored.add_summary(self.summary(1003, "10.0.0.9", "10.0.0.2"))
+        self.assertEqual(restored.host_index[ip_to_int("10.0.0.9")].id, "5")
+        self.assertEqual(restored.get_packet_details("5", "2", "HTTPS")[0]["id"], "5")
+        # Loaded subnets are taken apart again as streams and hosts expire
+        restored.expire(time.time() + 10 ** 6)
+        self.assertEqual(restored.view(8), {"hosts": [], "streams": []})
+        self.assertEqual(restored.index.stats(), {"terms": 0, "entries": 0})
+
+        # Heavy-hitter state comes back with its "other" host and stream
+        heavy = NetworkTrafficAggregator(top_k=2)
+        heavy.add_summaries([self.summary(1000, f"10.0.1.{i}", "10.0.0.2", length=str(100 + i)) for i in range(10)])
+        restored = NetworkTrafficAggregator.from_checkpoint(heavy.to_checkpoint())
+        self.assertEqual(restored._get_visualization_data(), heavy._get_visualization_data())
+        self.assertEqual(restored.host_hitters.counts, heavy.host_hitters.counts)
+        for ip in ["10.0.0.2"] + [f"10.0.1.{i}" for i in range(10)]:
+            self.assertEqual(restored.estimated_host_bytes(ip), heavy.estimated_host_bytes(ip))
+
+        # A heavy-hitter checkpoint without the hitters is incomplete, not an older layout to fall back from
+        sections = {name: data for name, data in heavy.to_checkpoint().items() if not name.startswith("hitters.")}
+        with self.assertRaises(KeyError):
+            NetworkTrafficAggregator.from_checkpoint(sections)
+
+    def test_heavy_hitter_mode(self):
+        """Only the top-K hosts and streams are kept; everything else adds up under "other" """
+        aggregator = NetworkTrafficAggregator(top_k=4)
+        summaries = []
+        for i in range(50):
+            summaries.append(self.summary(1000, "10.0.0.1", "10.0.0.2", length="1500"))
+            summaries.append(self.summary(1000, "10.0.0.3", "10.0.0.2", dst_port="22", length="1000"))
+        # A scan: one small packet each to many addresses
+        summaries += [self.summary(1001, "10.9.9.9", f"10.1.{i // 256}.{i % 256}", length="40")
+                      for i in range(2000)]
+        self.assertEqual(aggregator.add_summaries(summaries), len(summaries))
+
+        hosts = {host.ip: host for host in aggregator.hosts.values()}
+        self.assertLessEqual(len(hosts), 5)
+        self.assertLessEqual(len(aggregator.streams), 5)
+        self.assertEqual(hosts["10.0.0.1"].bytesTransferred, 50 * 1500)
+        self.assertEqual(hosts["10.0.0.2"].packets, 100)
+        self.assertEqual(aggregator.streams["1-2-HTTPS"].bytes, 50 * 1500)
+        self.assertIn("other", aggregator.hosts)
+
+        # Totals are conserved between the tracked entities and "other"
+        total = 50 * 1500 + 50 * 1000 + 2000 * 40
+        self.assertEqual(sum(host.bytesTransferred for host in aggregator.hosts.values()), 2 * total)
+        self.assertEqual(sum(stream.bytes for stream in aggregator.streams.values()), total)
+        self.assertEqual(sum(stream["bytes"] for stream in aggregator.view(24)["streams"]), total)
+        # The scanner is a heavy hitter itself; its many small peers are not
+        scanner = hosts["10.9.9.9"]
+        self.assertEqual(aggregator.streams[f"{scanner.id}-other-HTTPS"].packets, 2000)
+
+        # The long tail is still estimated, and its packets keep their real addresses
+        self.assertGreaterEqual(aggregator.estimated_host_bytes("10.1.0.7"), 40)
+        packet = aggregator.get_packet_details(scanner.id, "other", "HTTPS", limit=1)[0]
+        self.assertEqual(packet["destinationIP"], "10.1.7.207")
+
+    def test_flush_delta_removals(self):
+        """Removed entities are reported once and never also listed as changed"""
+        self.aggregator.add_packet(self.make_packet("10.0.0.1", "10.0.0.2"))
+        self.aggregator._remove_stream("1-2-HTTP")
+        self.aggregator._remove_host("2")
+        delta = self.aggregator.flush_delta()
+        
+        self.assertEqual([host["id"] for host in delta["hosts"]], ["1"])
+        self.assertEqual(delta["streams"], [])
+        self.assertEqual(delta["removedHosts"], ["2"])
+        self.assertEqual(delta["removedStreams"], ["1-2-HTTP"])
+        self.assertEqual(self.aggregator.get_packet_details("1", "2", "HTTP"), [])
+        self.assertIsNone(self.aggregator.flush_delta())
+
     def test_deep_packet_inspection(self):
         """Test deep packet inspection capabilities"""
         # HTTP packet with detailed data
@@ -338,5 +728,46 @@ class TestNetworkTrafficAggregator(unittest.TestCase):
             self.assertEqual(details.get('dnsQueryType'), '1')
             self.assertEqual(details.get('dnsIsResponse'), '0')
 
+    def test_add_summary_matches_add_packet(self):
+        """Summary tuples produce the same hosts and streams as full packets"""
+        full_packet = {
+            "_source": {
+                "layers": {
+                    "frame": {"frame.time_epoch": "1700000000.25"},
+                    "ip": {
+                        "ip.src": "10.0.0.1",
+                        "ip.dst": "10.0.0.2",
+                        "ip.len": "120",
+                        "ip.ttl": "64"
+                    },
+                    "tcp": {
+                        "tcp.srcport": "40000",
+                        "tcp.dstport": "22",
+                        "tcp.seq": "0",
+                        "tcp.len": "0",
+                        "tcp.flags.syn": "1",
+                        "tcp.flags.ack": "0"
+                    }
+                }
+            }
+        }
+        summary = ("1700000000.25", "eth:ethertype:ip:tcp", "10.0.0.1", "10.0.0.2", "120", "64",
+                   "40000", "22", "", "", "0x0002", "0", "0")
+        
+        self.aggregator.add_packet(full_packet)
+        summary_aggregator = NetworkTrafficAggregator()
+        summary_aggregator.add_summary(summary)
+        result = summary_aggregator._get_visualization_data()
+        self.assertEqual(result, self.aggregator._get_visualization_data())
+        self.assertEqual(result["streams"][0]["protocol"], "SSH")
+        
+        packet = summary_aggregator.get_packet_details("1", "2", "SSH")[0]
+        self.assertEqual(packet["ttl"], 64)
+        self.assertEqual(packet["destinationPort"], "22")
+        self.assertTrue(packet["tcpFlags"]["syn"])
+        self.assertFalse(packet["tcpFlags"]["ack"])
+        self.assertEqual((packet["tcpSeq"], packet["tcpLen"]), (0, 0))
+        self.assertEqual(summary_aggregator.flow_view(), self.aggregator.flow_view())
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+
+import unittest
+import sys
+import os
+import json
+import subprocess
+import time
+
+# Add the parent directory to the path so we can import the modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import threading
+
+from tshark_ingest import (DecodePool, EKDecoder, IngestQueue, IPV6_SUMMARY_FIELDS, JSONStreamDecoder, ReplayPacer,
+                           SUMMARY_FIELDS, TsharkReader, iter_packets, make_decoder, parse_replay_speed, summary_tshark_args)
+from serve_visualization import NetworkTrafficAggregator, decode_packet_chunk
+
+def make_packet(src, dst, length="100"):
+    return {
+        "_source": {
+            "layers": {
+                "frame": {"frame.time_epoch": "1700000000.5"},
+                "ip": {"ip.src": src, "ip.dst": dst, "ip.len": length},
+                "tcp": {
+                    "tcp.srcport": "12345",
+                    "tcp.dstport": "8080",
+                    "Options": {"tcp.options.mss": {"tcp.option_kind": "2"}}
+                }
+            }
+        }
+    }
+
+class TestEKDecoder(unittest.TestCase):
+    def ek_lines(self, count):
+        lines = []
+        for i in range(count):
+            lines.append(json.dumps({"index": {"_index": "packets-2024-01-01", "_type": "doc"}}))
+            lines.append(json.dumps({
+                "timestamp": "1700000000500",
+                "layers": {
+                    "frame": {"frame_frame_time_epoch": "1700000000.5"},
+                    "ip": {"ip_ip_src": f"10.0.0.{i}", "ip_ip_dst": "10.0.1.1", "ip_ip_len": "60"},
+                    "tcp": {"tcp_tcp_srcport": "1234", "tcp_tcp_dstport": "22", "tcp_tcp_flags_syn": "1"}
+                }
+            }))
+        return "\n".join(lines) + "\n"
+
+    def test_field_names_restored(self):
+        """EK field names are mapped back to the dotted names add_packet reads"""
+        packets = EKDecoder().feed(self.ek_lines(1))
+        self.assertEqual(len(packets), 1)
+        layers = packets[0]["_source"]["layers"]
+        self.assertEqual(layers["ip"]["ip.src"], "10.0.0.0")
+        self.assertEqual(layers["frame"]["frame.time_epoch"], "1700000000.5")
+        self.assertEqual(layers["tcp"]["tcp.flags.syn"], "1")
+
+    def test_split_lines_are_not_dropped(self):
+        """Lines split across reads are buffered until complete"""
+        data = self.ek_lines(50)
+        decoder = EKDecoder()
+        packets = []
+        for i in range(0, len(data), 7):
+            packets.extend(decoder.feed(data[i:i + 7]))
+        packets.extend(decoder.close())
+
+        self.assertEqual(len(packets), 50)
+        self.assertEqual(decoder.stats.packets, 50)
+        self.assertEqual(decoder.stats.errors, 0)
+
+        aggregator = NetworkTrafficAggregator()
+        for packet in packets:
+            aggregator.add_packet(packet)
+        self.assertEqual(len(aggregator.hosts), 51)
+
+class TestJSONStreamDecoder(unittest.TestCase):
+    def test_nested_objects_across_chunks(self):
+        """Pretty-printed arrays with nested layers decode packet by packet"""
+        expected = [make_packet(f"192.168.0.{i}", "192.168.0.254") for i in range(20)]
+        data = json.dumps(expected, indent=2)
+
+        for chunk_size in (1, 13, 4096):
+            decoder = JSONStreamDecoder()
+            chunks = [data[i:i + chunk_size] for i in range(0, len(data), chunk_size)]
+            packets = list(iter_packets(chunks, decoder))
+            self.assertEqual(packets, expected)
+            self.assertEqual(decoder.stats.errors, 0)
+
+    def test_truncated_output_is_reported(self):
+        """A packet cut off at end of stream counts as an error"""
+        data = json.dumps([make_packet("10.0.0.1", "10.0.0.2")], indent=2)
+        decoder = make_decoder("json")
+        packets = list(iter_packets([data[:-20]], decoder))
+        self.assertEqual(packets, [])
+        self.assertEqual(decoder.stats.errors, 1)
+
+    def test_malformed_packet_is_skipped(self):
+        """A complete but invalid packet is counted and decoding resumes with the next one"""
+        good = [make_packet("10.0.0.1", "10.0.0.2"), make_packet("10.0.0.3", "10.0.0.4")]
+        first, second = (json.dumps(packet, indent=2) for packet in good)
+        data = '[\n' + first + ',\n{"layers": {"ip": {"ip.src": "10.0.0.9",, "x": "}"}}},\n' + second + '\n]'
+
+        for chunk_size in (1, 7, 4096):
+            decoder = JSONStreamDecoder()
+            chunks = [data[i:i + chunk_size] for i in range(0, len(data), chunk_size)]
+            self.assertEqual(list(iter_packets(chunks, decoder)), good)
+            self.assertEqual(decoder.stats.errors, 1)
+
+    def test_unclosed_packet_is_dropped(self):
+        """A packet that never closes is dropped once it outgrows max_buffer"""
+        decoder = JSONStreamDecoder(max_buffer=1000)
+        self.assertEqual(decoder.feed('[{"layers": {"data": "' + "a" * 600), [])
+        self.assertEqual(decoder.stats.errors, 0)
+        self.assertEqual(decoder.feed("a" * 600), [])
+        self.assertEqual(decoder.stats.errors, 1)
+        self.assertEqual(decoder._buffer, "")
+
+    def test_unknown_format(self):
+        with self.assertRaises(ValueError):
+            make_decoder("pdml")
+
+class TestFieldsDecoder(unittest.TestCase):
+    def test_summary_lines(self):
+        """Tab separated summary lines become SUMMARY_FIELDS tuples"""
+        data = ("1700000000.1\teth:ethertype:ip:udp:dns\t10.0.0.1\t8.8.8.8\t60\t64\t\t\t5353\t53\t\t\t\n"
+                "1700000000.2\teth:ethertype:arp\t\t\t\t\t\t\t\t\t\t\t\n"
+                "1700000000.3\teth:ethertype:ip:tcp\t10.0.0.1\t10.0.0.2\t40\t64\t1\t2\t\t\t0x0012\t1\t0")
+        decoder = make_decoder("fields")
+        records = list(iter_packets([data], decoder))
+        
+        self.assertEqual(len(records), 2)
+        self.assertEqual(len(records[0]), len(SUMMARY_FIELDS))
+        self.assertEqual(records[0][3], "8.8.8.8")
+        self.assertEqual(records[1][-3:], ("0x0012", "1", "0"))
+        # The ARP line has no IP header
+        self.assertEqual(decoder.stats.errors, 1)
+
+    def test_tshark_args(self):
+        args = summary_tshark_args()
+        self.assertEqual(args[:2], ["-T", "fields"])
+        self.assertEqual(args.count("-e"), len(SUMMARY_FIELDS) + len(IPV6_SUMMARY_FIELDS))
+
+    def test_ipv6_summary_lines(self):
+        """IPv6 packets fill the ip.* columns from the trailing ipv6.* ones, as the native reader does"""
+        data = ("1700000000.1\teth:ethertype:ipv6:udp:dns\t\t\t\t\t\t\t5353\t53\t\t\t"
+                "\t2001:db8::1\t2001:db8::53\t8\t64\n"
+                "1700000000.2\teth:ethertype:ip:tcp\t10.0.0.1\t10.0.0.2\t40\t64\t1\t2\t\t\t0x0012\t1\t0"
+                "\t\t\t\t\n"
+                "1700000000.3\teth:ethertype:arp\t\t\t\t\t\t\t\t\t\t\t\t\t\t\t\n")
+        decoder = make_decoder("fields")
+        records = list(iter_packets([data], decoder))
+
+        self.assertEqual(records[0], ("1700000000.1", "eth:ethertype:ipv6:udp:dns", "2001:db8::1", "2001:db8::53",
+                                      "48", "64", "", "", "5353", "53", "", "", ""))
+        self.assertEqual(records[1][2:6], ("10.0.0.1", "10.0.0.2", "40", "64"))
+        self.assertEqual(len(records), 2)
+        self.assertEqual(decoder.stats.errors, 1)
+
+# Stands in for tshark: writes EK documents, optionally floods stderr, then idles
+FAKE_TSHARK = """
+import json, sys, time
+for i in range(int(sys.argv[1])):
+    print(json.dumps({"index": {}}))
+    print(json.dumps({"layers": {
+        "frame": {"frame_frame_time_epoch": str(1700000000 + i)},
+        "ip": {"ip_ip_src": "10.0.0.%d" % (i % 250), "ip_ip_dst": "10.0.1.1", "ip_ip_len": "60"},
+        "udp": {"udp_udp_srcport": "5000", "udp_udp_dstport": "5001"}}}))
+sys.stdout.flush()
+sys.stderr.write("warning\\n" * int(sys.argv[2]))
+sys.stderr.flush()
+time.sleep(float(sys.argv[3]))
+"""
+
+def fake_tshark(packets, stderr_lines=0, idle=0.0):
+    return subprocess.Popen([sys.executable, "-c", FAKE_TSHARK, str(packets), str(stderr_lines), str(idle)],
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+class TestTsharkReader(unittest.TestCase):
+    def test_packets_arrive_while_stderr_is_silent(self):
+        """Packets are delivered before tshark writes anything to stderr or exits"""
+        process = fake_tshark(5, idle=5)
+        try:
+            reader = TsharkReader(process).start()
+            started = time.time()
+            packets = []
+            while len(packets) < 5 and time.time() - started < 4:
+                packets.extend(reader.get_batch(timeout=0.1))
+            self.assertEqual(len(packets), 5)
+            self.assertIsNone(process.poll())
+            self.assertFalse(reader.finished)
+        finally:
+            process.kill()
+            process.wait()
+
+    def test_noisy_stderr_does_not_block(self):
+        """A full stderr pipe never stalls stdout, and every packet is kept"""
+        process = fake_tshark(2000, stderr_lines=50000)
+        reader = TsharkReader(process, maxsize=100).start()
+        packets = list(reader)
+        process.wait()
+        reader.join(timeout=3)
+        
+        self.assertEqual(len(packets), 2000)
+        self.assertEqual(reader.decoder.stats.packets, 2000)
+        self.assertEqual(len(reader.stderr_lines()), 50000)
+
+class TestDecodePool(unittest.TestCase):
+    def test_pool_matches_single_process_decode(self):
+        """Worker-decoded records build the same graph, in capture order"""
+        pool = DecodePool(decode_packet_chunk, workers=2)
+        try:
+            process = fake_tshark(500)
+            reader = TsharkReader(process, pool=pool).start()
+            records = list(reader)
+            process.wait()
+        finally:
+            pool.close()
+        
+        self.assertEqual(len(records), 500)
+        self.assertEqual(reader.decoder.stats.packets, 500)
+        timestamps = [record[4] for record in records]
+        self.assertEqual(timestamps, sorted(timestamps))
+        
+        pooled = NetworkTrafficAggregator()
+        for record in records:
+            pooled.add_record(record)
+        
+        process = fake_tshark(500)
+        expected = NetworkTrafficAggregator()
+        for packet in TsharkReader(process).start():
+            expected.add_packet(packet)
+        process.wait()
+        self.assertEqual(pooled._get_visualization_data(), expected._get_visualization_data())
+
+class TestIngestQueue(unittest.TestCase):
+    def fill(self, policy, count=10, maxsize=4):
+        ingest_queue = IngestQueue(maxsize, policy, sample_rate=3)
+        for i in range(count):
+            ingest_queue.put(i)
+        return ingest_queue
+
+    def test_drop_newest(self):
+        ingest_queue = self.fill("drop-newest")
+        self.assertEqual(ingest_queue.get_batch(timeout=0), [0, 1, 2, 3])
+        stats = ingest_queue.stats()
+        self.assertEqual((stats["received"], stats["enqueued"], stats["dropped"], stats["processed"]),
+                         (10, 4, 6, 4))
+
+    def test_drop_oldest(self):
+        ingest_queue = self.fill("drop-oldest")
+        self.assertEqual(ingest_queue.get_batch(timeout=0), [6, 7, 8, 9])
+        self.assertEqual(ingest_queue.dropped, 6)
+        self.assertEqual(ingest_queue.enqueued, 10)
+
+    def test_sample(self):
+        """Past the high-water mark only every sample_rate-th packet is admitted"""
+        ingest_queue = self.fill("sample")
+        self.assertEqual(ingest_queue.get_batch(timeout=0), [0, 1, 2, 5])
+        self.assertEqual(ingest_queue.received, ingest_queue.enqueued + ingest_queue.dropped)
+
+    def test_block_waits_for_consumer(self):
+        """A blocking put resumes once the consumer frees space, and nothing is lost"""
+        ingest_queue = IngestQueue(2, "block")
+        producer = threading.Thread(target=lambda: [ingest_queue.put(i) for i in range(100)])
+        producer.start()
+        received = []
+        while len(received) < 100:
+            received.extend(ingest_queue.get_batch(timeout=1))
+        producer.join()
+        self.assertEqual(received, list(range(100)))
+        self.assertEqual(ingest_queue.dropped, 0)
+        self.assertEqual(ingest_queue.processed, 100)
+
+    def test_unknown_policy(self):
+        with self.assertRaises(ValueError):
+            IngestQueue(10, "drop-random")
+
+class TestReplayPacer(unittest.TestCase):
+    def test_parse_replay_speed(self):
+        self.assertEqual(parse_replay_speed("max"), 0.0)
+        self.assertEqual(parse_replay_speed("realtime"), 1.0)
+        self.assertEqual(parse_replay_speed("10x"), 10.0)
+        self.assertEqual(parse_replay_speed(2.5), 2.5)
+        with self.assertRaises(ValueError):
+            parse_replay_speed("-1")
+
+    def test_paced_replay_sleeps_by_timestamp_gap(self):
+        """At 10x speed a 5 second gap between packets becomes about half a second"""
+        sleeps = []
+        pacer = ReplayPacer(10.0, sleep=sleeps.append)
+        pacer.wait(1000.0)
+        pacer.wait(1005.0)
+        self.assertEqual(len(sleeps), 1)
+        self.assertAlmostEqual(sleeps[0], 0.5, delta=0.05)
+
+    def test_batches_are_cut_before_sleeping(self):
+        """Packets due together share a batch; a batch is handed over before each sleep"""
+        pacer = ReplayPacer(1000.0, sleep=time.sleep)
+        records = [(1000.0,), (1000.0,), (1000.0,), (1100.0,), (1100.0,)]
+        batches = list(pacer.batches(records, max_size=2))
+        self.assertEqual([len(batch) for batch in batches], [2, 1, 2])
+        
+        unpaced = ReplayPacer(0.0)
+        self.assertEqual([len(batch) for batch in unpaced.batches(records * 3, max_size=4)], [4, 4, 4, 3])
+
+    def test_unpaced_replay_never_sleeps(self):
+        sleeps = []
+        pacer = ReplayPacer(0.0, sleep=sleeps.append)
+        for timestamp in (1000.0, 2000.0, 3000.0):
+            pacer.wait(timestamp)
+        self.assertEqual(sleeps, [])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,649 @@
+#!/usr/bin/env python3
+"""Streaming ingest of tshark packet output"""
+import codecs
+import collections
+import json
+import multiprocessing
+import os
+import queue
+import re
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+# Fields read by NetworkTrafficAggregator, used to restore the dotted names
+# that `tshark -T ek` flattens into underscores (e.g. ip_ip_src -> ip.src)
+EK_KNOWN_FIELDS = [
+    "frame.time_epoch", "frame.len", "frame.protocols",
+    "ip.src", "ip.dst", "ip.len", "ip.ttl", "ip.proto",
+    "tcp.srcport", "tcp.dstport", "tcp.flags",
+    "tcp.flags.syn", "tcp.flags.ack", "tcp.flags.fin",
+    "tcp.flags.reset", "tcp.flags.push", "tcp.flags.urg",
+    "udp.srcport", "udp.dstport",
+    "http.request.method", "http.request.uri", "http.host", "http.user_agent",
+    "http.response.code", "http.response.phrase",
+    "http.content_type", "http.content_length",
+    "dns.flags.response", "dns.qry.name", "dns.qry.type", "dns.flags.rcode", "dns.a",
+    "data.data",
+]
+
+EK_FIELD_NAMES = {
+    f"{name.split('.', 1)[0]}_{name.replace('.', '_')}": name for name in EK_KNOWN_FIELDS
+}
+
+# Columns requested in summary mode, in the order of the tuples passed to
+# NetworkTrafficAggregator.add_summary
+SUMMARY_FIELDS = (
+    "frame.time_epoch", "frame.protocols",
+    "ip.src", "ip.dst", "ip.len", "ip.ttl",
+    "tcp.srcport", "tcp.dstport", "udp.srcport", "udp.dstport",
+    "tcp.flags", "tcp.seq", "tcp.len",
+)
+
+# Printed after SUMMARY_FIELDS and folded into its ip.* columns for IPv6 packets,
+# which have no ip.src (ipv6.plen excludes the 40 byte header that ip.len counts)
+IPV6_SUMMARY_FIELDS = ("ipv6.src", "ipv6.dst", "ipv6.plen", "ipv6.hlim")
+
+
+# Characters that open or close JSON objects and strings
+_JSON_STRUCTURE = re.compile(r'[{}"\\]')
+
+
+class IngestStats:
+    """Counters for a streaming decoder"""
+
+    def __init__(self):
+        self.packets = 0
+        self.bytes = 0
+        self.errors = 0
+        self.started = time.time()
+
+    def packets_per_second(self) -> float:
+        elapsed = time.time() - self.started
+        return self.packets / elapsed if elapsed > 0 else 0.0
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "packets": self.packets,
+            "bytes": self.bytes,
+            "errors": self.errors,
+            "packetsPerSecond": round(self.packets_per_second(), 1)
+        }
+
+
+def _ek_field_name(layer: str, key: str) -> str:
+    if "." in key:
+        return key
+    if key in EK_FIELD_NAMES:
+        return EK_FIELD_NAMES[key]
+
+    # Unknown field: drop the "<layer>_" prefix and restore the dots
+    prefix = f"{layer}_"
+    if key.startswith(prefix):
+        key = key[len(prefix):]
+    return key.replace("_", ".")
+
+
+def ek_to_packet(document: Dict[str, Any]) -> Dict[str, Any]:
+    """Convert a `tshark -T ek` document into the `-T json` packet shape"""
+    layers = {}
+    for layer_name, fields in document.get("layers", {}).items():
+        if isinstance(fields, dict):
+            layers[layer_name] = {
+                _ek_field_name(layer_name, key): value for key, value in fields.items()
+            }
+        else:
+            layers[layer_name] = fields
+    return {"_source": {"layers": layers}}
+
+
+class EKDecoder:
+    """Decode newline-delimited `tshark -T ek` output into packet dicts"""
+
+    def __init__(self):
+        self.stats = IngestStats()
+        self._partial = ""
+
+    def feed(self, data: str) -> List[Dict[str, Any]]:
+        self.stats.bytes += len(data)
+        if self._partial:
+            data = self._partial + data
+
+        lines = data.split("\n")
+        # The last element is an unterminated line (or "" after a newline)
+        self._partial = lines.pop()
+
+        packets = []
+        for line in lines:
+            packet = self._decode_line(line)
+            if packet is not None:
+                packets.append(packet)
+        return packets
+
+    def close(self) -> List[Dict[str, Any]]:
+        line, self._partial = self._partial, ""
+        packet = self._decode_line(line)
+        return [packet] if packet is not None else []
+
+    def _decode_line(self, line: str):
+        line = line.strip()
+        if not line:
+            return None
+        try:
+            document = json.loads(line)
+        except json.JSONDecodeError:
+            self.stats.errors += 1
+            return None
+
+        # Skip the bulk-index header that precedes every packet document
+        if not isinstance(document, dict) or "layers" not in document:
+            return None
+
+        self.stats.packets += 1
+        return ek_to_packet(document)
+
+
+class JSONStreamDecoder:
+    """Incrementally decode pretty-printed `tshark -T json` output
+
+    tshark writes one JSON array spanning the whole capture, so packets are
+    pulled out of the buffer as soon as their closing brace arrives. Braces
+    are counted outside of strings, so each packet is decoded exactly once
+    and a malformed one is counted as an error and skipped instead of being
+    mistaken for one that is still incomplete. A packet that grows past
+    `max_buffer` characters without closing is dropped as well.
+    """
+
+    def __init__(self, max_buffer: int = 1 << 24):
+        self.stats = IngestStats()
+        self.max_buffer = max_buffer
+        self._decoder = json.JSONDecoder()
+        self._buffer = ""
+        # (offset scanned so far, brace depth, inside a string) of the pending packet
+        self._scan = (0, 0, False)
+
+    def feed(self, data: str) -> List[Dict[str, Any]]:
+        self.stats.bytes += len(data)
+        self._buffer += data
+        return self._drain()
+
+    def close(self) -> List[Dict[str, Any]]:
+        packets = self._drain()
+        if self._buffer.strip(" \t\r\n,[]"):
+            self.stats.errors += 1
+        self._buffer = ""
+        self._scan = (0, 0, False)
+        return packets
+
+    def _object_end(self, buffer: str, start: int) -> int:
+        """Index just past the object opened at buffer[start], or -1 if it has not closed yet
+
+        Resumes from where the previous call for the same pending object stopped.
+        """
+        offset, depth, in_string = self._scan
+        search = _JSON_STRUCTURE.search
+        end = len(buffer)
+        i = start + offset
+        while True:
+            match = search(buffer, i)
+            if match is None:
+                self._scan = (end - start, depth, in_string)
+                return -1
+            char = match.group()
+            i = match.end()
+            if in_string:
+                if char == '"':
+                    in_string = False
+                elif char == "\\":
+                    if i >= end:
+                        # The escaped character has not arrived yet
+                        self._scan = (i - 1 - start, depth, in_string)
+                        return -1
+                    i += 1
+            elif char == '"':
+                in_string = True
+            elif char == "{":
+                depth += 1
+            elif char == "}":
+                depth -= 1
+                if depth <= 0:
+                    self._scan = (0, 0, False)
+                    return i
+
+    def _drain(self) -> List[Dict[str, Any]]:
+        buffer = self._buffer
+        end = len(buffer)
+        pos = 0
+        packets = []
+
+        while True:
+            # Skip whitespace and the array punctuation between packets
+            while pos < end and buffer[pos] in " \t\r\n,[]":
+                pos += 1
+            if pos >= end:
+                break
+
+            if buffer[pos] != "{":
+                # Not part of the packet array; discard up to the next line
+                self.stats.errors += 1
+                newline = buffer.find("\n", pos)
+                if newline == -1:
+                    pos = end
+                    break
+                pos = newline + 1
+                continue
+
+            object_end = self._object_end(buffer, pos)
+            if object_end == -1:
+                if end - pos > self.max_buffer:
+                    # Never closes (or is absurdly large); drop it to bound memory
+                    self.stats.errors += 1
+                    self._scan = (0, 0, False)
+                    pos = end
+                break
+
+            try:
+                packet = self._decoder.decode(buffer[pos:object_end])
+            except json.JSONDecodeError:
+                # Complete but malformed; resync on the next packet
+                self.stats.errors += 1
+            else:
+                self.stats.packets += 1
+                packets.append(packet)
+            pos = object_end
+
+        self._buffer = buffer[pos:]
+        return packets
+
+
+def summary_tshark_args() -> List[str]:
+    """Return the tshark arguments that print SUMMARY_FIELDS and IPV6_SUMMARY_FIELDS as tab separated lines"""
+    # occurrence=f keeps only the outer header when IP is tunnelled in IP
+    args = ["-T", "fields", "-E", "separator=/t", "-E", "occurrence=f"]
+    for name in SUMMARY_FIELDS + IPV6_SUMMARY_FIELDS:
+        args.extend(["-e", name])
+    return args
+
+
+def parse_field_line(line: str):
+    """Split one `-T fields` line into a SUMMARY_FIELDS tuple, or None if it has no IP header
+
+    The IPV6_SUMMARY_FIELDS columns are optional; when present, an IPv6 packet
+    fills the ip.* columns like pcap_reader does.
+    """
+    fields = line.rstrip("\r\n").split("\t")
+    if len(fields) == len(SUMMARY_FIELDS) + len(IPV6_SUMMARY_FIELDS):
+        src, dst, payload_length, hop_limit = fields[len(SUMMARY_FIELDS):]
+        del fields[len(SUMMARY_FIELDS):]
+        if not fields[2] and src and payload_length.isdigit():
+            fields[2:6] = src, dst, str(int(payload_length) + 40), hop_limit
+    elif len(fields) != len(SUMMARY_FIELDS):
+        return None
+    if not fields[2]:
+        return None
+    return tuple(fields)
+
+
+class FieldsDecoder:
+    """Decode `tshark -T fields` summary output into SUMMARY_FIELDS tuples"""
+
+    def __init__(self):
+        self.stats = IngestStats()
+        self._partial = ""
+
+    def feed(self, data: str) -> List[tuple]:
+        self.stats.bytes += len(data)
+        if self._partial:
+            data = self._partial + data
+
+        lines = data.split("\n")
+        self._partial = lines.pop()
+
+        records = []
+        for line in lines:
+            record = self._decode_line(line)
+            if record is not None:
+                records.append(record)
+        return records
+
+    def close(self) -> List[tuple]:
+        line, self._partial = self._partial, ""
+        record = self._decode_line(line)
+        return [record] if record is not None else []
+
+    def _decode_line(self, line: str):
+        if not line.strip():
+            return None
+        record = parse_field_line(line)
+        if record is None:
+            self.stats.errors += 1
+            return None
+        self.stats.packets += 1
+        return record
+
+
+DECODERS = {
+    "ek": EKDecoder,
+    "json": JSONStreamDecoder,
+    "fields": FieldsDecoder,
+}
+
+
+def make_decoder(output_format: str = "ek"):
+    """Return a streaming decoder for a tshark `-T` output format"""
+    try:
+        return DECODERS[output_format]()
+    except KeyError:
+        raise ValueError(f"Unsupported tshark output format: {output_format}")
+
+
+def iter_packets(chunks: Iterable[str], decoder=None) -> Iterator[Dict[str, Any]]:
+    """Yield every complete packet dict decoded from a stream of text chunks"""
+    decoder = decoder or EKDecoder()
+    for chunk in chunks:
+        yield from decoder.feed(chunk)
+    yield from decoder.close()
+
+
+class IngestQueue:
+    """Bounded queue between packet decoding and aggregation
+
+    When the queue is full the policy decides what happens to a new packet:
+    "block" waits for space (back-pressure onto tshark's pipe), "drop-newest"
+    rejects it, "drop-oldest" evicts the oldest queued packet, and "sample"
+    starts admitting only every `sample_rate`-th packet once the queue is past
+    its high-water mark, dropping the rest. Every dropped packet is counted.
+    """
+
+    POLICIES = ("block", "drop-newest", "drop-oldest", "sample")
+
+    def __init__(self, maxsize: int = 10000, policy: str = "block",
+                 sample_rate: int = 10, high_water: float = 0.5):
+        if policy not in self.POLICIES:
+            raise ValueError(f"Unknown drop policy: {policy}")
+        self.maxsize = maxsize
+        self.policy = policy
+        self.sample_rate = sample_rate
+        self.high_water = int(maxsize * high_water)
+        self.received = 0
+        self.enqueued = 0
+        self.dropped = 0
+        self.processed = 0
+        self._items = collections.deque()
+        self._condition = threading.Condition()
+        self._closed = False
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def put(self, item) -> bool:
+        """Offer a packet to the queue, returning False if it was dropped"""
+        with self._condition:
+            self.received += 1
+            items = self._items
+
+            if self.policy == "sample" and len(items) >= self.high_water:
+                if self.received % self.sample_rate:
+                    self.dropped += 1
+                    return False
+
+            if len(items) >= self.maxsize:
+                if self.policy == "block":
+                    while len(items) >= self.maxsize and not self._closed:
+                        self._condition.wait()
+                elif self.policy == "drop-oldest":
+                    items.popleft()
+                    self.dropped += 1
+                else:
+                    self.dropped += 1
+                    return False
+
+            items.append(item)
+            self.enqueued += 1
+            self._condition.notify_all()
+            return True
+
+    def get_batch(self, timeout: float = 0.5, max_batch: int = 1000) -> List[Any]:
+        """Wait up to `timeout` for a packet, then take whatever else is already queued"""
+        with self._condition:
+            if not self._items:
+                self._condition.wait(timeout)
+            items = self._items
+            count = min(len(items), max_batch)
+            batch = [items.popleft() for _ in range(count)]
+            self.processed += count
+            if count:
+                self._condition.notify_all()
+            return batch
+
+    def close(self):
+        """Release any producer blocked on a full queue"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "policy": self.policy,
+            "capacity": self.maxsize,
+            "received": self.received,
+            "enqueued": self.enqueued,
+            "dropped": self.dropped,
+            "processed": self.processed,
+            "pending": len(self._items)
+        }
+
+
+class DecodePool:
+    """Decode tshark output on a pool of worker processes
+
+    `worker` is a picklable function that takes a text chunk made of complete
+    lines and returns (records, errors). Chunks are decoded in parallel but
+    results come back in submission order, so per-source packet order is
+    preserved.
+    """
+
+    def __init__(self, worker: Callable[[str], Any], workers: Optional[int] = None):
+        self.worker = worker
+        self.workers = workers or os.cpu_count() or 1
+        # spawn avoids forking a process that already runs reader and server threads
+        self._pool = multiprocessing.get_context("spawn").Pool(self.workers)
+
+    def imap(self, chunks: Iterable[str]) -> Iterator[Any]:
+        return self._pool.imap(self.worker, chunks)
+
+    def close(self):
+        self._pool.terminate()
+        self._pool.join()
+
+
+class TsharkReader:
+    """Drain a tshark process's stdout and stderr on dedicated threads
+
+    Decoded packets are handed to the consumer through a bounded IngestQueue,
+    so a silent stderr can never stall stdout (or the other way round) and the
+    consumer only waits for packets to arrive. Pipes are read with os.read,
+    so the process should be started without text=True.
+    """
+
+    READ_SIZE = 65536
+
+    def __init__(self, process, decoder=None, maxsize: int = 10000, policy: str = "block",
+                 on_stderr: Optional[Callable[[str], None]] = None, pool: Optional[DecodePool] = None):
+        self.process = process
+        self.decoder = decoder or EKDecoder()
+        self.pool = pool
+        self.packets = IngestQueue(maxsize, policy)
+        self.on_stderr = on_stderr
+        self._stderr_lines = queue.Queue()
+        self._eof = threading.Event()
+        self._threads = []
+
+    def start(self):
+        for target, pipe in ((self._read_stdout, self.process.stdout),
+                             (self._read_stderr, self.process.stderr)):
+            if pipe is None:
+                continue
+            thread = threading.Thread(target=target, args=(pipe,), daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    @property
+    def finished(self) -> bool:
+        """True once tshark closed stdout and every packet has been taken"""
+        return self._eof.is_set() and not len(self.packets)
+
+    def get_batch(self, timeout: float = 0.5, max_batch: int = 1000) -> List[Any]:
+        """Wait up to `timeout` for a packet, then take whatever else is already queued"""
+        return self.packets.get_batch(timeout, max_batch)
+
+    def stop(self):
+        """Stop waiting on the consumer so the reader threads can exit"""
+        self.packets.close()
+
+    def stats(self) -> Dict[str, Any]:
+        stats = self.decoder.stats.as_dict()
+        stats["queue"] = self.packets.stats()
+        return stats
+
+    def stderr_lines(self) -> List[str]:
+        """Return the stderr lines received since the last call"""
+        lines = []
+        while True:
+            try:
+                lines.append(self._stderr_lines.get_nowait())
+            except queue.Empty:
+                return lines
+
+    def __iter__(self) -> Iterator[Any]:
+        while not self.finished:
+            yield from self.get_batch()
+
+    def join(self, timeout: Optional[float] = None):
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def _read_chunks(self, fd):
+        """Yield text chunks that end on a line boundary"""
+        text = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        stats = self.decoder.stats
+        partial = ""
+        while True:
+            data = os.read(fd, self.READ_SIZE)
+            if not data:
+                break
+            stats.bytes += len(data)
+            chunk = partial + text.decode(data)
+            end = chunk.rfind("\n") + 1
+            partial = chunk[end:]
+            if end:
+                yield chunk[:end]
+        partial += text.decode(b"", final=True)
+        if partial:
+            yield partial
+
+    def _read_stdout(self, pipe):
+        if self.pool is not None:
+            return self._read_stdout_pooled(pipe)
+
+        text = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        fd = pipe.fileno()
+        try:
+            while True:
+                data = os.read(fd, self.READ_SIZE)
+                if not data:
+                    break
+                for packet in self.decoder.feed(text.decode(data)):
+                    self.packets.put(packet)
+            for packet in self.decoder.feed(text.decode(b"", final=True)) + self.decoder.close():
+                self.packets.put(packet)
+        finally:
+            self._eof.set()
+            self.packets.close()
+
+    def _read_stdout_pooled(self, pipe):
+        stats = self.decoder.stats
+        try:
+            for records, errors in self.pool.imap(self._read_chunks(pipe.fileno())):
+                stats.packets += len(records)
+                stats.errors += errors
+                for record in records:
+                    self.packets.put(record)
+        finally:
+            self._eof.set()
+            self.packets.close()
+
+    def _read_stderr(self, pipe):
+        for raw_line in iter(pipe.readline, b""):
+            line = raw_line.decode("utf-8", errors="replace").rstrip()
+            if not line:
+                continue
+            self._stderr_lines.put(line)
+            if self.on_stderr:
+                self.on_stderr(line)
+
+
+def parse_replay_speed(pace) -> float:
+    """Map a replay pace ("realtime", "max" or an N× multiplier) to a speed factor, 0 meaning unpaced"""
+    if pace in (None, "max", "fast", 0, "0"):
+        return 0.0
+    if pace == "realtime":
+        return 1.0
+    speed = float(str(pace).rstrip("x×"))
+    if speed < 0:
+        raise ValueError(f"Invalid replay pace: {pace}")
+    return speed
+
+
+class ReplayPacer:
+    """Delay replayed packets so they follow their original capture timestamps"""
+
+    # Sleeping for less than this costs more than it is worth
+    MIN_SLEEP = 0.001
+
+    def __init__(self, speed: float = 1.0, sleep=time.sleep):
+        self.speed = speed
+        self._sleep = sleep
+        self._first_timestamp = None
+        self._started = 0.0
+
+    def delay(self, timestamp: float) -> float:
+        """Seconds until a packet captured at `timestamp` is due (0 if unpaced or not started)"""
+        if not self.speed or self._first_timestamp is None:
+            return 0.0
+        due = self._started + (timestamp - self._first_timestamp) / self.speed
+        return due - time.monotonic()
+
+    def wait(self, timestamp: float):
+        """Block until a packet captured at `timestamp` (epoch seconds) is due"""
+        if not self.speed:
+            return
+        if self._first_timestamp is None:
+            self._first_timestamp = timestamp
+            self._started = time.monotonic()
+            return
+
+        delay = self.delay(timestamp)
+        if delay >= self.MIN_SLEEP:
+            self._sleep(delay)
+
+    def batches(self, records: Iterable[Any], max_size: int = 1000) -> Iterator[List[Any]]:
+        """Pace records (timestamp first) and group them into batches of at most `max_size`
+
+        A batch is handed over before every sleep, so paced packets are never
+        held back while the replay waits for the next one.
+        """
+        batch = []
+        for record in records:
+            timestamp = float(record[0])
+            if batch and self.delay(timestamp) >= self.MIN_SLEEP:
+                yield batch
+                batch = []
+            self.wait(timestamp)
+            batch.append(record)
+            if len(batch) >= max_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch